@@ -0,0 +1,179 @@
+import json
+import mmap
+import struct
+
+from context import scripts
+import scripts.utils as utils
+import scripts.binary as binary
+
+# Declarations kept in a store's index, so they can be read without the rest of the tree
+INDEXED_KINDS = {
+    "NAMESPACE",
+    "STRUCT_DECL",
+    "CLASS_DECL",
+    "UNION_DECL",
+    "ENUM_DECL",
+    "CLASS_TEMPLATE",
+    "CLASS_TEMPLATE_PARTIAL_SPECIALIZATION",
+    "FUNCTION_DECL",
+    "FUNCTION_TEMPLATE",
+    "CXX_METHOD",
+    "CONSTRUCTOR",
+    "FIELD_DECL",
+    "VAR_DECL",
+    "TYPEDEF_DECL",
+    "TYPE_ALIAS_DECL",
+}
+
+# Index offset and length, then a marker: the last bytes of a store
+_footer = struct.Struct("<QQ4s")
+_FOOTER_MARKER = b"BIDX"
+
+
+def dump_store(filepath, info):
+    """
+    Writes parsed info as an AST store: the binary format, followed by an offset index.
+
+    - The index lists, in pre-order, every node of an `INDEXED_KINDS` kind as
+      [kind, name, offset of the node in the body, index of its nearest indexed ancestor or -1].
+    - A store is a valid binary format file, `binary.read_binary` reads it whole.
+    """
+
+    entries = []
+    # (depth, entry index) of the indexed nodes enclosing the current one
+    ancestors = []
+
+    def on_node(offset, node):
+        kind = node.get("kind")
+        if kind not in INDEXED_KINDS:
+            return
+
+        depth = node.get("depth", 0)
+        while ancestors and ancestors[-1][0] >= depth:
+            ancestors.pop()
+        entries.append(
+            [kind, node.get("name"), offset, ancestors[-1][1] if ancestors else -1]
+        )
+        ancestors.append((depth, len(entries) - 1))
+
+    encoder = binary.Encoder(on_node=on_node)
+    body = encoder.encode_body(info)
+    data = binary.MAGIC + encoder.encode_tables()
+    index_offset = len(data) + len(body)
+    index = json.dumps(entries, separators=(",", ":")).encode()
+
+    utils.write_if_changed(
+        filepath=filepath,
+        data=b"".join(
+            (data, body, index, _footer.pack(index_offset, len(index), _FOOTER_MARKER))
+        ),
+    )
+
+
+class AstStore:
+    """
+    Read-only, memory-mapped access to an AST store written by `dump_store`.
+
+    How to use:
+        - with AstStore(filepath) as store:
+            - store.find(kind="STRUCT_DECL", name="PointXYZ"): the matching subtrees
+            - store.extract(kind="STRUCT_DECL", name="PointXYZ"): a parsed_info holding only
+              those subtrees and the nodes enclosing them, for `generate.generate`
+            - store.read(): the whole parsed_info
+
+    - Only the header, the shape table and the index are read on opening, a subtree is decoded
+      from its offset, so the pages of the rest of the file are never touched.
+    - The file is mapped read-only: processes opening the same store share its page cache.
+    """
+
+    def __init__(self, filepath):
+        self._file = open(filepath, "rb")
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._decoder = binary.Decoder(self._buffer)
+
+        self._entries = []
+        self._lookup = {}  # (kind, name) -> entry indices, in pre-order
+        if len(self._buffer) >= _footer.size:
+            index_offset, index_length, marker = _footer.unpack_from(
+                self._buffer, len(self._buffer) - _footer.size
+            )
+            if marker == _FOOTER_MARKER:
+                self._entries = json.loads(
+                    self._buffer[index_offset : index_offset + index_length]
+                )
+        for entry_index, (kind, name, _, _) in enumerate(self._entries):
+            self._lookup.setdefault((kind, name), []).append(entry_index)
+
+    def close(self):
+        self._decoder.release()
+        self._decoder = None
+        self._buffer.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self):
+        """
+        Returns the whole parsed_info.
+        """
+
+        return self._decoder.read_node()
+
+    def entries(self, kind=None, name=None):
+        """
+        Returns the indices of the index entries with the given kind and/or name, in pre-order.
+        """
+
+        if kind is not None and name is not None:
+            return list(self._lookup.get((kind, name), []))
+
+        return [
+            entry_index
+            for entry_index, (entry_kind, entry_name, _, _) in enumerate(self._entries)
+            if (kind is None or entry_kind == kind)
+            and (name is None or entry_name == name)
+        ]
+
+    def find(self, kind=None, name=None):
+        """
+        Returns the subtrees of the indexed nodes with the given kind and/or name.
+        """
+
+        return [
+            self._decoder.read_node(offset=self._entries[entry_index][2])
+            for entry_index in self.entries(kind=kind, name=name)
+        ]
+
+    def extract(self, kind=None, name=None):
+        """
+        Returns a parsed_info with only the matching subtrees, under (shallow copies of) the root
+        and the indexed nodes enclosing them, e.g. their namespaces.
+        """
+
+        root = self._decoder.read_node(shallow=True)
+        nodes = {-1: root}  # entry index -> its node in the result
+        complete = set()  # entries whose whole subtree is in the result
+
+        for entry_index in self.entries(kind=kind, name=name):
+            chain = []
+            ancestor = entry_index
+            while ancestor not in nodes:
+                chain.append(ancestor)
+                ancestor = self._entries[ancestor][3]
+            if ancestor in complete or entry_index in complete:
+                continue  # Already in the result, inside an earlier match
+
+            parent = nodes[ancestor]
+            for ancestor in reversed(chain):
+                node = self._decoder.read_node(
+                    offset=self._entries[ancestor][2], shallow=ancestor != entry_index
+                )
+                parent["members"].append(node)
+                nodes[ancestor] = parent = node
+            complete.add(entry_index)
+
+        return root
@@ -0,0 +1,373 @@
+"""
+Compact binary format for parsed info, an alternative to indented JSON.
+
+Layout:
+    - MAGIC
+    - header length (uint32, little endian), then the header: JSON, with
+        - values: every distinct scalar (strings, numbers, booleans, null)
+        - word_size, table_words, body_words: the size of the words (1, 2 or 4 bytes) and the
+          number of words in the shape table and in the body
+    - shape table, in little endian unsigned words: count, then per shape: key count, the keys
+      (as indices in `values`), count of dict and list values, then per such value: key index, tag
+    - body, in words too: the root dict encoded as a node
+
+- Every scalar (keys, kinds, names, type spellings, tokens, numbers) is stored once, in the
+  header, and referred to by its index.
+- A node (dict) is: its shape id, one word per key in key order (the value's index, 0 for dicts
+  and lists), then its dicts and lists in key order. The shape (keys, in order, with the type of
+  each value) is shared by all dicts with the same layout, so key names aren't repeated per node.
+- Lists of dicts (`members`) and lists of scalars (`tokens`) are a count followed by the nodes or
+  the values' indices. Other lists are a count followed by, per item, its tag and its encoding.
+- Fixed size words are decoded in bulk: the body is cast to a list of ints at once, and a node's
+  values are looked up with a single `map`. Reading a file is faster than `json.load` of the
+  indented JSON, for a file about 20 times smaller.
+- Decoding gives back exactly the dict that was encoded, key order included.
+"""
+
+import gc
+import sys
+import json
+import array
+import struct
+
+from context import scripts
+import scripts.utils as utils
+
+MAGIC = b"BAST\x02"
+EXTENSION = ".bast"
+
+# Value tags. SCALARS is a list without dicts or lists, NODES a non empty list of dicts.
+VALUE, DICT, NODES, SCALARS, LIST = range(5)
+_NEXT_NODE = -1  # Decoder only
+
+# Word size -> `memoryview.cast` format
+_WORD_FORMATS = {1: "B", 2: "H", 4: "I"}
+
+_header_length = struct.Struct("<I")
+
+
+def _tag(value):
+    if isinstance(value, dict):
+        return DICT
+    if isinstance(value, list):
+        if value and all(isinstance(item, dict) for item in value):
+            return NODES
+        if all(not isinstance(item, (dict, list)) for item in value):
+            return SCALARS
+        return LIST
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return VALUE
+    raise TypeError(f"Can't encode {type(value).__name__}: {value!r}")
+
+
+class Encoder:
+    """
+    Encodes parsed info into the binary format.
+
+    How to use:
+        - data = Encoder().encode(parsed_info)
+        - `on_node(offset, node)`, if given, is called for every dict with its offset (in words)
+          in the body
+    """
+
+    def __init__(self, on_node=None):
+        # Index 0 is the placeholder of dicts and lists in a node's words
+        self._values = [None]
+        self._value_ids = {(type(None), None): 0}  # (type, value) -> id
+        self._shapes = {}  # shape (keys tuple, tags tuple) -> id
+        self._body_words = 0
+        self._word_size = 1
+        self._on_node = on_node
+
+    def _value_id(self, value):
+        # True == 1 == 1.0 and 0.0 == -0.0: the type (and a float's repr) tell them apart
+        key = (type(value), repr(value) if isinstance(value, float) else value)
+        value_id = self._value_ids.get(key)
+        if value_id is None:
+            value_id = self._value_ids[key] = len(self._values)
+            self._values.append(value)
+        return value_id
+
+    def _write_node(self, words, node, tasks):
+        if self._on_node:
+            self._on_node(len(words), node)
+
+        tags = tuple(_tag(value) for value in node.values())
+        shape = (tuple(node), tags)
+        shape_id = self._shapes.get(shape)
+        if shape_id is None:
+            shape_id = self._shapes[shape] = len(self._shapes)
+            for key in node:
+                self._value_id(key)
+
+        words.append(shape_id)
+        compounds = []
+        for value, tag in zip(node.values(), tags):
+            if tag == VALUE:
+                words.append(self._value_id(value))
+            else:
+                words.append(0)
+                compounds.append((tag, value))
+        tasks.extend(reversed(compounds))
+
+    def encode_body(self, root):
+        """
+        Returns the encoded body for a root dict, filling the header's tables.
+        """
+
+        words = []
+        # Explicit stack of (tag, value) still to be written, so deep trees don't recurse
+        tasks = [(DICT, root)]
+
+        while tasks:
+            tag, value = tasks.pop()
+            if tag == DICT:
+                self._write_node(words, value, tasks)
+            elif tag == NODES:
+                words.append(len(value))
+                tasks.extend((DICT, item) for item in reversed(value))
+            elif tag == SCALARS:
+                words.append(len(value))
+                words.extend(self._value_id(item) for item in value)
+            elif tag == LIST:
+                words.append(len(value))
+                for item in reversed(value):
+                    item_tag = _tag(item)
+                    tasks.append((item_tag, item))
+                    tasks.append((None, item_tag))
+            elif tag is None:
+                # The tag of an item in a generic list
+                words.append(value)
+            else:
+                words.append(self._value_id(value))
+
+        # Words in the shape table are below the number of values too
+        largest = max(max(words, default=0), len(self._values), len(self._shapes))
+        self._word_size = next(
+            size for size in _WORD_FORMATS if largest < 1 << 8 * size
+        )
+        self._body_words = len(words)
+        return self._pack(words)
+
+    def _pack(self, words):
+        words = array.array(_WORD_FORMATS[self._word_size], words)
+        if sys.byteorder != "little":
+            words.byteswap()
+        return words.tobytes()
+
+    def encode_tables(self):
+        """
+        Returns the encoded header and shape table, after `encode_body`.
+        """
+
+        table = [len(self._shapes)]
+        for keys, tags in self._shapes:
+            table.append(len(keys))
+            table.extend(self._value_id(key) for key in keys)
+            compounds = [(index, tag) for index, tag in enumerate(tags) if tag != VALUE]
+            table.append(len(compounds))
+            for compound in compounds:
+                table.extend(compound)
+
+        header = json.dumps(
+            {
+                "values": self._values,
+                "word_size": self._word_size,
+                "table_words": len(table),
+                "body_words": self._body_words,
+            },
+            separators=(",", ":"),
+        ).encode()
+        return _header_length.pack(len(header)) + header + self._pack(table)
+
+    def encode(self, root):
+        """
+        Returns the complete encoding (magic, header, body) of a root dict.
+        """
+
+        body = self.encode_body(root)
+        return bytes(MAGIC + self.encode_tables() + body)
+
+
+class Decoder:
+    """
+    Decodes the binary format, from any buffer (bytes, mmap, memoryview).
+
+    How to use:
+        - parsed_info = Decoder(data).decode()
+        - Decoder(data).read_node(offset) decodes just the dict at an offset in the body
+
+    - The body is only read by `read_node`: a subtree is decoded without touching the rest.
+    - The decoder holds a view of the buffer, `release` it before closing an mmap.
+    """
+
+    def __init__(self, buffer, offset=0):
+        """
+        Parameters:
+            - buffer: The encoded data
+            - offset: Where the encoding (the magic) starts in the buffer
+        """
+
+        if bytes(buffer[offset : offset + len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a binary parsed info file")
+        offset += len(MAGIC)
+
+        (length,) = _header_length.unpack_from(buffer, offset)
+        offset += _header_length.size
+        header = json.loads(bytes(buffer[offset : offset + length]))
+        offset += length
+
+        self._values = header["values"]
+
+        # The shape table and the body, as one view of words
+        word_size = header["word_size"]
+        words = header["table_words"] + header["body_words"]
+        self._view = memoryview(buffer)[offset : offset + words * word_size].cast(
+            _WORD_FORMATS[word_size]
+        )
+        if sys.byteorder != "little" and word_size > 1:
+            words = array.array(self._view.format, self._view.tobytes())
+            words.byteswap()
+            self._view = memoryview(words)
+
+        table = self._view[: header["table_words"]].tolist()
+        self._shapes = []
+        position = 1
+        for _ in range(table[0]):
+            count = table[position]
+            keys = [
+                self._values[key_id]
+                for key_id in table[position + 1 : position + 1 + count]
+            ]
+            position += 1 + count
+            compounds = []
+            for _ in range(table[position]):
+                compounds.append((keys[table[position + 1]], table[position + 2]))
+                position += 2
+            position += 1
+            # Lists of scalars before any other dict or list are read along with the node,
+            # the others are reversed, so pushing them on the stack pops them in key order
+            inline = 0
+            while inline < len(compounds) and compounds[inline][1] == SCALARS:
+                inline += 1
+            inline_keys = [key for key, _ in compounds[:inline]]
+            self._shapes.append((keys, count, inline_keys, compounds[inline:][::-1]))
+
+        # Node offsets (e.g. from `Encoder`'s `on_node`) are relative to the body
+        self.body_offset = header["table_words"]
+
+    def release(self):
+        """
+        Releases the view of the buffer.
+        """
+
+        self._view.release()
+
+    def read_node(self, offset=0, shallow=False):
+        """
+        Returns the dict encoded at an offset in the body (the root by default).
+
+        - shallow: Only read the node's own values, its lists and dicts (e.g. `members`) are
+          left empty. The rest of the subtree isn't touched.
+        """
+
+        # The tree has no reference cycles: collections triggered by its many dicts are wasted
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._read_node(offset=offset, shallow=shallow)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _read_node(self, offset, shallow):
+        # The whole body at once is much faster to index than the view
+        words = self._view.tolist() if offset == 0 and not shallow else self._view
+        offset += self.body_offset
+        values = self._values
+        get_value = values.__getitem__
+        shapes = self._shapes
+
+        holder = [None]
+        # Explicit stack of (container, slot, tag) still to be read, so deep trees don't recurse.
+        # A (list, count, _NEXT_NODE) entry reads the next of the list's `count` remaining nodes.
+        tasks = [(holder, 0, DICT)]
+        pop = tasks.pop
+        push = tasks.append
+
+        while tasks:
+            container, slot, tag = pop()
+
+            if tag is None:
+                # An item of a generic list: its tag comes first
+                tag = words[offset]
+                offset += 1
+
+            if tag == DICT or tag == _NEXT_NODE:
+                if tag == _NEXT_NODE and slot > 1:
+                    push((container, slot - 1, _NEXT_NODE))
+                keys, count, inline_keys, compounds = shapes[words[offset]]
+                end = offset + 1 + count
+                # Dicts and lists get the placeholder value, replaced once they are read
+                node = dict(zip(keys, map(get_value, words[offset + 1 : end])))
+                offset = end
+                if shallow:
+                    for key in inline_keys:
+                        node[key] = []
+                    for key, key_tag in compounds:
+                        node[key] = {} if key_tag == DICT else []
+                else:
+                    for key in inline_keys:
+                        end = offset + 1 + words[offset]
+                        node[key] = list(map(get_value, words[offset + 1 : end]))
+                        offset = end
+                    for key, key_tag in compounds:
+                        push((node, key, key_tag))
+                if tag == DICT:
+                    container[slot] = node
+                else:
+                    container.append(node)
+            elif tag == NODES:
+                items = []
+                push((items, words[offset], _NEXT_NODE))
+                offset += 1
+                container[slot] = items
+            elif tag == SCALARS:
+                end = offset + 1 + words[offset]
+                container[slot] = list(map(get_value, words[offset + 1 : end]))
+                offset = end
+            elif tag == LIST:
+                count = words[offset]
+                offset += 1
+                items = [None] * count
+                tasks.extend((items, index, None) for index in reversed(range(count)))
+                container[slot] = items
+            else:
+                container[slot] = values[words[offset]]
+                offset += 1
+
+        return holder[0]
+
+    def decode(self):
+        """
+        Returns the root dict.
+        """
+
+        return self.read_node()
+
+
+def dumps(info):
+    return Encoder().encode(info)
+
+
+def loads(data):
+    return Decoder(data).decode()
+
+
+def dump_binary(filepath, info):
+    utils.write_if_changed(filepath=filepath, data=dumps(info))
+
+
+def read_binary(filename):
+    with open(filename, "rb") as f:
+        return loads(f.read())
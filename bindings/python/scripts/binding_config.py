@@ -0,0 +1,98 @@
+from context import scripts
+import scripts.utils as utils
+
+
+class BindingConfig:
+    """
+    Per-function options for the generated bindings, read from a JSON file.
+
+    How to use:
+        - config = BindingConfig.load(config_path)
+        - config.release_gil(qualified_name="pcl::filter", default=False)
+
+    File format:
+        {
+            "functions": {
+                "pcl::filter": {"release_gil": true},
+                "pcl::PointXYZ::getVector3fMap": {"release_gil": false},
+                "pcl::PointCloud::at": {"return_value_policy": "copy"},
+                "compute": {"release_gil": true}
+            }
+        }
+
+    - Functions and methods are keyed by qualified name (`namespace::class::name`), or by bare
+      name for every function with that name. Options of the qualified name take precedence.
+    - Options:
+        - release_gil (bool): Release the GIL while the C++ function runs
+          (`py::call_guard<py::gil_scoped_release>`), so other Python threads run meanwhile.
+          The function must not touch Python objects.
+        - return_value_policy (str): The `py::return_value_policy` of the returned value, one of
+          `RETURN_VALUE_POLICIES`, instead of the generator's choice
+    """
+
+    OPTIONS = {"release_gil": bool, "return_value_policy": str}
+    RETURN_VALUE_POLICIES = {
+        "automatic",
+        "automatic_reference",
+        "take_ownership",
+        "copy",
+        "move",
+        "reference",
+        "reference_internal",
+    }
+
+    def __init__(self, functions: dict = None) -> None:
+        """
+        Parameters:
+            - functions (dict): name -> options, as in the file's `functions`
+        """
+
+        self.functions = functions or {}
+        for name, options in self.functions.items():
+            for option, value in options.items():
+                if option not in self.OPTIONS:
+                    raise ValueError(f"Unknown binding option for {name}: {option}")
+                if not isinstance(value, self.OPTIONS[option]):
+                    raise ValueError(
+                        f"Binding option {option} of {name} must be a {self.OPTIONS[option].__name__}"
+                    )
+            policy = options.get("return_value_policy")
+            if policy is not None and policy not in self.RETURN_VALUE_POLICIES:
+                raise ValueError(f"Unknown return value policy for {name}: {policy}")
+
+    @classmethod
+    def load(cls, config_path: str = None) -> "BindingConfig":
+        """
+        Returns the configuration in a JSON file, or an empty configuration without a file.
+        """
+
+        if not config_path:
+            return cls()
+        return cls(functions=utils.read_json(filename=config_path).get("functions"))
+
+    def options(self, qualified_name: str) -> dict:
+        """
+        Returns the options of a function: those of its bare name, updated with those of its qualified name.
+        """
+
+        options = dict(self.functions.get(qualified_name.rsplit("::", 1)[-1], {}))
+        options.update(self.functions.get(qualified_name, {}))
+        return options
+
+    def release_gil(self, qualified_name: str, default: bool = False) -> bool:
+        """
+        Checks if a function's binding releases the GIL, `default` if the configuration doesn't say.
+        """
+
+        return self.options(qualified_name=qualified_name).get("release_gil", default)
+
+    def return_value_policy(
+        self, qualified_name: str, default: str = None
+    ) -> str or None:
+        """
+        Returns the return value policy of a function's binding, `default` if the configuration doesn't say.
+        """
+
+        return self.options(qualified_name=qualified_name).get(
+            "return_value_policy", default
+        )
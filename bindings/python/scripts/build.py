@@ -0,0 +1,474 @@
+"""
+Incremental build driver for the pipeline: source (+ includes) -> JSON -> pybind11 `.cpp` -> object.
+
+- Every artifact is a node of the graph, with a fingerprint of its inputs stored in a state file.
+  A node is rerun only if its fingerprint changed or its output is missing.
+- A node's fingerprint covers the contents of its input artifacts, not their timestamps: if a
+  header change leaves a source's JSON unchanged, the source's binding isn't regenerated and
+  its object isn't recompiled.
+- The nodes of each stage run in parallel (`jobs`), a stage starts once its inputs are built.
+"""
+
+import os
+import sys
+import json
+import shlex
+import types
+import hashlib
+import sysconfig
+import functools
+import subprocess
+
+from context import scripts
+import scripts.utils as utils
+import scripts.parse as parse
+import scripts.generate as generate
+from scripts.binding_config import BindingConfig
+from scripts.cache import get_libclang_version
+from scripts.compilation_database import CompilationDatabase
+
+
+class Fingerprints:
+    """
+    Stored fingerprints of the built nodes.
+
+    How to use:
+        - fingerprints = Fingerprints(state_path)
+        - fingerprints.stale(node, fingerprint, output), fingerprints.record(node, fingerprint)
+        - fingerprints.save()
+    """
+
+    def __init__(self, state_path: str) -> None:
+        self.state_path = state_path
+        self._digests = utils.FileDigests()  # avoids rehashing in a run
+        try:
+            with open(state_path, "r") as f:
+                self._state = json.load(f)
+        except (OSError, ValueError):
+            self._state = {}
+
+    def save(self) -> None:
+        utils.ensure_dir_exists(os.path.dirname(self.state_path) or ".")
+        utils.write_atomic(
+            filepath=self.state_path,
+            data=json.dumps(self._state, indent=2, sort_keys=True).encode(),
+        )
+
+    def file_digest(self, filepath: str) -> str or None:
+        """
+        Returns the sha256 of a file's contents, or None if the file doesn't exist.
+        """
+
+        return self._digests.get(filepath)
+
+    @staticmethod
+    def fingerprint(*inputs) -> str:
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+    def get(self, node: str) -> dict:
+        return self._state.get(node, {})
+
+    def stale(self, node: str, fingerprint: str, output: str) -> bool:
+        return self.get(node).get("fingerprint") != fingerprint or not os.path.exists(
+            output
+        )
+
+    def record(self, node: str, fingerprint: str, **details) -> None:
+        self._state[node] = dict(details, fingerprint=fingerprint)
+
+
+def parse_node(source, compilation_database_path, json_output_path, parse_options):
+    """
+    Parses a source to its JSON output, returns the realpaths of the files it includes
+
+    - Task function for `utils.parallel_map`, hence module level (picklable)
+    """
+
+    translation_unit = parse.parse_translation_unit(
+        source=source,
+        compilation_commands=parse.get_compilation_commands(
+            compilation_database_path=compilation_database_path, filename=source
+        ),
+        index=parse._worker_index,
+        skip_function_bodies=parse_options["skip_function_bodies"],
+        preprocessing=parse_options["preprocessing"],
+    )
+    parse.dump_parsed_info(
+        source=source,
+        parsed_info=parse.get_translation_unit_info(
+            translation_unit=translation_unit,
+            tokens=parse_options["tokens"],
+            fields=parse_options["fields"],
+            skip_function_bodies=parse_options["skip_function_bodies"],
+        ),
+        json_output_path=json_output_path,
+    )
+    return sorted(
+        {
+            utils.get_realpath(path=inclusion.include.name)
+            for inclusion in translation_unit.get_includes()
+        }
+    )
+
+
+def generate_node(json_path, cpp_path, config_path=None):
+    """
+    Generates the binding file for a JSON output, returns the vector types it makes opaque
+
+    - Task function for `utils.parallel_map`, hence module level (picklable)
+    """
+
+    opaque_types = []
+    utils.write_to_file(
+        filename=cpp_path,
+        linelist=generate.generate(
+            module_name="pcl",
+            source=json_path,
+            config=BindingConfig.load(config_path=config_path),
+            opaque_types=opaque_types,
+        ),
+    )
+    return opaque_types
+
+
+def compile_node(command):
+    """
+    Compiles a binding file to an object, raising with the compiler's output on failure
+
+    - Task function for `utils.parallel_map`, hence module level (picklable)
+    """
+
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        raise RuntimeError(result.stdout.decode(errors="replace"))
+
+
+def get_generator_files() -> list:
+    """
+    Returns the files of the generator's code: `generate.py` and the modules of this package it
+    imports, directly or not, e.g. `binding_config.py`, `binary.py`, `ast_store.py`.
+    """
+
+    files = set()
+    stack = [generate]
+    while stack:
+        module = stack.pop()
+        if module.__file__ in files:
+            continue
+        files.add(module.__file__)
+
+        for value in vars(module).values():
+            dependency = (
+                value
+                if isinstance(value, types.ModuleType)
+                else sys.modules.get(getattr(value, "__module__", None) or "")
+            )
+            if (
+                dependency is not None
+                and dependency.__name__.startswith("scripts.")
+                and getattr(dependency, "__file__", None)
+            ):
+                stack.append(dependency)
+
+    return sorted(files)
+
+
+def get_compile_flags(arguments: list) -> list:
+    """
+    Returns the flags to compile a binding with: the source's preprocessor and language flags
+    (from the compilation database), pybind11's and Python's include directories.
+    """
+
+    flags = ["-fPIC"]
+    take_next = False
+    for argument in arguments:
+        if take_next:
+            flags.append(argument)
+            take_next = False
+        elif argument in ("-I", "-isystem", "-D", "-include"):
+            flags.append(argument)
+            take_next = True
+        elif argument.startswith(("-I", "-isystem", "-D", "-std=")):
+            flags.append(argument)
+
+    try:
+        import pybind11
+
+        flags.append(f"-I{pybind11.get_include()}")
+    except ImportError:
+        # Expected on the include path already, e.g. through `compile_flags`
+        pass
+    flags.append(f"-I{sysconfig.get_paths()['include']}")
+
+    return flags
+
+
+class Builder:
+    """
+    Builds the JSON outputs, the bindings and their objects for sources, rerunning only stale nodes.
+
+    How to use:
+        - summary = Builder(sources, compilation_database_path, ...).build()
+    """
+
+    def __init__(
+        self,
+        sources: list,
+        compilation_database_path: str,
+        json_output_path: str,
+        pybind11_output_path: str,
+        state_path: str = None,
+        jobs: int = 1,
+        compiler: str = "c++",
+        compile_flags: list = (),
+        skip_compile: bool = False,
+        tokens: bool = True,
+        fields="full",
+        skip_function_bodies: bool = False,
+        preprocessing: bool = True,
+        config_path: str = None,
+    ) -> None:
+        """
+        Parameters:
+            - sources (list): The sources to build, all the files of the compilation database if empty
+            - state_path (str): The fingerprints file, `.build_state.json` under `json_output_path` by default
+            - jobs (int): Nodes of a stage to run at a time
+            - compiler (str), compile_flags (list): The command to compile the bindings with, see `get_compile_flags`
+            - skip_compile (bool): Stop at the bindings
+            - tokens, fields, skip_function_bodies, preprocessing: See `parse.parse_file`
+            - config_path (str): A `BindingConfig` file for the generated bindings
+        """
+
+        self.compilation_database_path = compilation_database_path
+        self.compilation_database = CompilationDatabase.load(
+            compilation_database_path=compilation_database_path
+        )
+        self.sources = [
+            utils.get_realpath(path=source) for source in sources
+        ] or self.compilation_database.files()
+        self.json_output_path = json_output_path
+        self.pybind11_output_path = pybind11_output_path
+        self.jobs = jobs
+        self.compiler = compiler
+        self.compile_flags = list(compile_flags)
+        self.skip_compile = skip_compile
+        self.config_path = config_path
+        self.parse_options = {
+            "tokens": tokens,
+            "fields": fields,
+            "skip_function_bodies": skip_function_bodies,
+            "preprocessing": preprocessing,
+        }
+        self.fingerprints = Fingerprints(
+            state_path=state_path
+            or utils.join_path(json_output_path, ".build_state.json")
+        )
+
+    def _run(self, stage: str, tasks: dict, function, summary: dict) -> dict:
+        """
+        Runs a stage's stale nodes in parallel.
+
+        Parameters:
+            - tasks (dict): source -> keyword arguments for `function`
+
+        Returns:
+            - results (dict): source -> `function`'s result, for the nodes which succeeded
+        """
+
+        results = {}
+        for source, result, error in utils.parallel_map(
+            function=functools.partial(_run_task, function=function, tasks=tasks),
+            items=list(tasks),
+            jobs=self.jobs,
+            initializer=parse.init_worker if stage == "parse" else None,
+        ):
+            if error:
+                summary["failed"].append(source)
+                print(f"Failed to {stage} {source}: {error}", file=sys.stderr)
+                continue
+
+            results[source] = result
+            summary[stage].append(source)
+
+        return results
+
+    def build(self) -> dict:
+        """
+        Brings every output up to date.
+
+        Returns:
+            - summary (dict): The sources whose nodes were rerun per stage (`parse`, `generate`,
+              `compile`), and the `failed` ones
+        """
+
+        summary = {"parse": [], "generate": [], "compile": [], "failed": []}
+        fingerprints = self.fingerprints
+        version = get_libclang_version()
+
+        def parse_fingerprint(source, arguments, source_digest, includes):
+            return fingerprints.fingerprint(
+                version,
+                arguments,
+                self.parse_options,
+                source_digest,
+                [(include, fingerprints.file_digest(include)) for include in includes],
+            )
+
+        # Stage 1: source (+ includes) -> JSON
+        json_paths = {}
+        tasks = {}
+        inputs = {}  # source -> (arguments, source digest) taken before parsing
+        for source in self.sources:
+            json_paths[source] = parse.get_json_output_path(
+                source=source, json_output_path=self.json_output_path
+            )
+            arguments = self.compilation_database.get_arguments(filename=source)
+            source_digest = fingerprints.file_digest(source)
+            fingerprint = parse_fingerprint(
+                source,
+                arguments,
+                source_digest,
+                fingerprints.get(f"parse:{source}").get("includes", []),
+            )
+            if fingerprints.stale(f"parse:{source}", fingerprint, json_paths[source]):
+                inputs[source] = (arguments, source_digest)
+                tasks[source] = dict(
+                    source=source,
+                    compilation_database_path=self.compilation_database_path,
+                    json_output_path=self.json_output_path,
+                    parse_options=self.parse_options,
+                )
+
+        parsed = self._run(
+            stage="parse", tasks=tasks, function=parse_node, summary=summary
+        )
+        for source, includes in parsed.items():
+            arguments, source_digest = inputs[source]
+            fingerprints.record(
+                f"parse:{source}",
+                parse_fingerprint(source, arguments, source_digest, includes),
+                includes=includes,
+            )
+        fingerprints.save()
+
+        # Stage 2: JSON -> pybind11 `.cpp`, the generator's code and configuration are inputs too
+        generator_digest = fingerprints.fingerprint(
+            [
+                (filepath, fingerprints.file_digest(filepath))
+                for filepath in get_generator_files()
+            ]
+        )
+        config_digest = self.config_path and fingerprints.file_digest(self.config_path)
+        cpp_paths = {}
+        tasks = {}
+        stale = {}  # source -> fingerprint
+        for source in self.sources:
+            if source in summary["failed"]:
+                continue
+            cpp_paths[source] = generate.get_cpp_output_path(
+                source=json_paths[source],
+                pybind11_output_path=self.pybind11_output_path,
+            )
+            fingerprint = fingerprints.fingerprint(
+                generator_digest,
+                config_digest,
+                fingerprints.file_digest(json_paths[source]),
+            )
+            if fingerprints.stale(f"generate:{source}", fingerprint, cpp_paths[source]):
+                stale[source] = fingerprint
+                tasks[source] = dict(
+                    json_path=json_paths[source],
+                    cpp_path=cpp_paths[source],
+                    config_path=self.config_path,
+                )
+
+        generated = self._run(
+            stage="generate", tasks=tasks, function=generate_node, summary=summary
+        )
+        for source, opaque_types in generated.items():
+            fingerprints.record(
+                f"generate:{source}", stale[source], opaque_types=opaque_types
+            )
+        fingerprints.save()
+
+        # Every binding file includes the opaque types of all the files
+        opaque_header_path = generate.update_opaque_header(
+            pybind11_output_path=self.pybind11_output_path,
+            opaque_types={
+                cpp_paths[source]: fingerprints.get(f"generate:{source}").get(
+                    "opaque_types", []
+                )
+                for source in self.sources
+                if source not in summary["failed"]
+            },
+        )
+
+        if self.skip_compile:
+            return summary
+
+        # Stage 3: pybind11 `.cpp` -> object
+        tasks = {}
+        stale = {}
+        for source in self.sources:
+            if source in summary["failed"]:
+                continue
+            object_path = f"{os.path.splitext(cpp_paths[source])[0]}.o"
+            command = (
+                [self.compiler]
+                + get_compile_flags(
+                    self.compilation_database.get_arguments(filename=source)
+                )
+                + [f"-I{os.path.dirname(opaque_header_path)}"]
+                + self.compile_flags
+                + ["-c", cpp_paths[source], "-o", object_path]
+            )
+            fingerprint = fingerprints.fingerprint(
+                command,
+                fingerprints.file_digest(cpp_paths[source]),
+                fingerprints.file_digest(opaque_header_path),
+            )
+            if fingerprints.stale(f"compile:{source}", fingerprint, object_path):
+                stale[source] = fingerprint
+                tasks[source] = dict(command=command)
+
+        compiled = self._run(
+            stage="compile", tasks=tasks, function=compile_node, summary=summary
+        )
+        for source in compiled:
+            fingerprints.record(f"compile:{source}", stale[source])
+        fingerprints.save()
+
+        return summary
+
+
+def _run_task(source, function, tasks):
+    return function(**tasks[source])
+
+
+def main():
+    args = utils.parse_arguments(script="build")
+
+    summary = Builder(
+        sources=args.files,
+        compilation_database_path=args.compilation_database_path,
+        json_output_path=args.json_output_path,
+        pybind11_output_path=args.pybind11_output_path,
+        state_path=args.state_path,
+        jobs=args.jobs,
+        compiler=args.compiler,
+        compile_flags=shlex.split(args.compile_flags),
+        skip_compile=args.skip_compile,
+        tokens=not args.no_tokens,
+        fields=args.fields,
+        skip_function_bodies=args.skip_function_bodies,
+        config_path=args.config,
+    ).build()
+
+    for stage in ("parse", "generate", "compile"):
+        print(f"{stage}: {len(summary[stage])} rerun")
+    if summary["failed"]:
+        sys.exit(f"{len(summary['failed'])} failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import ctypes
+import hashlib
+import clang.cindex as clang
+
+from context import scripts
+import scripts.utils as utils
+
+
+class _CXString(ctypes.Structure):
+    _fields_ = [("data", ctypes.c_void_p), ("private_flags", ctypes.c_uint)]
+
+
+def get_libclang_version():
+    """
+    Returns the version string of the loaded libclang, e.g. "clang version 11.0.0"
+
+    - Uses functions of its own from the library (indexing a `CDLL` doesn't cache them), so the
+      prototypes the bindings set on `clang.conf.lib`'s functions are left alone.
+    """
+
+    lib = clang.conf.lib
+    get_version = lib["clang_getClangVersion"]
+    get_version.restype = _CXString
+    get_version.argtypes = []
+    get_string = lib["clang_getCString"]
+    get_string.restype = ctypes.c_char_p
+    get_string.argtypes = [_CXString]
+    dispose_string = lib["clang_disposeString"]
+    dispose_string.restype = None
+    dispose_string.argtypes = [_CXString]
+
+    version = get_version()
+    try:
+        return (get_string(version) or b"").decode()
+    finally:
+        dispose_string(version)
+
+
+class ParseCache:
+    """
+    Content-addressed on-disk cache of `parse_file` results.
+
+    How to use:
+        - cache = ParseCache(cache_path, max_size=..., max_age=...)
+        - parsed_info = cache.get(source, arguments)
+        - cache.put(source, arguments, includes, parsed_info) on a miss
+        - cache.prune() once the run is over
+
+    - Entries are keyed by the source's path and contents, the compiler arguments, the libclang
+      version and the contents of every file the source includes (transitively).
+    - The included files are only known after parsing, so lookups go through a manifest
+      (keyed without the includes) listing the includes recorded when the entry was stored.
+      Hashing those files' current contents then gives the entry's key, without calling libclang.
+    """
+
+    def __init__(self, cache_path: str, max_size: int = None, max_age: float = None):
+        """
+        Parameters:
+            - cache_path (str): Directory to keep the cache in
+            - max_size (int): Maximum total size of the entries, in bytes
+            - max_age (float): Maximum time since an entry was last used, in seconds
+        """
+
+        self.cache_path = cache_path
+        self.max_size = max_size
+        self.max_age = max_age
+        self._manifest_dir = utils.join_path(cache_path, "manifests")
+        self._entry_dir = utils.join_path(cache_path, "entries")
+        self._digests = utils.FileDigests()  # avoids rehashing in a run
+        self._version = get_libclang_version()
+
+        utils.ensure_dir_exists(self._manifest_dir)
+        utils.ensure_dir_exists(self._entry_dir)
+
+    def file_digest(self, filepath: str) -> str or None:
+        """
+        Returns the sha256 of a file's contents, or None if the file doesn't exist.
+        """
+
+        return self._digests.get(filepath)
+
+    def manifest_key(self, source: str, arguments: list, options: dict = None) -> str:
+        """
+        Returns the key of a source's manifest: everything but the included files.
+
+        Parameters:
+            - source (str): The source's realpath
+            - arguments (list): The compiler arguments
+            - options (dict): Any parse options affecting the output
+        """
+
+        key = json.dumps(
+            [
+                self._version,
+                source,
+                self.file_digest(source),
+                list(arguments),
+                options or {},
+            ],
+            sort_keys=True,
+        )
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def entry_key(self, manifest_key: str, includes: list) -> str or None:
+        """
+        Returns the key of an entry, or None if an included file no longer exists.
+        """
+
+        hasher = hashlib.sha256(manifest_key.encode())
+        for include in includes:
+            digest = self.file_digest(include)
+            if digest is None:
+                return None
+            hasher.update(f"\0{include}\0{digest}".encode())
+        return hasher.hexdigest()
+
+    def lookup(self, source: str, arguments: list, options: dict = None) -> str or None:
+        """
+        Returns the path of the entry for a source if it is up to date, or None on a miss.
+
+        - Marks the entry as recently used, for eviction.
+        """
+
+        manifest_key = self.manifest_key(source, arguments, options)
+        manifest_path = utils.join_path(self._manifest_dir, manifest_key)
+
+        try:
+            with open(manifest_path, "r") as f:
+                includes = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        entry_key = self.entry_key(manifest_key=manifest_key, includes=includes)
+        if entry_key is None:
+            return None
+        entry_path = utils.join_path(self._entry_dir, entry_key)
+
+        try:
+            os.utime(entry_path)
+        except OSError:
+            return None
+        os.utime(manifest_path)
+
+        return entry_path
+
+    def store(
+        self,
+        source: str,
+        arguments: list,
+        includes: list,
+        write_entry,
+        options: dict = None,
+    ) -> None:
+        """
+        Stores an entry for a source.
+
+        Parameters:
+            - includes (list): Paths of all the files the source includes, directly or not
+            - write_entry: Called with the entry's path to write the entry (atomically)
+        """
+
+        includes = sorted(set(includes))
+        manifest_key = self.manifest_key(source, arguments, options)
+        entry_key = self.entry_key(manifest_key=manifest_key, includes=includes)
+        if entry_key is None:
+            return
+
+        write_entry(utils.join_path(self._entry_dir, entry_key))
+        utils.write_atomic(
+            filepath=utils.join_path(self._manifest_dir, manifest_key),
+            data=json.dumps(includes).encode(),
+        )
+
+    def get(self, source: str, arguments: list, options: dict = None) -> dict or None:
+        """
+        Returns the cached parsed_info for a source, or None on a miss.
+        """
+
+        entry_path = self.lookup(source, arguments, options)
+        if entry_path is None:
+            return None
+
+        try:
+            with open(entry_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(
+        self,
+        source: str,
+        arguments: list,
+        includes: list,
+        parsed_info: dict,
+        options: dict = None,
+    ) -> None:
+        """
+        Stores the parsed_info for a source.
+
+        Parameters:
+            - includes (list): Paths of all the files the source includes, directly or not
+        """
+
+        data = json.dumps(parsed_info, separators=(",", ":")).encode()
+        self.store(
+            source=source,
+            arguments=arguments,
+            includes=includes,
+            write_entry=lambda entry_path: utils.write_atomic(entry_path, data),
+            options=options,
+        )
+
+    def put_file(
+        self,
+        source: str,
+        arguments: list,
+        includes: list,
+        filepath: str,
+        options: dict = None,
+    ) -> None:
+        """
+        Stores the parsed_info for a source from a JSON file, e.g. one streamed by `parse_file`.
+        """
+
+        def write_entry(entry_path):
+            with open(filepath, "rb") as f:
+                utils.write_atomic(entry_path, f.read())
+
+        self.store(
+            source=source,
+            arguments=arguments,
+            includes=includes,
+            write_entry=write_entry,
+            options=options,
+        )
+
+    def prune(self) -> None:
+        """
+        Evicts entries not used within `max_age`, then the least recently used ones until
+        the total size is within `max_size`.
+        """
+
+        entries = []
+        for name in os.listdir(self._entry_dir):
+            path = utils.join_path(self._entry_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        # Most recently used first
+        entries.sort(reverse=True)
+        now = time.time()
+        total_size = 0
+        for mtime, size, path in entries:
+            total_size += size
+            expired = self.max_age is not None and now - mtime > self.max_age
+            oversized = self.max_size is not None and total_size > self.max_size
+            if expired or oversized:
+                total_size -= size
+                os.remove(path)
+
+        # Manifests pointing to evicted entries just miss, drop the stale ones by age too
+        if self.max_age is not None:
+            for name in os.listdir(self._manifest_dir):
+                path = utils.join_path(self._manifest_dir, name)
+                if now - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+
+
+class AstCache(ParseCache):
+    """
+    On-disk cache of serialized TranslationUnits (`.ast` files).
+
+    How to use:
+        - ast_cache = AstCache(cache_path)
+        - translation_unit = ast_cache.get(source, arguments, index)
+        - ast_cache.put(source, arguments, translation_unit) on a miss
+
+    - Loading a saved TU with `TranslationUnit.from_ast_file` is much faster than reparsing.
+    - Staleness is checked like `ParseCache`: an entry is only used while the source, the
+      arguments, the libclang version and the contents of every included file are unchanged.
+    """
+
+    def get(
+        self, source: str, arguments: list, index=None, options: dict = None
+    ) -> clang.TranslationUnit or None:
+        """
+        Returns the cached TranslationUnit for a source, or None on a miss.
+        """
+
+        entry_path = self.lookup(source, arguments, options)
+        if entry_path is None:
+            return None
+
+        try:
+            return clang.TranslationUnit.from_ast_file(filename=entry_path, index=index)
+        except clang.TranslationUnitLoadError:
+            return None
+
+    def put(
+        self,
+        source: str,
+        arguments: list,
+        translation_unit: clang.TranslationUnit,
+        options: dict = None,
+    ) -> None:
+        """
+        Saves the TranslationUnit for a source.
+        """
+
+        def write_entry(entry_path):
+            tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+            try:
+                translation_unit.save(tmp_path)
+                os.replace(tmp_path, entry_path)
+            except clang.TranslationUnitSaveError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        self.store(
+            source=source,
+            arguments=arguments,
+            includes=[
+                inclusion.include.name for inclusion in translation_unit.get_includes()
+            ],
+            write_entry=write_entry,
+            options=options,
+        )
@@ -0,0 +1,103 @@
+import os
+import clang.cindex as clang
+
+from context import scripts
+import scripts.utils as utils
+
+
+class CompilationDatabase:
+    """
+    A compilation database loaded once and indexed by file.
+
+    How to use:
+        - compilation_database = CompilationDatabase.load(compilation_database_path)
+        - compilation_database.get_arguments(filename)
+
+    `load` caches the database per directory, so every parse in a run shares one instance.
+    """
+
+    _loaded = {}  # directory -> (compile_commands.json mtime, CompilationDatabase)
+
+    def __init__(self, compilation_database_path: str) -> None:
+        self.path = compilation_database_path
+        self._arguments = {}  # file's realpath -> compiler arguments
+        self._inferred = (
+            {}
+        )  # file's realpath -> compiler arguments inferred by libclang
+
+        self._database = clang.CompilationDatabase.fromDirectory(
+            buildDir=compilation_database_path
+        )
+
+        for command in self._database.getAllCompileCommands() or []:
+            filename = utils.get_realpath(
+                path=utils.join_path(command.directory, command.filename)
+            )
+            # Keep the first command for a file, as `getCompileCommands(...)[0]` did
+            if filename in self._arguments:
+                continue
+
+            # Drop the compiler name (0th element) and the filename (last element)
+            self._arguments[filename] = list(command.arguments)[1:-1]
+
+    @classmethod
+    def load(cls, compilation_database_path: str) -> "CompilationDatabase":
+        """
+        Returns the database for a directory, loading it only if it isn't loaded or has changed on disk.
+
+        Parameters:
+            - compilation_database_path (str): The directory containing `compile_commands.json`
+        """
+
+        directory = utils.get_realpath(path=compilation_database_path)
+        database_file = utils.join_path(directory, "compile_commands.json")
+        mtime = os.path.getmtime(database_file) if os.path.exists(database_file) else 0
+
+        loaded_mtime, database = cls._loaded.get(directory, (None, None))
+        if database is None or loaded_mtime != mtime:
+            database = cls(compilation_database_path=directory)
+            cls._loaded[directory] = (mtime, database)
+
+        return database
+
+    def __contains__(self, filename: str) -> bool:
+        return utils.get_realpath(path=filename) in self._arguments
+
+    def __len__(self) -> int:
+        return len(self._arguments)
+
+    def files(self) -> list:
+        """
+        Returns all the files with an entry in the database, sorted.
+        """
+
+        return sorted(self._arguments)
+
+    def get_arguments(self, filename: str) -> list:
+        """
+        Returns the compiler arguments for a file.
+
+        Parameters:
+            - filename (str): The file's name to get its compilation arguments
+
+        Returns:
+            - arguments (list): The arguments passed to the compiler, without the compiler name and filename
+        """
+
+        filename = utils.get_realpath(path=filename)
+        arguments = self._arguments.get(filename)
+
+        if arguments is None:
+            arguments = self._inferred.get(filename)
+
+        if arguments is None:
+            # Files without an entry, e.g. headers: libclang infers their commands from the
+            # closest listed file, wherever it is
+            compilation_commands = self._database.getCompileCommands(filename=filename)
+            if not compilation_commands:
+                raise KeyError(f"No compilation commands for {filename} in {self.path}")
+            arguments = self._inferred[filename] = list(
+                compilation_commands[0].arguments
+            )[1:-1]
+
+        return list(arguments)
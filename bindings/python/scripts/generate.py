@@ -1,7 +1,56 @@
+import os
+import re
+import sys
+import glob
+import functools
+
 from context import scripts
 import scripts.utils as utils
+import scripts.binary as binary
+from scripts.ast_store import AstStore
+from scripts.binding_config import BindingConfig
 from typing import Any, List, Dict
 
+# Type kinds of arithmetic fields, which NumPy structured dtypes support
+_dtype_element_types = {
+    "Bool",
+    "Char_S",
+    "Char_U",
+    "SChar",
+    "UChar",
+    "Short",
+    "UShort",
+    "Int",
+    "UInt",
+    "Long",
+    "ULong",
+    "LongLong",
+    "ULongLong",
+    "Float",
+    "Double",
+}
+# Spellings of fundamental types, returned by value even when returned by reference
+_fundamental_types = {
+    "bool",
+    "char",
+    "signed char",
+    "unsigned char",
+    "short",
+    "unsigned short",
+    "int",
+    "unsigned int",
+    "long",
+    "unsigned long",
+    "long long",
+    "unsigned long long",
+    "float",
+    "double",
+    "long double",
+    "std::size_t",
+    "size_t",
+}
+_fixed_width_typedef = re.compile(r"(std::)?u?int(8|16|32|64)_t|(std::)?size_t")
+
 
 class bind:
     """
@@ -15,16 +64,27 @@ class bind:
         "#include <pybind11/pybind11.h>",
         "#include <pybind11/stl.h>",
         "#include <pybind11/stl_bind.h>",
+        "#include <pybind11/numpy.h>",
+        "#include <algorithm>",
+        "#include <string>",
+        "#include <type_traits>",
         "namespace py = pybind11;",
         "using namespace py::literals;",
     ]  # initial pybind lines to be written to binded file
 
-    def __init__(self, root: dict, module_name: str) -> None:
+    def __init__(
+        self, root: dict, module_name: str, config: BindingConfig = None
+    ) -> None:
         self._module_name = module_name  # main python module name
+        self._config = config or BindingConfig()  # per-function binding options
+        self._record_names = self.get_record_names(root)  # qualified, in the whole file
         self._state_stack = []  # stack to keep track of the state (node kind)
         self._linelist = []  # list of lines to be written to the binding file
         self._skipped = []  # list of skipped items, to be used for debugging purposes
         self._inclusion_list = []  # list of all inclusion directives (included files)
+        self._exported_names = []  # python names of the bound classes and functions
+        self._base_class_names = []  # names of the base classes of the bound classes
+        self._opaque_types = []  # qualified names of the vector types made opaque
         handled_by_pybind = self.skip  # handled by pybind11
         handled_elsewhere = self.skip  # handled in another kind's function
         no_need_to_handle = self.skip  # unnecessary kind
@@ -127,6 +187,63 @@ class bind:
         end_token["CLASS_DECL"] = ";"
 
         self._linelist.append(end_token.get(kind, ""))
+        # statements needing the whole class bound first, see `handle_struct_decl`
+        self._linelist += self._state_stack[-1].get("after_scope", [])
+
+    @staticmethod
+    def is_dtype_field(field: dict) -> bool:
+        """
+        Checks if a field can be part of a NumPy structured dtype: an arithmetic type,
+        a fixed width integer typedef, or an array of those.
+        """
+
+        if field.get("is_bitfield") or field["element_type"] not in (
+            _dtype_element_types | {"ConstantArray", "Elaborated", "Typedef"}
+        ):
+            return False
+
+        stack = list(field["members"])
+        while stack:
+            sub_item = stack.pop()
+            if sub_item.get("element_type") in ("Record", "Enum") or (
+                sub_item["kind"] in ("TYPE_REF", "TEMPLATE_REF")
+                and not _fixed_width_typedef.fullmatch(sub_item["name"])
+            ):
+                return False
+            stack += sub_item["members"]
+        return True
+
+    @staticmethod
+    def get_dtype_fields(members: list) -> list or None:
+        """
+        Returns the names of the fields of a POD struct for its NumPy structured dtype, or None if
+        one of them can't be part of a dtype.
+
+        - Fields of anonymous structs are the struct's fields.
+        - Of the members of an anonymous union, the one with the most fields is kept, e.g. `x, y, z`
+          rather than `data[4]`: dtype fields can't overlap.
+        """
+
+        fields = []
+        for sub_item in members:
+            if sub_item["kind"] == "FIELD_DECL":
+                if not bind.is_dtype_field(sub_item):
+                    return None
+                fields.append(sub_item["name"])
+            elif sub_item["kind"] == "ANONYMOUS_STRUCT_DECL":
+                struct_fields = bind.get_dtype_fields(members=sub_item["members"])
+                if struct_fields is None:
+                    return None
+                fields += struct_fields
+            elif sub_item["kind"] == "ANONYMOUS_UNION_DECL":
+                alternatives = [
+                    bind.get_dtype_fields(members=[alternative])
+                    for alternative in sub_item["members"]
+                ]
+                if None in alternatives:
+                    return None
+                fields += max(alternatives, key=len, default=[])
+        return fields
 
     @staticmethod
     def get_fields_from_anonymous(item: dict) -> list:
@@ -153,6 +270,30 @@ class bind:
                 fields += bind.get_fields_from_anonymous(item=sub_item)
         return fields
 
+    def array_property(self, field_name: str) -> str:
+        """
+        Returns the property binding a `ConstantArray` field of the current struct.
+
+        - The getter returns a NumPy array viewing the field's memory, with the struct's python
+          object as base: reads and element writes (`point.data[0] = 1`) don't copy, and the
+          struct outlives the view.
+        - The setter copies a sequence of the same size into the field (`point.data = [1, 2, 3, 4]`).
+        - Multidimensional arrays are viewed flattened.
+        """
+
+        element_type = f"std::remove_all_extents_t<decltype({self.name}::{field_name})>"
+        size = f"sizeof({self.name}::{field_name}) / sizeof({element_type})"
+        getter = (
+            f"[](py::object obj) {{auto &o = obj.cast<{self.name} &>(); "
+            f"return py::array_t<{element_type}>({size}, reinterpret_cast<{element_type} *>(&o.{field_name}), obj); }}"
+        )
+        setter = (
+            f"[]({self.name} &o, py::array_t<{element_type}, py::array::c_style | py::array::forcecast> value) {{"
+            f'if (static_cast<std::size_t>(value.size()) != {size}) throw py::value_error("{field_name} expects " + std::to_string({size}) + " values"); '
+            f"std::copy_n(value.data(), value.size(), reinterpret_cast<{element_type} *>(&o.{field_name})); }}"
+        )
+        return f'.def_property("{field_name}", {getter}, {setter})'
+
     def handle_node(self, item: dict) -> None:
         """
         Function for handling a node (any type).
@@ -233,15 +374,18 @@ class bind:
             str(cls).replace("struct ", "").replace("pcl::", "")
             for cls in base_class_list
         ]
+        self._base_class_names += base_class_list_string
 
         if template_class_name:
             struct_details = ",".join([template_class_name] + base_class_list_string)
             self._linelist.append(
                 f'py::class_<{struct_details}>(m, "{template_class_name_python}")'
             )
+            self._exported_names.append(template_class_name_python)
         else:
             struct_details = ",".join([self.name] + base_class_list_string)
             self._linelist.append(f'py::class_<{struct_details}>(m, "{self.name}")')
+            self._exported_names.append(self.name)
 
         # default constructor
         self._linelist.append(".def(py::init<>())")
@@ -252,10 +396,7 @@ class bind:
             fields = self.get_fields_from_anonymous(sub_item)
             for field in fields:
                 if field["element_type"] == "ConstantArray":
-                    # TODO: FIX: readwrite, not readonly
-                    self._linelist.append(
-                        f'.def_property_readonly("{field["name"]}", []({self.name}& obj) {{return obj.{field["name"]}; }})'  # float[ ' + f'obj.{sub_item["name"]}' + '.size()];} )'
-                    )
+                    self._linelist.append(self.array_property(field_name=field["name"]))
                 else:
                     self._linelist.append(
                         f'.def_readwrite("{field["name"]}", &{self.name}::{field["name"]})'
@@ -267,7 +408,7 @@ class bind:
             if sub_item["kind"] == "FIELD_DECL":
                 if sub_item["element_type"] == "ConstantArray":
                     self._linelist.append(
-                        f'.def_property_readonly("{sub_item["name"]}", []({self.name}& obj) {{return obj.{sub_item["name"]}; }})'  # float[ ' + f'obj.{sub_item["name"]}' + '.size()];} )'
+                        self.array_property(field_name=sub_item["name"])
                     )
                 else:
                     self._linelist.append(
@@ -278,10 +419,61 @@ class bind:
             elif sub_item["kind"] == "CXX_METHOD":
                 # TODO: Add template args, currently blank
                 if sub_item["name"] not in ("PCL_DEPRECATED"):
+                    qualified_name = f'{self.qualified_name()}::{sub_item["name"]}'
+                    # `const` methods need `py::const_` to be picked by `py::overload_cast`
+                    const = ", py::const_" if sub_item.get("is_const_method") else ""
+                    policy = self.get_return_value_policy(
+                        qualified_name=qualified_name,
+                        result_type=sub_item.get("result_type"),
+                        is_method=True,
+                    )
+                    call_guard = self.get_call_guard(qualified_name=qualified_name)
                     self._linelist.append(
-                        f'.def("{sub_item["name"]}", py::overload_cast<>(&{self.name}::{sub_item["name"]}))'
+                        f'.def("{sub_item["name"]}", py::overload_cast<>(&{self.name}::{sub_item["name"]}{const}){policy}{call_guard})'
                     )
 
+        if not template_class_name:
+            self.bind_pod_vector()
+
+    def qualified_name(self) -> str:
+        """
+        Returns the current node's name, qualified by the names of the nodes enclosing it.
+        """
+
+        return "::".join(state["name"] for state in self._state_stack[1:])
+
+    def bind_pod_vector(self) -> None:
+        """
+        Binds `std::vector` of the current struct, if it's a POD record, as an opaque container.
+
+        - The vector type is made opaque, and bound with `py::bind_vector` and the buffer protocol,
+          with a NumPy structured dtype for the struct: `numpy.asarray(points)` views the whole
+          vector without copying, instead of converting it element by element into a list.
+        - Only for structs directly in namespaces (or at global scope), since
+          `PYBIND11_MAKE_OPAQUE` needs the fully qualified name, at global scope.
+        - `PYBIND11_MAKE_OPAQUE` must be seen by every binding file using the vector, not only
+          this one: the vector types are collected into one header every binding file includes,
+          see `generate_opaque_header`.
+        """
+
+        # Without the translation unit and the struct
+        enclosing = self._state_stack[1:-1]
+        if not self.item.get("type_is_pod") or any(
+            state["kind"] != "NAMESPACE" for state in enclosing
+        ):
+            return
+
+        fields = self.get_dtype_fields(members=self.members)
+        if not fields:
+            return
+
+        self._opaque_types.append(self.qualified_name())
+        self._state_stack[-1]["after_scope"] = [
+            f"PYBIND11_NUMPY_DTYPE({self.name}, {', '.join(fields)});",
+            f'py::bind_vector<std::vector<{self.name}>>(m, "{self.name}Vector", py::buffer_protocol());',
+        ]
+        self._exported_names.append(f"{self.name}Vector")
+
     def handle_function(self) -> None:
         """
         Handles `CursorKind.FUNCTION_DECL`
@@ -298,10 +490,114 @@ class bind:
         if parameter_type_list:
             parameter_type_list = "," + parameter_type_list
 
+        policy = self.get_return_value_policy(
+            qualified_name=self.qualified_name(),
+            result_type=self.item.get("result_type"),
+        )
+        call_guard = self.get_call_guard(
+            qualified_name=self.qualified_name(),
+            default=self.takes_only_bound_references(),
+        )
         self._linelist.append(
-            f'm.def("{self.name}", &{self.name} {parameter_type_list});'
+            f'm.def("{self.name}", &{self.name} {parameter_type_list}{policy}{call_guard});'
+        )
+        self._exported_names.append(self.name)
+
+    @staticmethod
+    def returns_class_reference(result_type: str) -> bool:
+        """
+        Checks if a return type is an lvalue reference (`T &`, `const T &`) to a non-fundamental type.
+        """
+
+        if (
+            not result_type
+            or not result_type.endswith("&")
+            or result_type.endswith("&&")
+        ):
+            return False
+        referenced = result_type[:-1].replace("const ", "").replace("volatile ", "")
+        referenced = " ".join(referenced.split())
+        return not (
+            referenced in _fundamental_types
+            or _fixed_width_typedef.fullmatch(referenced)
         )
 
+    def get_return_value_policy(
+        self, qualified_name: str, result_type: str, is_method: bool = False
+    ) -> str:
+        """
+        Returns the return value policy argument of a function's binding.
+
+        - The configured policy, if any.
+        - `reference_internal` for methods returning a reference to a class, usually one of the
+          object's members: the returned object references it instead of copying it on every call,
+          and keeps the object alive (`reference_internal` is `reference` with `py::keep_alive<0, 1>`).
+        - Else nothing, pybind11's default.
+        """
+
+        policy = self._config.return_value_policy(qualified_name=qualified_name)
+        if policy is None and is_method and self.returns_class_reference(result_type):
+            policy = "reference_internal"
+        return f", py::return_value_policy::{policy}" if policy else ""
+
+    def get_call_guard(self, qualified_name: str, default: bool = False) -> str:
+        """
+        Returns the call guard argument of a function's binding: releasing the GIL if the
+        configuration says so (`default` if it doesn't), else nothing.
+        """
+
+        if self._config.release_gil(qualified_name=qualified_name, default=default):
+            return ", py::call_guard<py::gil_scoped_release>()"
+        return ""
+
+    @staticmethod
+    def get_record_names(root: dict) -> set:
+        """
+        Returns the qualified names of the structs and classes declared anywhere in the parsed info,
+        before or after their uses, forward declarations included.
+        """
+
+        record_names = set()
+        # Explicit stack of (node, qualified name prefix), so deep trees don't recurse
+        stack = [(member, "") for member in root["members"]]
+        while stack:
+            node, prefix = stack.pop()
+            if node["kind"] in ("NAMESPACE", "STRUCT_DECL", "CLASS_DECL"):
+                name = prefix + node["name"]
+                if node["kind"] != "NAMESPACE":
+                    record_names.add(name)
+                stack.extend((member, f"{name}::") for member in node["members"])
+        return record_names
+
+    def takes_only_bound_references(self) -> bool:
+        """
+        Checks if the current function only takes references to classes declared in this file.
+
+        - Used as the default for releasing the GIL: pybind11 converts the arguments before
+          releasing it, and such a function gets no Python object to touch, e.g.
+          `void filter(const PointCloud &input, PointCloud &output)`.
+        """
+
+        parameters = [
+            sub_item for sub_item in self.members if sub_item["kind"] == "PARM_DECL"
+        ]
+        if not parameters:
+            return False
+
+        for parameter in parameters:
+            types = [
+                sub_item["name"].replace("struct ", "").replace("class ", "")
+                for sub_item in parameter["members"]
+                if sub_item["kind"] == "TYPE_REF"
+            ]
+            if (
+                parameter["element_type"] != "LValueReference"
+                or len(types) != 1
+                or types[0] not in self._record_names
+            ):
+                return False
+        return True
+
     def handle_constructor(self) -> None:
         """
         Handles `CursorKind.CONSTRUCTOR`
@@ -357,7 +653,15 @@ class bind:
         #     self._inclusion_list.append(self.name)
 
 
-def generate(module_name: str, parsed_info: dict = None, source: str = None) -> str:
+def generate(
+    module_name: str,
+    parsed_info: dict = None,
+    source: str = None,
+    kind: str = None,
+    name: str = None,
+    config: BindingConfig = None,
+    opaque_types: list = None,
+) -> str:
     """
     The main function which handles generation of bindings.
 
@@ -365,6 +669,11 @@ def generate(module_name: str, parsed_info: dict = None, source: str = None) ->
         - module_name (str): Generated python module's name.
         - parsed_info (dict): Parsed info about a C++ source file.
         - source (str): File name
+        - kind (str), name (str): Only bind the declarations with this kind and/or name.
+          Read straight from the index of a binary format `source` (see `ast_store`).
+        - config (BindingConfig): Per-function binding options
+        - opaque_types (list): If given, the vector types made opaque are appended to it,
+          for `generate_opaque_header`
 
     Returns:
         - lines_to_write (list): Lines to write in the binded file.
@@ -384,6 +693,7 @@ def generate(module_name: str, parsed_info: dict = None, source: str = None) ->
         # for inclusion in self._inclusion_list:
         #     lines_to_write.append(f"#include <{inclusion}>")
         lines_to_write += bind_object._initial_pybind_lines
+        lines_to_write.append(f"#include <{OPAQUE_HEADER}>")
         for i, _ in enumerate(bind_object._linelist):
             if bind_object._linelist[i].startswith("namespace"):
                 continue
@@ -401,40 +711,610 @@ def generate(module_name: str, parsed_info: dict = None, source: str = None) ->
         lines_to_write.append("}")
         return lines_to_write
 
+    parsed_info = load_parsed_info(
+        parsed_info=parsed_info, source=source, kind=kind, name=name
+    )
+    bind_object = bind(root=parsed_info, module_name=module_name, config=config)
+    # Extract filename from parsed_info (TRANSLATION_UNIT's name contains the filepath)
+    filename = "pcl" + parsed_info["name"].rsplit("pcl")[-1]
+    if opaque_types is not None:
+        opaque_types += [
+            [filename, type_name] for type_name in bind_object._opaque_types
+        ]
+    return combine_lines()
+
+
+OPAQUE_HEADER = "pcl_opaque.h"
+
+
+def get_opaque_header_path(pybind11_output_path: str) -> str:
+    """
+    Returns the path of the header declaring the opaque types, see `generate_opaque_header`
+    """
+
+    return utils.join_path(pybind11_output_path, "pybind11-gen", OPAQUE_HEADER)
+
+
+def generate_opaque_header(opaque_types: list) -> list:
+    """
+    Generates the header making the vector types opaque, included by every binding file.
+
+    - A `PYBIND11_MAKE_OPAQUE` only affects the files which see it: a function of another file
+      returning the vector would convert it into a list, and the module would hold two different
+      `type_caster`s for the same type. So the declarations of all the files are in one header.
+    - The header has to be on the include path of the binding files (`pybind11-gen`).
+
+    Parameters:
+        - opaque_types (list): [header declaring the type, qualified type name] pairs, collected
+          with the `opaque_types` parameter of `generate` (or `generate_shards`, `generate_submodule`)
+
+    Returns:
+        - lines_to_write (list): Lines of the header
+    """
+
+    opaque_types = sorted({tuple(opaque_type) for opaque_type in opaque_types})
+    lines = ["#pragma once", "#include <pybind11/pybind11.h>", "#include <vector>"]
+    lines += [
+        f"#include <{header}>" for header in dict.fromkeys(h for h, _ in opaque_types)
+    ]
+    lines += [
+        f"PYBIND11_MAKE_OPAQUE(std::vector<{type_name}>)"
+        for type_name in dict.fromkeys(t for _, t in opaque_types)
+    ]
+    return lines
+
+
+def update_opaque_header(pybind11_output_path: str, opaque_types: dict) -> str:
+    """
+    Records the opaque types of binding files, and writes the header with those of all the files.
+
+    - Runs may generate only some of the files (e.g. `generate.py a.json`, then `generate.py b.json`),
+      the types of the others are kept in a record next to the header, `pcl_opaque.json`.
+    - Files whose binding file was removed are dropped from the record.
+
+    Parameters:
+        - pybind11_output_path (str): The output directory of the binding files
+        - opaque_types (dict): Binding file -> its opaque types (see `generate_opaque_header`),
+          replacing what was recorded for it
+
+    Returns:
+        - header_path (str): The path of the header
+    """
+
+    header_path = get_opaque_header_path(pybind11_output_path=pybind11_output_path)
+    record_path = f"{os.path.splitext(header_path)[0]}.json"
+
+    record = (
+        utils.read_json(filename=record_path) if os.path.exists(record_path) else {}
+    )
+    for cpp_path, types in opaque_types.items():
+        record[utils.get_realpath(path=cpp_path)] = types
+    record = {
+        cpp_path: record[cpp_path]
+        for cpp_path in sorted(record)
+        if os.path.exists(cpp_path)
+    }
+
+    utils.ensure_dir_exists(dir=os.path.dirname(header_path))
+    utils.dump_json(filepath=record_path, info=record)
+    utils.write_to_file(
+        filename=header_path,
+        linelist=generate_opaque_header(
+            opaque_types=[
+                opaque_type for types in record.values() for opaque_type in types
+            ]
+        ),
+    )
+    return header_path
+
+
+def load_parsed_info(
+    parsed_info: dict = None, source: str = None, kind: str = None, name: str = None
+) -> dict:
+    """
+    Returns the parsed info to generate bindings for, see `generate` for the parameters.
+    """
+
     # Argument checks and `parsed_info` value initialisation
     if parsed_info and source:  # Both args passed, choose parsed_info.
         print("Both parsed_info and source arguments provided, choosing parsed_info.")
-    elif source:  # If source passed, read JSON.
-        parsed_info = utils.read_json(filename=source)
+    elif source:  # If source passed, read JSON (or the binary format).
+        if source.endswith(binary.EXTENSION):
+            with AstStore(source) as store:
+                if kind or name:
+                    parsed_info = store.extract(kind=kind, name=name)
+                else:
+                    parsed_info = store.read()
+        elif kind or name:
+            raise Exception("Selecting declarations needs a binary format source")
+        else:
+            parsed_info = utils.read_json(filename=source)
     elif parsed_info:  # If parsed_info passed, just use that further on.
         pass
     else:  # Both args are None.
         raise Exception("Provide either parsed_info or source")
 
     # If parsed_info is not empty
-    if parsed_info:
-        bind_object = bind(root=parsed_info, module_name=module_name)
-        # Extract filename from parsed_info (TRANSLATION_UNIT's name contains the filepath)
-        filename = "pcl" + parsed_info["name"].rsplit("pcl")[-1]
-        return combine_lines()
-    else:
+    if not parsed_info:
         raise Exception("Empty dict: parsed_info")
+    return parsed_info
 
 
-def main():
-    args = utils.parse_arguments(script="generate")
+def split_statements(linelist: list) -> list:
+    """
+    Splits the lines generated by `bind` into statements (a class and its chained `.def`s, an `m.def`).
+
+    Returns:
+        - statements (list): (namespaces enclosing the statement, as a tuple, lines of the statement)
+    """
+
+    statements = []
+    namespaces = []
+    statement = None
+    for line in linelist:
+        if line.startswith("namespace "):
+            namespaces.append(line[len("namespace ") :].rstrip("{").strip())
+        elif line == "}" and namespaces:
+            namespaces.pop()
+        elif line:
+            if statement is None:
+                statement = (tuple(namespaces), [])
+                statements.append(statement)
+            statement[1].append(line)
+            if line.endswith(";"):
+                statement = None
+    return statements
+
+
+def balance_shards(statements: list, shards: int) -> list:
+    """
+    Splits statements into at most `shards` contiguous groups of about the same number of lines.
+
+    - Contiguous groups keep the declaration order, e.g. base classes before derived classes.
+    """
+
+    total = sum(len(lines) for _, lines in statements)
+    groups = [[]]
+    weight = 0
+    for statement in statements:
+        if (
+            groups[-1]
+            and len(groups) < shards
+            and weight >= total * len(groups) / shards
+        ):
+            groups.append([])
+        groups[-1].append(statement)
+        weight += len(statement[1])
+    return [group for group in groups if group]
+
+
+def generate_shards(
+    module_name: str,
+    shard_name: str,
+    shards: int,
+    parsed_info: dict = None,
+    source: str = None,
+    kind: str = None,
+    name: str = None,
+    config: BindingConfig = None,
+    opaque_types: list = None,
+) -> tuple:
+    """
+    Generates bindings split into shard files, which can be compiled in parallel.
+
+    - Each shard defines `void init_<shard_name>_<i>(py::module &m)`, the module file's
+      `PYBIND11_MODULE` calls them in order.
+    - Namespaces become blocks with a `using namespace`, reopened in each shard.
+
+    Parameters:
+        - shard_name (str): Prefix of the shards' init functions, unique within the module
+        - shards (int): Maximum number of shards, fewer are generated if there are fewer statements
+        - See `generate` for the other parameters, e.g. `opaque_types`
+
+    Returns:
+        - (module_lines, shard_lines): Lines of the module file, list of the lines of each shard
+    """
+
+    parsed_info = load_parsed_info(
+        parsed_info=parsed_info, source=source, kind=kind, name=name
+    )
+    bind_object = bind(root=parsed_info, module_name=module_name, config=config)
+    filename = "pcl" + parsed_info["name"].rsplit("pcl")[-1]
+    init_functions, shard_lines = _shard_bindings(
+        bind_object=bind_object,
+        filename=filename,
+        shard_name=shard_name,
+        shards=shards,
+    )
+    if opaque_types is not None:
+        opaque_types += [
+            [filename, type_name] for type_name in bind_object._opaque_types
+        ]
+
+    module_lines = bind_object._initial_pybind_lines + [
+        f"void {init_function}(py::module &m);" for init_function in init_functions
+    ]
+    module_lines.append(f"PYBIND11_MODULE({module_name}, m)" + "{")
+    module_lines += [f"{init_function}(m);" for init_function in init_functions]
+    module_lines.append("}")
+
+    return module_lines, shard_lines
+
+
+def to_identifier(name: str) -> str:
+    return "".join(character if character.isalnum() else "_" for character in name)
+
+
+def _shard_bindings(bind_object: bind, filename: str, shard_name: str, shards: int):
+    """
+    Returns the init functions of the shards of a `bind` object's lines, and each shard's lines
+    """
+
+    shard_name = to_identifier(shard_name)
+    init_functions = []
+    shard_lines = []
+    for group in balance_shards(split_statements(bind_object._linelist), shards):
+        init_functions.append(f"init_{shard_name}_{len(init_functions)}")
+        lines = [f"#include <{filename}>"] + bind_object._initial_pybind_lines
+        lines.append(f"#include <{OPAQUE_HEADER}>")
+        lines.append(f"void {init_functions[-1]}(py::module &m)" + "{")
+        namespaces = ()
+        for statement_namespaces, statement in group:
+            if statement_namespaces != namespaces:
+                lines += ["}"] * len(namespaces)
+                lines += [
+                    "{" + f"using namespace {namespace};"
+                    for namespace in statement_namespaces
+                ]
+                namespaces = statement_namespaces
+            lines += statement
+        lines += ["}"] * len(namespaces)
+        lines.append("}")
+        shard_lines.append(lines)
+
+    return init_functions, shard_lines
+
+
+def generate_submodule(
+    module_name: str,
+    submodule_name: str,
+    shard_name: str,
+    shards: int = 1,
+    parsed_info: dict = None,
+    source: str = None,
+    kind: str = None,
+    name: str = None,
+    config: BindingConfig = None,
+) -> dict:
+    """
+    Generates the bindings of a file as a submodule, to be loaded lazily, see `generate_lazy_module`.
+
+    Parameters:
+        - submodule_name (str): The submodule's python name, e.g. `point_types`
+        - shard_name (str): Prefix of the init functions, unique within the module
+        - shards (int): See `generate_shards`
+
+    Returns:
+        - submodule (dict):
+            - name: `submodule_name`
+            - init_function: `void <init_function>(py::module &m)` binds the file on a (sub)module
+            - lines: Lines of the file defining `init_function`
+            - shard_lines: Lines of each shard file it calls
+            - names: The names it binds (classes, functions)
+            - bases: The names of the base classes of its classes
+            - opaque_types: The vector types it makes opaque, see `generate_opaque_header`
+    """
+
+    parsed_info = load_parsed_info(
+        parsed_info=parsed_info, source=source, kind=kind, name=name
+    )
+    bind_object = bind(root=parsed_info, module_name=module_name, config=config)
+    filename = "pcl" + parsed_info["name"].rsplit("pcl")[-1]
+    init_functions, shard_lines = _shard_bindings(
+        bind_object=bind_object,
+        filename=filename,
+        shard_name=shard_name,
+        shards=shards,
+    )
+
+    init_function = f"init_{to_identifier(shard_name)}"
+    lines = bind_object._initial_pybind_lines + [
+        f"void {shard_init_function}(py::module &m);"
+        for shard_init_function in init_functions
+    ]
+    lines.append(f"void {init_function}(py::module &m)" + "{")
+    lines += [f"{shard_init_function}(m);" for shard_init_function in init_functions]
+    lines.append("}")
+
+    return {
+        "name": submodule_name,
+        "init_function": init_function,
+        "lines": lines,
+        "shard_lines": shard_lines,
+        "names": list(dict.fromkeys(bind_object._exported_names)),
+        "bases": list(dict.fromkeys(bind_object._base_class_names)),
+        "opaque_types": [
+            [filename, type_name] for type_name in bind_object._opaque_types
+        ],
+    }
+
+
+def generate_lazy_module(module_name: str, submodules: list) -> list:
+    """
+    Generates a module whose submodules are only initialized on first use.
+
+    - Accessing `module.<submodule>`, or a name a submodule binds (`module.PointXYZ`), calls the
+      module's `__getattr__` (PEP 562). It initializes the submodule (`import module.<submodule>` works
+      from then on), copies its names onto the module, and returns the attribute.
+      Later accesses are plain attribute lookups.
+    - pybind11 needs base classes registered before their derived classes: the submodules binding
+      the bases of a submodule's classes are initialized before it. Base classes from outside the
+      module's submodules can't be resolved this way.
+    - Functions taking or returning types of a submodule that isn't loaded yet raise TypeError
+      until it is, e.g. by accessing one of its names.
+
+    Parameters:
+        - submodules (list): Dicts with the `name`, `init_function`, `names` and `bases` of each
+          submodule, see `generate_submodule`
+
+    Returns:
+        - lines_to_write (list): Lines of the module file
+    """
+
+    submodule_names = [submodule["name"] for submodule in submodules]
+    if len(set(submodule_names)) != len(submodule_names):
+        raise ValueError(f"Submodule names aren't unique: {submodule_names}")
+
+    owners = {}  # bound name -> submodule name
+    for submodule in submodules:
+        for bound_name in submodule["names"]:
+            owners.setdefault(bound_name, submodule["name"])
+
+    def string_list(strings):
+        return "{" + ", ".join(f'"{string}"' for string in strings) + "}"
+
+    lines = list(bind._initial_pybind_lines)
+    # Next to the initial lines' includes, without repeating them
+    includes = [
+        include
+        for include in (
+            "#include <algorithm>",
+            "#include <map>",
+            "#include <string>",
+            "#include <vector>",
+        )
+        if include not in lines
+    ]
+    last_include = max(
+        index for index, line in enumerate(lines) if line.startswith("#include")
+    )
+    lines[last_include + 1 : last_include + 1] = includes
+    lines += [
+        f"void {submodule['init_function']}(py::module &m);" for submodule in submodules
+    ]
+    lines += [
+        "namespace {",
+        "struct Submodule {",
+        "void (*init)(py::module &);",
+        "std::vector<std::string> dependencies;",
+        "std::vector<std::string> names;",
+        "};",
+        "const std::map<std::string, Submodule> &submodules(){",
+        "static const std::map<std::string, Submodule> submodules = {",
+    ]
+    for submodule in submodules:
+        dependencies = [
+            owners[base]
+            for base in submodule["bases"]
+            if base in owners and owners[base] != submodule["name"]
+        ]
+        lines.append(
+            f'{{"{submodule["name"]}", {{&{submodule["init_function"]}, '
+            f"{string_list(dict.fromkeys(dependencies))}, "
+            f'{string_list(submodule["names"])}}}}},'
+        )
+    lines += [
+        "};",
+        "return submodules;",
+        "}",
+        "void load_submodule(py::module &m, const std::string &name){",
+        'if (m.attr("__dict__").contains(name)) return;',
+        "const Submodule &submodule = submodules().at(name);",
+        "for (const std::string &dependency : submodule.dependencies) load_submodule(m, dependency);",
+        "py::module submodule_object = m.def_submodule(name.c_str());",
+        "submodule.init(submodule_object);",
+        f'py::module::import("sys").attr("modules")[py::str("{module_name}." + name)] = submodule_object;',
+        "for (const std::string &bound_name : submodule.names) m.attr(bound_name.c_str()) = submodule_object.attr(bound_name.c_str());",
+        "}",
+        "}",
+        f"PYBIND11_MODULE({module_name}, m)" + "{",
+        'm.def("__getattr__", [](const std::string &name) -> py::object {',
+        f'py::module m = py::module::import("{module_name}");',
+        "for (const auto &item : submodules()){",
+        "const std::vector<std::string> &names = item.second.names;",
+        "if (item.first == name || std::find(names.begin(), names.end(), name) != names.end()){",
+        "load_submodule(m, item.first);",
+        "return m.attr(name.c_str());",
+        "}",
+        "}",
+        f"throw py::attribute_error(\"module '{module_name}' has no attribute '\" + name + \"'\");",
+        "});",
+        'm.def("__dir__", []() -> py::object {',
+        f'py::list names = py::module::import("{module_name}").attr("__dict__").attr("keys")();',
+        "for (const auto &item : submodules()){",
+        "names.append(item.first);",
+        "for (const std::string &bound_name : item.second.names) names.append(bound_name);",
+        "}",
+        'return py::module::import("builtins").attr("sorted")(py::set(names));',
+        "});",
+        "}",
+    ]
+
+    return lines
+
+
+def get_cpp_output_path(source: str, pybind11_output_path: str) -> str:
+    """
+    Returns the path of the binding file for a parsed info file (under a `json` directory)
+    """
+
+    return utils.get_output_path(
+        source=source,
+        output_dir=utils.join_path(pybind11_output_path, "pybind11-gen"),
+        split_from="json",
+        extension=".cpp",
+    )
+
+
+def generate_worker(
+    source: str,
+    pybind11_output_path: str,
+    kind: str = None,
+    name: str = None,
+    shards: int = 1,
+    lazy: bool = False,
+    config_path: str = None,
+) -> dict:
+    """
+    Generates and writes the binding file for one parsed info file
 
-    for source in args.files:
-        source = utils.get_realpath(path=source)
-        lines_to_write = generate(module_name="pcl", source=source)
-        output_filepath = utils.get_output_path(
+    - Used as the task function for `utils.parallel_map`, hence module level (picklable)
+    - With `shards` > 1, the binding file only defines the module, the bindings are in
+      `<name>_shard<i>.cpp` files next to it, see `generate_shards`
+    - With `lazy`, the binding file defines a submodule instead of a module
+    - `config_path` is a `BindingConfig` file, loaded in the worker
+
+    Returns:
+        - result (dict):
+            - output_filepath: The binding file's path
+            - opaque_types: For `generate_opaque_header`
+            - submodule: With `lazy`, the submodule's metadata for `generate_lazy_module`
+              (see `generate_submodule`, without the lines)
+    """
+
+    config = BindingConfig.load(config_path=config_path)
+
+    output_filepath = get_cpp_output_path(
+        source=source, pybind11_output_path=pybind11_output_path
+    )
+    output_stem = os.path.splitext(output_filepath)[0]
+    # The path under pybind11-gen keeps init functions unique across the module's files
+    shard_name = os.path.relpath(
+        output_stem, utils.join_path(pybind11_output_path, "pybind11-gen")
+    )
+
+    shard_filepaths = []
+    submodule = None
+    opaque_types = []
+    if lazy:
+        submodule = generate_submodule(
+            module_name="pcl",
+            submodule_name=os.path.basename(output_stem),
+            shard_name=shard_name,
+            shards=shards,
+            source=source,
+            kind=kind,
+            name=name,
+            config=config,
+        )
+        for index, lines in enumerate(submodule.pop("shard_lines")):
+            shard_filepaths.append(f"{output_stem}_shard{index}.cpp")
+            utils.write_to_file(filename=shard_filepaths[-1], linelist=lines)
+        utils.write_to_file(filename=output_filepath, linelist=submodule.pop("lines"))
+        opaque_types = submodule.pop("opaque_types")
+    elif shards > 1:
+        module_lines, shard_lines = generate_shards(
+            module_name="pcl",
+            shard_name=shard_name,
+            shards=shards,
             source=source,
-            output_dir=utils.join_path(args.pybind11_output_path, "pybind11-gen"),
-            split_from="json",
-            extension=".cpp",
+            kind=kind,
+            name=name,
+            config=config,
+            opaque_types=opaque_types,
+        )
+        for index, lines in enumerate(shard_lines):
+            shard_filepaths.append(f"{output_stem}_shard{index}.cpp")
+            utils.write_to_file(filename=shard_filepaths[-1], linelist=lines)
+        utils.write_to_file(filename=output_filepath, linelist=module_lines)
+    else:
+        lines_to_write = generate(
+            module_name="pcl",
+            source=source,
+            kind=kind,
+            name=name,
+            config=config,
+            opaque_types=opaque_types,
         )
         utils.write_to_file(filename=output_filepath, linelist=lines_to_write)
 
+    # Shards of a previous run with more shards would still be picked up by CMake
+    for stale_filepath in glob.glob(f"{glob.escape(output_stem)}_shard*.cpp"):
+        if stale_filepath not in shard_filepaths:
+            os.remove(stale_filepath)
+
+    return {
+        "output_filepath": output_filepath,
+        "opaque_types": opaque_types,
+        "submodule": submodule,
+    }
+
+
+def get_lazy_module_path(pybind11_output_path: str) -> str:
+    """
+    Returns the path of the module file loading the submodules generated with `lazy`
+    """
+
+    return utils.join_path(pybind11_output_path, "pybind11-gen", "pcl_module.cpp")
+
+
+def main():
+    args = utils.parse_arguments(script="generate")
+    sources = [utils.get_realpath(path=source) for source in args.files]
+
+    # Each file is generated on its own, `args.jobs` at a time; results arrive in the order of `sources`
+    results = utils.parallel_map(
+        function=functools.partial(
+            generate_worker,
+            pybind11_output_path=args.pybind11_output_path,
+            kind=args.kind,
+            name=args.name,
+            shards=args.shards,
+            lazy=args.lazy,
+            config_path=args.config,
+        ),
+        items=sources,
+        jobs=args.jobs,
+    )
+
+    failed = []
+    submodules = []
+    opaque_types = {}  # binding file -> its opaque types
+    for source, result, error in results:
+        if error:
+            failed.append(source)
+            print(f"Failed to generate {source}: {error!r}", file=sys.stderr)
+            continue
+        opaque_types[result["output_filepath"]] = result["opaque_types"]
+        if args.lazy:
+            submodules.append(result["submodule"])
+
+    if failed:
+        sys.exit(f"{len(failed)} of {len(sources)} files failed to generate")
+
+    # Every binding file includes it, with the opaque types of all the files, of previous runs too
+    update_opaque_header(
+        pybind11_output_path=args.pybind11_output_path, opaque_types=opaque_types
+    )
+
+    if args.lazy:
+        utils.write_to_file(
+            filename=get_lazy_module_path(
+                pybind11_output_path=args.pybind11_output_path
+            ),
+            linelist=generate_lazy_module(module_name="pcl", submodules=submodules),
+        )
+
 
 if __name__ == "__main__":
     main()
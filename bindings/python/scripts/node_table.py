@@ -0,0 +1,316 @@
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # Filters fall back to plain Python scans
+    np = None
+
+
+class NodeTable:
+    """
+    Columnar (struct-of-arrays) representation of parsed info.
+
+    How to use:
+        - table = NodeTable.from_parsed_info(parsed_info)
+        - table.root: a `NodeView` of the root, usable wherever a `parsed_info` dict is read,
+          e.g. `generate.generate(module_name, parsed_info=table.root)`
+        - table.find(kind="STRUCT_DECL", name="PointXYZ"): views of the matching nodes
+
+    - Nodes are stored in pre-order. Each node is a row: depth, line, column, kind, name, parent,
+      subtree end (one past the node's last descendant), shape (its keys, in order) and a packed
+      bitmask of its boolean traits, plus one column per other string trait (interned, -1 if absent).
+    - Values that fit no column (e.g. the root's `tokens`) are kept per node in `extras`.
+    - A few tens of bytes per node, instead of a dict with ~40 entries.
+    """
+
+    _fixed_columns = ("depth", "line", "column")
+    _string_columns = (
+        "kind",
+        "name",
+        "element_type",
+        "access_specifier",
+        "result_type",
+        "brief_comment",
+        "raw_comment",
+    )
+    _max_flags = 64
+
+    def __init__(self):
+        self.columns = {
+            "depth": array("I"),
+            "line": array("I"),
+            "column": array("I"),
+            "parent": array("i"),
+            "end": array("I"),
+            "shape": array("I"),
+            "flags": array("Q"),
+            "token_start": array("i"),
+            "token_end": array("i"),
+        }
+        for key in self._string_columns:
+            self.columns[key] = array("i")
+
+        self.strings = []  # interned strings, referred to by index
+        self._string_ids = {}  # string -> index in `strings`
+        self.flag_keys = []  # boolean trait -> its bit in `flags`, by position
+        self._flag_bits = {}
+        self.shapes = []  # tuples of keys, in the node's order
+        self._shape_ids = {}
+        self.extras = {}  # node index -> {key: value} for values without a column
+
+    def __len__(self):
+        return len(self.columns["depth"])
+
+    @property
+    def root(self):
+        return NodeView(self, 0)
+
+    def intern(self, string):
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            string_id = self._string_ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+    def _flag_bit(self, key):
+        bit = self._flag_bits.get(key)
+        if bit is None and len(self.flag_keys) < self._max_flags:
+            bit = self._flag_bits[key] = len(self.flag_keys)
+            self.flag_keys.append(key)
+        return bit
+
+    def append(self, info, parent=-1):
+        """
+        Adds a node, as the last child of `parent`, and returns its index.
+
+        - `info` is the node's parsed_info, its `members` are ignored: children are appended on their own.
+        - `close(index)` must be called once all of the node's descendants are appended.
+        """
+
+        columns = self.columns
+        index = len(self)
+        keys = tuple(key for key in info if key != "members") + ("members",)
+
+        shape_id = self._shape_ids.get(keys)
+        if shape_id is None:
+            shape_id = self._shape_ids[keys] = len(self.shapes)
+            self.shapes.append(keys)
+
+        columns["shape"].append(shape_id)
+        columns["parent"].append(parent)
+        columns["end"].append(index + 1)
+        for key in self._fixed_columns:
+            columns[key].append(info.get(key, 0))
+        for key in self._string_columns:
+            value = info.get(key)
+            columns[key].append(self.intern(value) if isinstance(value, str) else -1)
+
+        token_range = info.get("token_range")
+        columns["token_start"].append(token_range[0] if token_range else -1)
+        columns["token_end"].append(token_range[1] if token_range else -1)
+
+        flags = 0
+        extras = None
+        for key, value in info.items():
+            if key == "members" or key == "token_range":
+                continue
+            if isinstance(value, bool):
+                bit = self._flag_bit(key)
+                if bit is not None:
+                    flags |= value << bit
+                    continue
+            elif key in columns and (
+                isinstance(value, str) or key in self._fixed_columns
+            ):
+                continue
+            if extras is None:
+                extras = self.extras[index] = {}
+            extras[key] = value
+        columns["flags"].append(flags)
+
+        return index
+
+    def close(self, index):
+        """
+        Marks the end of a node's subtree, after all its descendants are appended.
+        """
+
+        self.columns["end"][index] = len(self)
+
+    @classmethod
+    def from_parsed_info(cls, parsed_info):
+        """
+        Returns the table for a parsed_info tree.
+        """
+
+        table = cls()
+        # Explicit stack of (index, iterator over members), so deep trees don't recurse
+        stack = [(table.append(parsed_info), iter(parsed_info["members"]))]
+
+        while stack:
+            index, members = stack[-1]
+            for member in members:
+                stack.append(
+                    (table.append(member, parent=index), iter(member["members"]))
+                )
+                break
+            else:
+                stack.pop()
+                table.close(index)
+
+        return table
+
+    def keys(self, index):
+        return self.shapes[self.columns["shape"][index]]
+
+    def children(self, index):
+        """
+        Yields the indices of a node's children.
+        """
+
+        end = self.columns["end"]
+        child = index + 1
+        while child < end[index]:
+            yield child
+            child = end[child]
+
+    def value(self, index, key):
+        """
+        Returns a node's value for a key, raising KeyError if the node doesn't have it (like a dict).
+        """
+
+        if key not in self.keys(index):
+            raise KeyError(key)
+
+        if key == "members":
+            return [NodeView(self, child) for child in self.children(index)]
+
+        extras = self.extras.get(index)
+        if extras and key in extras:
+            return extras[key]
+
+        if key == "token_range":
+            return [
+                self.columns["token_start"][index],
+                self.columns["token_end"][index],
+            ]
+
+        column = self.columns.get(key)
+        if key in self._fixed_columns:
+            return column[index]
+        if column is not None:
+            return self.strings[column[index]]
+
+        return bool(self.columns["flags"][index] >> self._flag_bits[key] & 1)
+
+    def to_parsed_info(self, index=0):
+        """
+        Returns the parsed_info dict of a node's subtree.
+        """
+
+        root = {}
+        # Explicit stack of (index, dict to fill), so deep trees don't recurse
+        stack = [(index, root)]
+        while stack:
+            index, info = stack.pop()
+            for key in self.keys(index):
+                if key == "members":
+                    info["members"] = []
+                    for child in self.children(index):
+                        child_info = {}
+                        info["members"].append(child_info)
+                        stack.append((child, child_info))
+                else:
+                    info[key] = self.value(index, key)
+        return root
+
+    def indices(self, kind=None, name=None):
+        """
+        Returns the indices of the nodes with the given kind and/or name, as a vectorized scan
+        over the interned columns (NumPy, if available).
+        """
+
+        conditions = []
+        for key, value in (("kind", kind), ("name", name)):
+            if value is None:
+                continue
+            string_id = self._string_ids.get(value)
+            if string_id is None:
+                return []
+            conditions.append((self.columns[key], string_id))
+
+        if not conditions:
+            return list(range(len(self)))
+
+        if np is not None:
+            mask = np.ones(len(self), dtype=bool)
+            for column, string_id in conditions:
+                mask &= np.frombuffer(column, dtype=np.int32) == string_id
+            return np.flatnonzero(mask).tolist()
+
+        return [
+            index
+            for index in range(len(self))
+            if all(column[index] == string_id for column, string_id in conditions)
+        ]
+
+    def find(self, kind=None, name=None):
+        """
+        Returns views of the nodes with the given kind and/or name.
+        """
+
+        return [NodeView(self, index) for index in self.indices(kind=kind, name=name)]
+
+
+class NodeView:
+    """
+    A read-only view of one node of a `NodeTable`, usable like its parsed_info dict.
+
+    - `node["kind"]`, `node["members"]`, `node.get(...)`, `key in node`, iteration over keys, etc.
+    """
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.table.value(self.index, key)
+
+    def get(self, key, default=None):
+        try:
+            return self.table.value(self.index, key)
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self.table.keys(self.index)
+
+    def __iter__(self):
+        return iter(self.table.keys(self.index))
+
+    def __len__(self):
+        return len(self.table.keys(self.index))
+
+    def keys(self):
+        return self.table.keys(self.index)
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_parsed_info(self):
+        return self.table.to_parsed_info(self.index)
+
+    def __eq__(self, other):
+        if isinstance(other, NodeView):
+            other = other.to_parsed_info()
+        return self.to_parsed_info() == other
+
+    def __repr__(self):
+        return (
+            f"NodeView({self.get('kind')!r}, {self.get('name')!r}, index={self.index})"
+        )
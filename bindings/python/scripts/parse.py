@@ -1,8 +1,50 @@
+import os
 import sys
+import bisect
+import functools
 import clang.cindex as clang
 
 from context import scripts
 import scripts.utils as utils
+import scripts.binary as binary
+import scripts.ast_store as ast_store
+import scripts.generate as generate
+from scripts.cache import AstCache, ParseCache
+from scripts.compilation_database import CompilationDatabase
+from scripts.node_table import NodeTable
+from scripts.symbol_index import SymbolIndex
+from scripts.watch import Watcher
+
+
+def in_file(cursor, filename):
+    """
+    Checks if a cursor belongs to the file
+
+    - Needed to ensure that only symbols belonging to the file gets parsed, not the included files' symbols
+    """
+
+    file = cursor.location.file
+    return file is not None and file.name == filename
+
+
+def _valid_cursors(cursor, filename, prune=None):
+    """
+    Yields the children of a cursor which belong to the file and aren't pruned
+    """
+
+    for child in cursor.get_children():
+        if in_file(child, filename) and not (prune and prune(child)):
+            yield child
+
+
+def _root_cursors(node):
+    """
+    Returns an iterator over the valid children of a root node, or its `children` if given
+    """
+
+    if "children" in node:
+        return iter(node["children"])
+    return _valid_cursors(node["cursor"], node["filename"], node.get("prune"))
 
 
 def valid_children(node):
@@ -18,25 +60,75 @@ def valid_children(node):
                     - The file's name to check if the node belongs to it
                     - Needed to ensure that only symbols belonging to the file gets parsed, not the included files' symbols
                 - depth: The depth of the node (root=0)
+                - prune (optional): Function returning True for cursors to leave out, with their subtrees
+                - children (optional, root only): The root's valid children, when already known
+                  (e.g. grouped by file), instead of filtering all of the root's children
 
     Yields:
         - child_node (dict): Same structure as the argument
     """
 
-    cursor = node["cursor"]
+    depth = node["depth"] + 1
+    for child in _root_cursors(node):
+        # Other keys (e.g. `token_offsets`) are shared by the whole tree
+        child_node = dict(node, cursor=child, depth=depth)
+        child_node.pop("children", None)
+        yield child_node
+
+
+def walk(node, pre_visit=None, post_visit=None):
+    """
+    Traverses the AST in depth-first order, using an explicit stack instead of recursion
+
+    - No Python recursion, so arbitrarily deep ASTs don't hit the recursion limit.
+    - Only cursors are kept on the stack, no per-node dicts are allocated.
+
+    Parameters:
+        - node (dict): The root node, see `valid_children` for the keys
+        - pre_visit (function):
+            - Called as `pre_visit(cursor, depth, parent)` before a node's children are visited
+            - `parent` is what `pre_visit` returned for the node's parent (None for the root)
+            - Its return value is passed to the node's children and to `post_visit`
+        - post_visit (function):
+            - Called as `post_visit(cursor, depth, value)` after all of a node's children are visited
+            - `value` is what `pre_visit` returned for the node
+
+    Returns:
+        - The value `pre_visit` returned for the root
+    """
+
     filename = node["filename"]
+    prune = node.get("prune")
+    cursor = node["cursor"]
     depth = node["depth"]
 
-    for child in cursor.get_children():
-        child_node = {"cursor": child, "filename": filename, "depth": depth + 1}
-        # Check if the child belongs to the file
-        if child.location.file and child.location.file.name == filename:
-            yield (child_node)
+    root_value = pre_visit(cursor, depth, None) if pre_visit else None
+
+    # Each entry: (cursor, depth, pre_visit's value, iterator over the cursor's valid children)
+    stack = [(cursor, depth, root_value, _root_cursors(node))]
+
+    while stack:
+        cursor, depth, value, children = stack[-1]
+
+        child = next(children, None)
+        if child is None:
+            # All children visited
+            stack.pop()
+            if post_visit:
+                post_visit(cursor, depth, value)
+            continue
+
+        child_value = pre_visit(child, depth + 1, value) if pre_visit else None
+        stack.append(
+            (child, depth + 1, child_value, _valid_cursors(child, filename, prune))
+        )
+
+    return root_value
 
 
 def print_ast(node):
     """
-    Prints the AST by recursively traversing it
+    Prints the AST by traversing it
 
     Parameters:
         - node (dict):
@@ -52,25 +144,220 @@ def print_ast(node):
         - None
     """
 
-    cursor = node["cursor"]
-    depth = node["depth"]
+    def print_cursor(cursor, depth, parent):
+        print(
+            "-" * depth,
+            cursor.location.file,
+            f"L{cursor.location.line} C{cursor.location.column}",
+            cursor.kind.name,
+            cursor.spelling,
+        )
+
+    walk(node, pre_visit=print_cursor)
+
+
+def _checks(*checks):
+    """
+    Returns (name, getter) pairs for boolean checks, e.g. ("kind_is_declaration", "kind.is_declaration")
+    """
 
-    print(
-        "-" * depth,
-        cursor.location.file,
-        f"L{cursor.location.line} C{cursor.location.column}",
-        cursor.kind.name,
-        cursor.spelling,
+    def getter(path):
+        attribute, method = path.rsplit(".", 1) if "." in path else (None, path)
+        if attribute:
+            return lambda cursor: getattr(getattr(cursor, attribute), method)()
+        return lambda cursor: getattr(cursor, method)()
+
+    return [(name, getter(path)) for name, path in checks]
+
+
+"""
+- Traits of a node, in output order: field name -> function returning its value for a cursor
+- A field whose function returns None is left out of the node
+- `depth` and `members` are always output
+"""
+CURSOR_FIELDS = dict(
+    [
+        ("line", lambda cursor: cursor.location.line),
+        ("column", lambda cursor: cursor.location.column),
+        (
+            "kind",
+            lambda cursor: (
+                "ANONYMOUS_" + cursor.kind.name
+                if cursor.is_anonymous()
+                else cursor.kind.name
+            ),
+        ),
+        # `token_range` (and the root's `tokens`) go here, see `select_fields`
+        ("name", lambda cursor: cursor.spelling),
+        (
+            "element_type",
+            lambda cursor: (
+                cursor.type.kind.spelling
+                if cursor.type.kind.spelling != "Invalid"
+                else None
+            ),
+        ),
+        (
+            "access_specifier",
+            lambda cursor: (
+                cursor.access_specifier.name
+                if cursor.access_specifier.name != "INVALID"
+                else None
+            ),
+        ),
+        ("result_type", lambda cursor: cursor.result_type.spelling or None),
+        ("brief_comment", lambda cursor: cursor.brief_comment or None),
+        ("raw_comment", lambda cursor: cursor.raw_comment or None),
+    ]
+    # add result of various kinds of checks available in cindex.py
+    + _checks(
+        ("kind_is_declaration", "kind.is_declaration"),
+        ("kind_is_reference", "kind.is_reference"),
+        ("kind_is_expression", "kind.is_expression"),
+        ("kind_is_statement", "kind.is_statement"),
+        ("kind_is_attribute", "kind.is_attribute"),
+        ("kind_is_invalid", "kind.is_invalid"),
+        ("kind_is_translation_unit", "kind.is_translation_unit"),
+        ("kind_is_preprocessing", "kind.is_preprocessing"),
+        ("kind_is_unexposed", "kind.is_unexposed"),
     )
+    # check for deleted ctor analogous to `is_default_constructor` unavailable
+    + _checks(
+        ("is_definition", "is_definition"),
+        ("is_const_method", "is_const_method"),
+        ("is_converting_constructor", "is_converting_constructor"),
+        ("is_copy_constructor", "is_copy_constructor"),
+        ("is_default_constructor", "is_default_constructor"),
+        ("is_move_constructor", "is_move_constructor"),
+        ("is_default_method", "is_default_method"),
+        ("is_mutable_field", "is_mutable_field"),
+        ("is_pure_virtual_method", "is_pure_virtual_method"),
+        ("is_static_method", "is_static_method"),
+        ("is_virtual_method", "is_virtual_method"),
+        ("is_abstract_record", "is_abstract_record"),
+        ("is_scoped_enum", "is_scoped_enum"),
+        ("is_anonymous", "is_anonymous"),
+        ("is_bitfield", "is_bitfield"),
+    )
+    + _checks(
+        ("type_is_const_qualified", "type.is_const_qualified"),
+        ("type_is_volatile_qualified", "type.is_volatile_qualified"),
+        ("type_is_restrict_qualified", "type.is_restrict_qualified"),
+        ("type_is_pod", "type.is_pod"),
+    )
+    + [
+        # special case handling for `cursor.type.is_function_variadic()`
+        (
+            "type_is_function_variadic",
+            lambda cursor: (
+                cursor.type.is_function_variadic()
+                if cursor.type.kind.spelling == "FunctionProto"
+                else None
+            ),
+        ),
+    ]
+)
 
-    # Get cursor's children and recursively print
-    for child_node in valid_children(node):
-        print_ast(child_node)
+"""
+Named sets of fields:
+    - minimal: just enough to walk the tree
+    - bindgen: the fields `generate.bind` reads
+    - full: everything
+"""
+FIELD_PROFILES = {
+    "minimal": ("line", "column", "kind", "name"),
+    "bindgen": (
+        "line",
+        "column",
+        "kind",
+        "name",
+        "element_type",
+        "access_specifier",
+        "result_type",
+        "type_is_pod",
+        "is_bitfield",
+        "is_const_method",
+    ),
+    "full": tuple(CURSOR_FIELDS),
+}
+
+
+def select_fields(fields="full", tokens=False):
+    """
+    Returns the fields to compute for each node
+
+    Parameters:
+        - fields: A profile name from `FIELD_PROFILES`, a comma separated string or a list of field names
+        - tokens (bool): Whether to add the `token_range` field
+
+    Returns:
+        - selected (list): (name, getter) pairs in output order; the getter of `token_range` is None
+    """
+
+    if isinstance(fields, str):
+        fields = FIELD_PROFILES.get(fields) or fields.split(",")
+    fields = {field.strip() for field in fields}
+
+    unknown = fields.difference(CURSOR_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    selected = []
+    for field, getter in CURSOR_FIELDS.items():
+        if field == "name" and tokens:
+            selected.append(("token_range", None))
+        if field in fields:
+            selected.append((field, getter))
+
+    return selected
+
+
+def get_cursor_info(cursor, depth, tree):
+    """
+    Returns the traits of a single node, without its members
+
+    - Only the fields selected for the tree are computed (see `select_fields`)
+
+    Parameters:
+        - cursor: The cursor pointing to a node
+        - depth: The depth of the node (root=0)
+        - tree (dict): The root node, for the keys shared by the whole tree (`fields`, `token_offsets`, `tokens`)
+
+    Returns:
+        - parsed_info (dict): Contains key-value pairs of various traits of a node
+    """
+
+    parsed_info = dict()
+
+    parsed_info["depth"] = depth
+
+    fields = tree.get("fields")
+    if fields is None:
+        fields = select_fields(tokens="token_offsets" in tree)
+
+    for field, get_field in fields:
+        # The TU's tokens are stored once, at the root; nodes refer to them by a [start, end) range
+        if get_field is None:
+            token_offsets = tree["token_offsets"]
+            if depth == 0:
+                parsed_info["tokens"] = tree["tokens"]
+            extent = cursor.extent
+            parsed_info["token_range"] = [
+                bisect.bisect_left(token_offsets, extent.start.offset),
+                bisect.bisect_left(token_offsets, extent.end.offset),
+            ]
+            continue
+
+        value = get_field(cursor)
+        if value is not None:
+            parsed_info[field] = value
+
+    return parsed_info
 
 
 def generate_parsed_info(node):
     """
-    Generates parsed information by recursively traversing the AST
+    Generates parsed information by traversing the AST
 
     Parameters:
         - node (dict):
@@ -81,6 +368,8 @@ def generate_parsed_info(node):
                     - The file's name to check if the node belongs to it
                     - Needed to ensure that only symbols belonging to the file gets parsed, not the included files' symbols
                 - depth: The depth of the node (root=0)
+                - token_offsets (optional): Start offsets of the TU's tokens, see `tokenize`
+                - tokens (optional, root only): Spellings of the TU's tokens
 
     Returns:
         - parsed_info (dict):
@@ -88,87 +377,112 @@ def generate_parsed_info(node):
             - The key 'members' contains the node's children's `parsed_info`
     """
 
-    parsed_info = dict()
+    def add_parsed_info(cursor, depth, parent_info):
+        parsed_info = get_cursor_info(cursor=cursor, depth=depth, tree=node)
+        parsed_info["members"] = []
 
-    cursor = node["cursor"]
-    depth = node["depth"]
+        # Add the node's info to its parent's, as a member
+        if parent_info is not None:
+            parent_info["members"].append(parsed_info)
 
-    parsed_info["depth"] = depth
-    parsed_info["line"] = cursor.location.line
-    parsed_info["column"] = cursor.location.column
-    parsed_info["kind"] = cursor.kind.name
-    parsed_info["tokens"] = [x.spelling for x in cursor.get_tokens()]
-
-    if cursor.is_anonymous():
-        parsed_info["kind"] = "ANONYMOUS_" + parsed_info["kind"]
-    parsed_info["name"] = cursor.spelling
-    if cursor.type.kind.spelling != "Invalid":
-        parsed_info["element_type"] = cursor.type.kind.spelling
-    if cursor.access_specifier.name != "INVALID":
-        parsed_info["access_specifier"] = cursor.access_specifier.name
-    if cursor.result_type.spelling != "":
-        parsed_info["result_type"] = cursor.result_type.spelling
-    if cursor.brief_comment:
-        parsed_info["brief_comment"] = cursor.brief_comment
-    if cursor.raw_comment:
-        parsed_info["raw_comment"] = cursor.raw_comment
+        return parsed_info
 
-    # add result of various kinds of checks available in cindex.py
+    return walk(node, pre_visit=add_parsed_info)
 
-    cursorkind_checks = {
-        "kind_is_declaration": cursor.kind.is_declaration,
-        "kind_is_reference": cursor.kind.is_reference,
-        "kind_is_expression": cursor.kind.is_expression,
-        "kind_is_statement": cursor.kind.is_statement,
-        "kind_is_attribute": cursor.kind.is_attribute,
-        "kind_is_invalid": cursor.kind.is_invalid,
-        "kind_is_translation_unit": cursor.kind.is_translation_unit,
-        "kind_is_preprocessing": cursor.kind.is_preprocessing,
-        "kind_is_unexposed": cursor.kind.is_unexposed,
-    }
 
-    # check for deleted ctor analogous to `is_default_constructor` unavailable
-    cursor_checks = {
-        "is_definition": cursor.is_definition,
-        "is_const_method": cursor.is_const_method,
-        "is_converting_constructor": cursor.is_converting_constructor,
-        "is_copy_constructor": cursor.is_copy_constructor,
-        "is_default_constructor": cursor.is_default_constructor,
-        "is_move_constructor": cursor.is_move_constructor,
-        "is_default_method": cursor.is_default_method,
-        "is_mutable_field": cursor.is_mutable_field,
-        "is_pure_virtual_method": cursor.is_pure_virtual_method,
-        "is_static_method": cursor.is_static_method,
-        "is_virtual_method": cursor.is_virtual_method,
-        "is_abstract_record": cursor.is_abstract_record,
-        "is_scoped_enum": cursor.is_scoped_enum,
-        "is_anonymous": cursor.is_anonymous,
-        "is_bitfield": cursor.is_bitfield,
-    }
+def generate_node_table(node):
+    """
+    Generates parsed information as a columnar `NodeTable`, without building a dict per node
 
-    type_checks = {
-        "type_is_const_qualified": cursor.type.is_const_qualified,
-        "type_is_volatile_qualified": cursor.type.is_volatile_qualified,
-        "type_is_restrict_qualified": cursor.type.is_restrict_qualified,
-        "type_is_pod": cursor.type.is_pod,
-    }
+    Parameters:
+        - node (dict): The root node, see `generate_parsed_info`
 
-    for checks in (cursorkind_checks, cursor_checks, type_checks):
-        for check, check_call in checks.items():
-            parsed_info[check] = check_call()
+    Returns:
+        - node_table (NodeTable): `node_table.root` can be used in place of `parsed_info`
+    """
+
+    node_table = NodeTable()
 
-    # special case handling for `cursor.type.is_function_variadic()`
-    if cursor.type.kind.spelling == "FunctionProto":
-        parsed_info["type_is_function_variadic"] = cursor.type.is_function_variadic()
+    def append_node(cursor, depth, parent_index):
+        return node_table.append(
+            get_cursor_info(cursor=cursor, depth=depth, tree=node),
+            parent=-1 if parent_index is None else parent_index,
+        )
 
-    parsed_info["members"] = []
+    def close_node(cursor, depth, index):
+        node_table.close(index)
 
-    # Get cursor's children and recursively add their info to a dictionary, as members of the parent
-    for child_node in valid_children(node):
-        child_parsed_info = generate_parsed_info(child_node)
-        parsed_info["members"].append(child_parsed_info)
+    walk(node, pre_visit=append_node, post_visit=close_node)
 
-    return parsed_info
+    return node_table
+
+
+def stream_parsed_info(node, file):
+    """
+    Writes parsed information as JSON to a file while traversing the AST
+
+    - Writes the same bytes as `utils.dump_json(generate_parsed_info(node))`, but only one
+      node's `parsed_info` is in memory at a time.
+
+    Parameters:
+        - node (dict): The root node, see `generate_parsed_info`
+        - file: A file object open for writing text
+
+    Returns:
+        - None
+    """
+
+    writer = utils.JsonTreeWriter(file=file)
+
+    def begin_node(cursor, depth, parent):
+        writer.begin_node(get_cursor_info(cursor=cursor, depth=depth, tree=node))
+
+    def end_node(cursor, depth, value):
+        writer.end_node()
+
+    walk(node, pre_visit=begin_node, post_visit=end_node)
+
+
+# CursorKind -> whether it is a statement or an expression, filled in lazily by `is_statement_or_expression`
+_statement_or_expression_kinds = {}
+
+
+def is_statement_or_expression(cursor):
+    """
+    Checks if a cursor is a statement or an expression, e.g. a function body or a default argument
+
+    - Used as the `prune` function when parsing for bindings, which need neither.
+    """
+
+    kind = cursor.kind
+    pruned = _statement_or_expression_kinds.get(kind)
+    if pruned is None:
+        pruned = kind.is_statement() or kind.is_expression()
+        _statement_or_expression_kinds[kind] = pruned
+    return pruned
+
+
+def tokenize(translation_unit):
+    """
+    Tokenizes a translation unit's main file, once
+
+    Parameters:
+        - translation_unit (clang.TranslationUnit)
+
+    Returns:
+        - (tokens, token_offsets):
+            - tokens (list): The tokens' spellings
+            - token_offsets (list): The tokens' (sorted) start offsets in the file,
+              used to turn a cursor's extent into a range of token indices
+    """
+
+    tokens = []
+    token_offsets = []
+    for token in translation_unit.get_tokens(extent=translation_unit.cursor.extent):
+        tokens.append(token.spelling)
+        token_offsets.append(token.extent.start.offset)
+
+    return tokens, token_offsets
 
 
 def get_compilation_commands(compilation_database_path, filename):
@@ -183,99 +497,600 @@ def get_compilation_commands(compilation_database_path, filename):
         - compilation commands (list): The arguments passed to the compiler
     """
 
-    # Build a compilation database found in the given directory
-    compilation_database = clang.CompilationDatabase.fromDirectory(
-        buildDir=compilation_database_path
+    # The database is loaded once per directory and shared by all parses in the process
+    compilation_database = CompilationDatabase.load(
+        compilation_database_path=compilation_database_path
     )
 
-    # Get compiler arguments from the compilation database for the given file
-    compilation_commands = compilation_database.getCompileCommands(filename=filename)
+    # Files without an entry (e.g. headers) borrow the arguments of the nearest file in their directory
+    return compilation_database.get_arguments(filename=filename)
+
+
+def parse_translation_unit(
+    source,
+    compilation_commands,
+    index=None,
+    ast_cache=None,
+    skip_function_bodies=False,
+    preprocessing=True,
+    reparseable=False,
+):
+    """
+    Returns the TranslationUnit for a file, reloading a saved one from `ast_cache` when still valid
+
+    Parameters:
+        - source: Source to parse
+        - compilation_commands (list): The arguments passed to the compiler
+        - index: The `clang.Index` to parse with, a new one is created if not provided
+        - ast_cache: An `AstCache` of saved TranslationUnits
+        - skip_function_bodies (bool): Whether to skip parsing function bodies
+        - preprocessing (bool): Whether to record inclusion directives and macros
+        - reparseable (bool): Whether the TranslationUnit will be `reparse`d, see `watch`
+
+    Returns:
+        - translation_unit (clang.TranslationUnit)
+    """
+
+    """
+    - option `PARSE_DETAILED_PROCESSING_RECORD`:
+        - Indicates that the parser should construct a detailed preprocessing record, 
+          including all macro definitions and instantiations.
+        - Required to get the `INCLUSION_DIRECTIVE`s.
+    - option `PARSE_SKIP_FUNCTION_BODIES`:
+        - Function bodies aren't parsed; only their declarations are needed for bindings.
+    - option `PARSE_PRECOMPILED_PREAMBLE`:
+        - The included headers are precompiled on the first reparse, later reparses of an
+          edited source only parse the source itself.
+    """
+    options = 0
+    if preprocessing:
+        options |= clang.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD
+    if skip_function_bodies:
+        options |= clang.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES
+    if reparseable:
+        options |= clang.TranslationUnit.PARSE_PRECOMPILED_PREAMBLE
+
+    # Create a new index to start parsing
+    if index is None:
+        index = clang.Index.create()
+
+    if ast_cache:
+        source_ast = ast_cache.get(
+            source=source,
+            arguments=compilation_commands,
+            index=index,
+            options={"parse_options": options},
+        )
+        if source_ast is not None:
+            return source_ast
+
+    # Parse the given source code file by running clang and generating the AST before loading
+    source_ast = index.parse(path=source, args=compilation_commands, options=options)
 
+    if ast_cache:
+        ast_cache.put(
+            source=source,
+            arguments=compilation_commands,
+            translation_unit=source_ast,
+            options={"parse_options": options},
+        )
+
+    return source_ast
+
+
+def get_translation_unit_info(
+    translation_unit,
+    tokens=True,
+    output_filepath=None,
+    fields="full",
+    skip_function_bodies=False,
+):
     """
-    - compilation_commands:
-        - An iterable object providing all the compilation commands available to build filename.
-        - type: <class 'clang.cindex.CompileCommands'>
-    - compilation_commands[0]:
-        - Since we have only one command per filename in the compile_commands.json, extract 0th element
-        - type: <class 'clang.cindex.CompileCommand'>
-    - compilation_commands[0].arguments:
-        - Get compiler arguments from the CompileCommand object
-        - type: <class 'generator'>
-    - list(compilation_commands[0].arguments)[1:-1]:
-        - Convert the generator object to list, and extract compiler arguments
-        - 0th element is the compiler name
-        - nth element is the filename
+    Returns the parsed_info for an already parsed TranslationUnit, or streams it to a JSON file
+
+    - See `parse_file` for the parameters
     """
 
-    return list(compilation_commands[0].arguments)[1:-1]
+    # Dictionary to hold a node's information
+    root_node = {
+        "cursor": translation_unit.cursor,
+        "filename": translation_unit.spelling,
+        "depth": 0,
+        "fields": select_fields(fields=fields, tokens=tokens),
+    }
+
+    if skip_function_bodies:
+        root_node["prune"] = is_statement_or_expression
+
+    if tokens:
+        root_node["tokens"], root_node["token_offsets"] = tokenize(translation_unit)
+
+    # For testing purposes
+    # print_ast(root_node)
 
+    if output_filepath:
+        with utils.open_if_changed(output_filepath) as f:
+            stream_parsed_info(node=root_node, file=f)
+        return None
 
-def parse_file(source, compilation_database_path=None):
+    return generate_parsed_info(root_node)
+
+
+def parse_file(
+    source,
+    compilation_database_path=None,
+    index=None,
+    cache=None,
+    ast_cache=None,
+    tokens=True,
+    output_filepath=None,
+    fields="full",
+    skip_function_bodies=False,
+    preprocessing=True,
+    symbol_index=None,
+):
     """
-    Returns the parsed_info for a file
+    Returns the parsed_info for a file, or streams it to a JSON file
 
     Parameters:
         - source: Source to parse
         - compilation_database_path: The path to `compile_commands.json`
+        - index: The `clang.Index` to parse with, a new one is created if not provided
+        - cache: A `ParseCache` to look the result up in (and store it to), skipping libclang on a hit
+        - ast_cache: An `AstCache` to reload the TranslationUnit from instead of reparsing
+        - tokens (bool): Whether to output the TU's tokens (and each node's `token_range` into them)
+        - output_filepath:
+            - If given, the parsed_info is written to this JSON file while traversing the AST
+              (see `stream_parsed_info`) instead of being built in memory
+        - fields: The traits to compute for each node: a profile name (`minimal`, `bindgen`, `full`)
+          or a list of field names, see `select_fields`
+        - skip_function_bodies (bool):
+            - Parse for bindings: function bodies are skipped by libclang, and statements and
+              expressions (bodies, initializers, default arguments) are left out of the output
+        - preprocessing (bool): Whether to output inclusion directives and macros
+        - symbol_index: A `SymbolIndex` to record the file's declarations in. A `cache` hit
+          doesn't reparse, so it is only used for files already in the index.
 
     Returns:
-        - parsed_info (dict)
+        - parsed_info (dict), or None if `output_filepath` is given
     """
 
-    # Create a new index to start parsing
-    index = clang.Index.create()
-
     # Get compiler arguments
     compilation_commands = get_compilation_commands(
         compilation_database_path=compilation_database_path,
         filename=source,
     )
 
+    selected_fields = select_fields(fields=fields, tokens=tokens)
+
+    # Options affecting the output, part of the cache key
+    options = {
+        "fields": [field for field, _ in selected_fields],
+        "skip_function_bodies": skip_function_bodies,
+        "preprocessing": preprocessing,
+    }
+
+    if cache and (symbol_index is None or source in symbol_index):
+        parsed_info = cache.get(
+            source=source, arguments=compilation_commands, options=options
+        )
+        if parsed_info is not None:
+            if output_filepath:
+                utils.dump_json(filepath=output_filepath, info=parsed_info)
+                return None
+            return parsed_info
+
+    source_ast = parse_translation_unit(
+        source=source,
+        compilation_commands=compilation_commands,
+        index=index,
+        ast_cache=ast_cache,
+        skip_function_bodies=skip_function_bodies,
+        preprocessing=preprocessing,
+    )
+
+    if symbol_index is not None:
+        symbol_index.add_translation_unit(translation_unit=source_ast, source=source)
+
+    parsed_info = get_translation_unit_info(
+        translation_unit=source_ast,
+        tokens=tokens,
+        output_filepath=output_filepath,
+        fields=fields,
+        skip_function_bodies=skip_function_bodies,
+    )
+
+    if cache:
+        includes = [inclusion.include.name for inclusion in source_ast.get_includes()]
+        if output_filepath:
+            cache.put_file(
+                source=source,
+                arguments=compilation_commands,
+                includes=includes,
+                filepath=output_filepath,
+                options=options,
+            )
+        else:
+            cache.put(
+                source=source,
+                arguments=compilation_commands,
+                includes=includes,
+                parsed_info=parsed_info,
+                options=options,
+            )
+
+    return parsed_info
+
+
+def parse_project(
+    compilation_database_path,
+    index=None,
+    ast_cache=None,
+    tokens=True,
+    fields="full",
+    skip_function_bodies=False,
+    preprocessing=True,
+    is_project_header=None,
+):
     """
-    - Parse the given source code file by running clang and generating the AST before loading
-    - option `PARSE_DETAILED_PROCESSING_RECORD`:
-        - Indicates that the parser should construct a detailed preprocessing record, 
-          including all macro definitions and instantiations.
-        - Required to get the `INCLUSION_DIRECTIVE`s.
+    Parses every file in a compilation database, emitting each project header's declarations once
+
+    - Sources are parsed in sorted order. A header is owned by the first source including it
+      (directly or not): its declarations are emitted from that source's TranslationUnit, and
+      it isn't traversed again for the sources parsed after.
+    - A header's parsed_info has the same layout as a source's, its root's `name` is the header.
+    - Tokens are only output for sources, `tokenize` covers the main file of a TranslationUnit.
+
+    Parameters:
+        - compilation_database_path: The path to `compile_commands.json`
+        - is_project_header (function):
+            - Returns True for the (real) paths of the headers to emit
+            - Defaults to the headers under the deepest directory containing all the sources,
+              so system and third party headers are left out
+        - See `parse_file` for the other parameters
+
+    Yields:
+        - (filename, parsed_info): For each source, followed by the headers it owns
     """
-    source_ast = index.parse(
-        path=source,
-        args=compilation_commands,
-        options=clang.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD,
+
+    compilation_database = CompilationDatabase.load(
+        compilation_database_path=compilation_database_path
     )
+    sources = compilation_database.files()
+    if not sources:
+        return
 
-    # Dictionary to hold a node's information
-    root_node = {
-        "cursor": source_ast.cursor,
-        "filename": source_ast.spelling,
-        "depth": 0,
-    }
+    if is_project_header is None:
+        project_root = os.path.commonpath([os.path.dirname(path) for path in sources])
 
-    # For testing purposes
-    # print_ast(root_node)
+        def is_project_header(path):
+            return path.startswith(project_root + os.sep)
 
-    return generate_parsed_info(root_node)
+    owned = set(sources)  # sources own themselves
+    for source in sources:
+        source_ast = parse_translation_unit(
+            source=source,
+            compilation_commands=compilation_database.get_arguments(filename=source),
+            index=index,
+            ast_cache=ast_cache,
+            skip_function_bodies=skip_function_bodies,
+            preprocessing=preprocessing,
+        )
+
+        # (realpath, filename as spelled by libclang, which `in_file` compares against)
+        files = [(source, source_ast.spelling)]
+        for inclusion in source_ast.get_includes():
+            header = utils.get_realpath(path=inclusion.include.name)
+            if header not in owned and is_project_header(header):
+                owned.add(header)
+                files.append((header, inclusion.include.name))
+
+        prune = is_statement_or_expression if skip_function_bodies else None
+
+        # One pass over the TU's top level cursors, grouped by file: each file's group is then
+        # walked, instead of filtering all the top level cursors again for every file
+        groups = {filename: [] for _, filename in files}
+        for cursor in source_ast.cursor.get_children():
+            file = cursor.location.file
+            group = groups.get(file.name) if file is not None else None
+            if group is not None and not (prune and prune(cursor)):
+                group.append(cursor)
+
+        for filepath, filename in files:
+            is_source = filepath == source
+            root_node = {
+                "cursor": source_ast.cursor,
+                "filename": filename,
+                "depth": 0,
+                "fields": select_fields(fields=fields, tokens=tokens and is_source),
+                "children": groups[filename],
+            }
+
+            if prune:
+                root_node["prune"] = prune
+
+            if tokens and is_source:
+                root_node["tokens"], root_node["token_offsets"] = tokenize(source_ast)
+
+            parsed_info = generate_parsed_info(root_node)
+            if not is_source and "name" in parsed_info:
+                parsed_info["name"] = filename
+
+            yield filepath, parsed_info
+
+
+def get_json_output_path(source, json_output_path, extension=".json"):
+    """
+    Returns the path of the JSON file to dump a source's parsed info to
+
+    Parameters:
+        - source: The source's realpath
+        - json_output_path: The directory under which the `json` output directory is
+        - extension: Output extension, `binary.EXTENSION` for the binary format
+    """
+
+    return utils.get_output_path(
+        source=source,
+        output_dir=utils.join_path(json_output_path, "json"),
+        split_from="pcl",
+        extension=extension,
+    )
+
+
+# Index owned by the current (worker) process, reused across all the files it parses
+_worker_index = None
+
+
+def init_worker():
+    """
+    Creates the `clang.Index` used by `parse_worker` in the current process
+    """
+
+    global _worker_index
+    _worker_index = clang.Index.create()
+
+
+def parse_worker(
+    source,
+    compilation_database_path=None,
+    cache=None,
+    ast_cache=None,
+    tokens=True,
+    stream_to=None,
+    fields="full",
+    skip_function_bodies=False,
+    preprocessing=True,
+    symbol_index_path=None,
+):
+    """
+    Returns the parsed_info for a file, using the current process' index
+
+    - Used as the task function for `utils.parallel_map`, hence module level (picklable)
+    - If `stream_to` (a `json_output_path`) is given, the parsed_info is streamed to the
+      source's JSON output file by the worker and None is returned
+    - If `symbol_index_path` is given, the file's declarations are recorded in that `SymbolIndex`
+    """
+
+    symbol_index = symbol_index_path and SymbolIndex(index_path=symbol_index_path)
+    try:
+        return parse_file(
+            source=source,
+            compilation_database_path=compilation_database_path,
+            index=_worker_index,
+            cache=cache,
+            ast_cache=ast_cache,
+            tokens=tokens,
+            output_filepath=stream_to
+            and get_json_output_path(source=source, json_output_path=stream_to),
+            fields=fields,
+            skip_function_bodies=skip_function_bodies,
+            preprocessing=preprocessing,
+            symbol_index=symbol_index,
+        )
+    finally:
+        if symbol_index:
+            symbol_index.close()
+
+
+def dump_parsed_info(source, parsed_info, json_output_path, output_format="json"):
+    """
+    Writes a source's parsed info to its output file, see `get_json_output_path`
+
+    Parameters:
+        - output_format: `json`, or `binary` for an AST store (see `ast_store`)
+    """
+
+    if output_format == "binary":
+        ast_store.dump_store(
+            filepath=get_json_output_path(
+                source=source,
+                json_output_path=json_output_path,
+                extension=binary.EXTENSION,
+            ),
+            info=parsed_info,
+        )
+    else:
+        utils.dump_json(
+            filepath=get_json_output_path(
+                source=source, json_output_path=json_output_path
+            ),
+            info=parsed_info,
+        )
+
+
+def watch(sources, args):
+    """
+    Parses the sources, then keeps their TranslationUnits warm and re-emits the parsed info
+    (and the bindings, if `args.pybind11_output_path` is given) of each one whose files change
+
+    Parameters:
+        - sources (list): The sources' realpaths
+        - args: The parsed command line arguments
+    """
+
+    index = clang.Index.create()
+    compilation_database = CompilationDatabase.load(
+        compilation_database_path=args.compilation_database_path
+    )
+
+    def parse_source(source):
+        return parse_translation_unit(
+            source=source,
+            compilation_commands=compilation_database.get_arguments(filename=source),
+            index=index,
+            skip_function_bodies=args.skip_function_bodies,
+            preprocessing=not args.no_preprocessing,
+            reparseable=True,
+        )
+
+    def emit(source, translation_unit):
+        parsed_info = get_translation_unit_info(
+            translation_unit=translation_unit,
+            tokens=not args.no_tokens,
+            fields=args.fields,
+            skip_function_bodies=args.skip_function_bodies,
+        )
+        dump_parsed_info(
+            source=source,
+            parsed_info=parsed_info,
+            json_output_path=args.json_output_path,
+            output_format=args.output_format,
+        )
+        if args.pybind11_output_path:
+            cpp_path = generate.get_cpp_output_path(
+                source=get_json_output_path(
+                    source=source, json_output_path=args.json_output_path
+                ),
+                pybind11_output_path=args.pybind11_output_path,
+            )
+            opaque_types = []
+            utils.write_to_file(
+                filename=cpp_path,
+                linelist=generate.generate(
+                    module_name="pcl",
+                    parsed_info=parsed_info,
+                    opaque_types=opaque_types,
+                ),
+            )
+            generate.update_opaque_header(
+                pybind11_output_path=args.pybind11_output_path,
+                opaque_types={cpp_path: opaque_types},
+            )
+
+    watcher = Watcher(
+        parse_source=parse_source, on_change=emit, interval=args.watch_interval
+    )
+    for source in sources:
+        watcher.add(source)
+    print(f"Watching {len(sources)} files, Ctrl+C to stop", file=sys.stderr)
+    watcher.run()
 
 
 def main():
     # Get command line arguments
     args = utils.parse_arguments(script="parse")
-    for source in args.files:
-        source = utils.get_realpath(path=source)
+    if args.stream and args.output_format != "json":
+        sys.exit("--stream is only supported for the json output format")
+    if args.project and (args.files or args.stream):
+        sys.exit("--project parses the whole compilation database, without --stream")
+    if args.project and (args.jobs != 1 or args.cache_path or args.symbol_index_path):
+        # Sequential, as header ownership depends on the parse order, and without those caches
+        sys.exit(
+            "--project parses sequentially, without --jobs, --cache_path or --symbol_index_path"
+        )
+    if not (args.project or args.files):
+        sys.exit("Provide the files to parse, or --project")
+    if args.watch and (args.project or args.stream):
+        sys.exit("--watch can't be combined with --project or --stream")
+    sources = [utils.get_realpath(path=source) for source in args.files]
 
-        # Parse the source file
-        parsed_info = parse_file(source, args.compilation_database_path)
+    if args.watch:
+        watch(sources=sources, args=args)
+        return
 
-        # Output path for dumping the parsed info into a json file
-        output_filepath = utils.get_output_path(
-            source=source,
-            output_dir=utils.join_path(args.json_output_path, "json"),
-            split_from="pcl",
-            extension=".json",
+    # Load the compilation database up front; forked workers inherit the loaded index
+    CompilationDatabase.load(compilation_database_path=args.compilation_database_path)
+
+    cache = None
+    if args.cache_path:
+        cache = ParseCache(
+            cache_path=args.cache_path,
+            max_size=args.cache_max_size and args.cache_max_size * 1024**2,
+            max_age=args.cache_max_age and args.cache_max_age * 24 * 60 * 60,
+        )
+
+    ast_cache = None
+    if args.ast_cache_path:
+        ast_cache = AstCache(
+            cache_path=args.ast_cache_path,
+            max_size=args.cache_max_size and args.cache_max_size * 1024**2,
+            max_age=args.cache_max_age and args.cache_max_age * 24 * 60 * 60,
         )
 
+    if args.project:
+        # Sequential: which source owns a header depends on the sources parsed before it
+        for filepath, parsed_info in parse_project(
+            compilation_database_path=args.compilation_database_path,
+            ast_cache=ast_cache,
+            tokens=not args.no_tokens,
+            fields=args.fields,
+            skip_function_bodies=args.skip_function_bodies,
+            preprocessing=not args.no_preprocessing,
+        ):
+            dump_parsed_info(
+                source=filepath,
+                parsed_info=parsed_info,
+                json_output_path=args.json_output_path,
+                output_format=args.output_format,
+            )
+        if ast_cache:
+            ast_cache.prune()
+        return
+
+    # Parse the source files, `args.jobs` at a time; results arrive in the order of `sources`
+    results = utils.parallel_map(
+        function=functools.partial(
+            parse_worker,
+            compilation_database_path=args.compilation_database_path,
+            cache=cache,
+            ast_cache=ast_cache,
+            tokens=not args.no_tokens,
+            stream_to=args.json_output_path if args.stream else None,
+            fields=args.fields,
+            skip_function_bodies=args.skip_function_bodies,
+            preprocessing=not args.no_preprocessing,
+            symbol_index_path=args.symbol_index_path,
+        ),
+        items=sources,
+        jobs=args.jobs,
+        initializer=init_worker,
+    )
+
+    failed = []
+    for source, parsed_info, error in results:
+        if error:
+            failed.append(source)
+            print(f"Failed to parse {source}: {error!r}", file=sys.stderr)
+            continue
+
+        # Already written by the worker
+        if args.stream:
+            continue
+
         # Dump the parsed info at output path
-        utils.dump_json(filepath=output_filepath, info=parsed_info)
+        dump_parsed_info(
+            source=source,
+            parsed_info=parsed_info,
+            json_output_path=args.json_output_path,
+            output_format=args.output_format,
+        )
+
+    for parse_cache in (cache, ast_cache):
+        if parse_cache:
+            parse_cache.prune()
+
+    if failed:
+        sys.exit(f"{len(failed)} of {len(sources)} files failed to parse")
 
 
 if __name__ == "__main__":
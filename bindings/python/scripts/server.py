@@ -0,0 +1,350 @@
+"""
+Local parse server, keeping libclang and recently parsed TranslationUnits warm across clients.
+
+Protocol, over a Unix socket: one JSON request per line, `{"method": ..., "params": {...}}`,
+answered by one JSON line, `{"result": ...}` or `{"error": ...}`. Methods:
+    - `parse_file`: params as `parse.parse_file` (source, compilation_database_path, tokens,
+      fields, skip_function_bodies, preprocessing), returns the parsed_info
+    - `generate`: params as `generate.generate`, returns the lines of the binding file
+"""
+
+import os
+import json
+import socket
+import threading
+import socketserver
+import collections
+import clang.cindex as clang
+
+from context import scripts
+import scripts.utils as utils
+import scripts.parse as parse
+import scripts.generate as generate
+from scripts.watch import get_mtime
+
+
+class PooledTranslationUnit:
+    """
+    A TranslationUnit of a `TranslationUnitPool`, with what was computed from it.
+
+    - `lock` guards the TranslationUnit and `parsed_infos`: held while traversing it, and by the
+      pool while reparsing it.
+    - `parsed_infos` maps the traversal options to their parsed_info, emptied on reparse: an
+      entry is valid for the `dependencies` the TranslationUnit was parsed with.
+    """
+
+    def __init__(self, translation_unit, dependencies: dict) -> None:
+        self.translation_unit = translation_unit
+        self.dependencies = dependencies  # {dependency: mtime}
+        self.lock = threading.Lock()
+        self.parsed_infos = {}
+
+
+class TranslationUnitPool:
+    """
+    Least recently used TranslationUnits, reparsed when their files change.
+
+    How to use:
+        - pool = TranslationUnitPool(max_size=32)
+        - pooled = pool.get(source, arguments, skip_function_bodies=..., preprocessing=...)
+        - with pooled.lock: use pooled.translation_unit
+
+    - Not thread-safe: calls to `get` must be serialized, e.g. by a lock.
+    """
+
+    def __init__(self, max_size: int = 32, index=None) -> None:
+        self.max_size = max_size
+        self.index = index or clang.Index.create()
+        self.hits = 0
+        self.reparses = 0
+        # (source, arguments, parse flags) -> PooledTranslationUnit
+        self._entries = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _dependencies(source: str, translation_unit, mtimes: dict) -> dict:
+        filepaths = [source] + [
+            utils.get_realpath(path=inclusion.include.name)
+            for inclusion in translation_unit.get_includes()
+        ]
+        return {
+            filepath: mtimes[filepath] if filepath in mtimes else get_mtime(filepath)
+            for filepath in filepaths
+        }
+
+    def get(
+        self,
+        source: str,
+        arguments: list,
+        skip_function_bodies: bool = False,
+        preprocessing: bool = True,
+    ) -> PooledTranslationUnit:
+        """
+        Returns an up to date TranslationUnit for a source: the pooled one, reparsed if any of
+        its files changed, or a new one (evicting the least recently used beyond `max_size`).
+
+        - Waits for the pooled one's lock to reparse it, the caller must not hold it.
+        """
+
+        key = (source, tuple(arguments), skip_function_bodies, preprocessing)
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            self._entries.move_to_end(key)
+            mtimes = {filepath: get_mtime(filepath) for filepath in entry.dependencies}
+            if mtimes == entry.dependencies:
+                self.hits += 1
+                return entry
+
+            with entry.lock:
+                try:
+                    entry.translation_unit.reparse()
+                except clang.TranslationUnitLoadError:
+                    del self._entries[key]
+                else:
+                    self.reparses += 1
+                    entry.dependencies = self._dependencies(
+                        source, entry.translation_unit, mtimes
+                    )
+                    entry.parsed_infos.clear()
+                    return entry
+
+        mtimes = {source: get_mtime(source)}
+        translation_unit = parse.parse_translation_unit(
+            source=source,
+            compilation_commands=arguments,
+            index=self.index,
+            skip_function_bodies=skip_function_bodies,
+            preprocessing=preprocessing,
+            reparseable=True,
+        )
+        entry = PooledTranslationUnit(
+            translation_unit=translation_unit,
+            dependencies=self._dependencies(source, translation_unit, mtimes),
+        )
+        self._entries[key] = entry
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+        return entry
+
+
+class ParseServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves `parse_file` and `generate` requests on a Unix socket.
+
+    How to use:
+        - server = ParseServer(socket_path, compilation_database_path)
+        - server.serve_forever(), then server.server_close() to remove the socket
+
+    - Clients are served concurrently. Parsing goes through the pool under a global lock,
+      traversing a TranslationUnit only holds its own lock: requests for different sources
+      don't wait for each other's traversal.
+    - The parsed_info is cached per TranslationUnit and traversal options, until the
+      TranslationUnit is reparsed.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path: str,
+        compilation_database_path: str = None,
+        max_translation_units: int = 32,
+    ) -> None:
+        """
+        Parameters:
+            - socket_path (str): The Unix socket to listen on, replaced if no server uses it
+            - compilation_database_path (str): Default for requests without one
+            - max_translation_units (int): TranslationUnits kept warm, see `TranslationUnitPool`
+        """
+
+        self.socket_path = socket_path
+        self.compilation_database_path = compilation_database_path
+        self.pool = TranslationUnitPool(max_size=max_translation_units)
+        self.cache_hits = 0
+        self._lock = threading.Lock()  # guards the pool
+
+        if os.path.exists(socket_path):
+            with ParseClient(socket_path) as client:
+                if client.connected():
+                    raise OSError(f"A server is already listening on {socket_path}")
+            os.remove(socket_path)
+        super().__init__(socket_path, _RequestHandler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def parse_file(
+        self,
+        source: str,
+        compilation_database_path: str = None,
+        tokens: bool = True,
+        fields="full",
+        skip_function_bodies: bool = False,
+        preprocessing: bool = True,
+    ) -> dict:
+        source = utils.get_realpath(path=source)
+
+        with self._lock:
+            arguments = parse.get_compilation_commands(
+                compilation_database_path=compilation_database_path
+                or self.compilation_database_path,
+                filename=source,
+            )
+            pooled = self.pool.get(
+                source=source,
+                arguments=arguments,
+                skip_function_bodies=skip_function_bodies,
+                preprocessing=preprocessing,
+            )
+
+        options = (tokens, json.dumps(fields, sort_keys=True))
+        with pooled.lock:
+            parsed_info = pooled.parsed_infos.get(options)
+            if parsed_info is not None:
+                self.cache_hits += 1
+                return parsed_info
+
+            parsed_info = parse.get_translation_unit_info(
+                translation_unit=pooled.translation_unit,
+                tokens=tokens,
+                fields=fields,
+                skip_function_bodies=skip_function_bodies,
+            )
+            pooled.parsed_infos[options] = parsed_info
+            return parsed_info
+
+    def generate(self, **params) -> list:
+        return generate.generate(**params)
+
+    def handle_request_line(self, line: bytes) -> bytes:
+        """
+        Returns the response line for a request line.
+        """
+
+        try:
+            request = json.loads(line)
+            method = {"parse_file": self.parse_file, "generate": self.generate}[
+                request["method"]
+            ]
+            response = {"result": method(**request.get("params", {}))}
+        except Exception as error:
+            response = {"error": f"{type(error).__name__}: {error}"}
+
+        return json.dumps(response, separators=(",", ":")).encode() + b"\n"
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        for line in self.rfile:
+            self.wfile.write(self.server.handle_request_line(line))
+            self.wfile.flush()
+
+
+class ParseClient:
+    """
+    Client for a `ParseServer`, falling back to parsing in-process when no server is running.
+
+    How to use:
+        - client = ParseClient(socket_path)
+        - parsed_info = client.parse_file(source, compilation_database_path=...)
+        - lines_to_write = client.generate(module_name="pcl", source=...)
+    """
+
+    def __init__(self, socket_path: str) -> None:
+        self.socket_path = socket_path
+        self._socket = None
+        self._file = None
+
+    def close(self) -> None:
+        if self._socket:
+            self._file.close()
+            self._socket.close()
+            self._socket = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def connected(self) -> bool:
+        """
+        Connects to the server if not connected yet, returns False if there is no server.
+        """
+
+        if self._socket is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                connection.connect(self.socket_path)
+            except OSError:
+                connection.close()
+                return False
+            self._socket = connection
+            self._file = connection.makefile("rwb")
+
+        return True
+
+    def request(self, method: str, **params):
+        """
+        Sends a request to the server and returns its result, raising RuntimeError with the
+        server's error message if it failed.
+        """
+
+        self._file.write(
+            json.dumps({"method": method, "params": params}).encode() + b"\n"
+        )
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            self.close()
+            raise ConnectionError("The parse server closed the connection")
+
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def parse_file(self, source: str, **params) -> dict:
+        """
+        Returns the parsed_info for a file, see `parse.parse_file` for the parameters.
+        """
+
+        if self.connected():
+            return self.request("parse_file", source=source, **params)
+        return parse.parse_file(source=source, **params)
+
+    def generate(self, module_name: str, **params) -> list:
+        """
+        Returns the binding lines, see `generate.generate` for the parameters.
+        """
+
+        if self.connected():
+            return self.request("generate", module_name=module_name, **params)
+        return generate.generate(module_name=module_name, **params)
+
+
+def main():
+    args = utils.parse_arguments(script="server")
+
+    server = ParseServer(
+        socket_path=args.socket_path,
+        compilation_database_path=args.compilation_database_path,
+        max_translation_units=args.max_translation_units,
+    )
+    print(f"Serving on {args.socket_path}, Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+import sqlite3
+import clang.cindex as clang
+
+from context import scripts
+import scripts.utils as utils
+
+_schema = """
+CREATE TABLE IF NOT EXISTS symbols (
+    usr TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    file TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    column INTEGER NOT NULL,
+    is_definition INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS symbols_by_name ON symbols (name, kind);
+CREATE INDEX IF NOT EXISTS symbols_by_file ON symbols (file);
+
+CREATE TABLE IF NOT EXISTS translation_units (
+    source TEXT PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS symbol_references (
+    source TEXT NOT NULL,
+    usr TEXT NOT NULL,
+    PRIMARY KEY (source, usr)
+);
+CREATE INDEX IF NOT EXISTS symbol_references_by_usr ON symbol_references (usr);
+
+CREATE TABLE IF NOT EXISTS bases (
+    usr TEXT NOT NULL,
+    base_usr TEXT NOT NULL,
+    PRIMARY KEY (usr, base_usr)
+);
+CREATE INDEX IF NOT EXISTS bases_by_base ON bases (base_usr);
+
+CREATE TABLE IF NOT EXISTS files (
+    file TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+);
+"""
+
+# Declarations whose contents can be spread over several files, traversed even in unchanged files
+_open_scope_kinds = {
+    clang.CursorKind.NAMESPACE,
+    clang.CursorKind.LINKAGE_SPEC,
+}
+
+
+class SymbolIndex:
+    """
+    Project-wide index of declarations, keyed by USR, in an SQLite file.
+
+    How to use:
+        - with SymbolIndex(index_path) as symbol_index:
+            - symbol_index.add_translation_unit(translation_unit)
+            - symbol_index.find(name="PointXYZ", kind="STRUCT_DECL"): where it is declared
+            - symbol_index.bases(usr), symbol_index.translation_units(usr), ...
+
+    - Each declaration is stored once, at its definition if one was seen (else its first declaration).
+    - A translation unit only records references to the declarations it sees.
+    - Each indexed file's digest is stored. A file whose contents are unchanged (e.g. a header
+      included by many sources) isn't traversed again, its declarations are only referenced.
+      A changed file's declarations are all deleted and indexed again.
+    - The file can be shared by concurrent processes, writes are serialized by SQLite.
+    """
+
+    def __init__(self, index_path: str, timeout: float = 60) -> None:
+        """
+        Parameters:
+            - index_path (str): The SQLite file, created if it doesn't exist
+            - timeout (float): Seconds to wait for another process' write to finish
+        """
+
+        self.index_path = index_path
+        self._connection = sqlite3.connect(index_path, timeout=timeout)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.executescript(_schema)
+        self._digests = utils.FileDigests()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __contains__(self, source: str) -> bool:
+        """
+        Checks if a translation unit (source file) is indexed.
+        """
+
+        return (
+            self._connection.execute(
+                "SELECT 1 FROM translation_units WHERE source = ?",
+                (utils.get_realpath(path=source),),
+            ).fetchone()
+            is not None
+        )
+
+    def add_translation_unit(
+        self, translation_unit: clang.TranslationUnit, source: str = None
+    ) -> None:
+        """
+        Records the declarations seen by a translation unit, replacing its previous references.
+
+        Parameters:
+            - translation_unit (clang.TranslationUnit): The parsed source
+            - source (str): The source's path, the translation unit's spelling by default
+        """
+
+        source = utils.get_realpath(path=source or translation_unit.spelling)
+        symbols = []
+        references = set()
+        bases = set()
+        # file name -> (realpath, digest, whether it changed since it was indexed)
+        files = {}
+
+        def get_file(name):
+            if name not in files:
+                filepath = utils.get_realpath(path=name)
+                digest = self._digests.get(filepath) or ""
+                row = self._connection.execute(
+                    "SELECT digest FROM files WHERE file = ?", (filepath,)
+                ).fetchone()
+                files[name] = (filepath, digest, row is None or row["digest"] != digest)
+            return files[name]
+
+        # Explicit stack of (cursor, USR of the enclosing declaration)
+        stack = [(child, None) for child in translation_unit.cursor.get_children()]
+        stack.reverse()
+
+        while stack:
+            cursor, parent_usr = stack.pop()
+            kind = cursor.kind
+            file = cursor.location.file
+            if file is None or kind.is_statement() or kind.is_expression():
+                continue
+
+            filepath, _, changed = get_file(file.name)
+            if not changed:
+                # Referenced through the file's indexed symbols, but the file may include others
+                if kind in _open_scope_kinds:
+                    children = [(child, None) for child in cursor.get_children()]
+                    children.reverse()
+                    stack.extend(children)
+                continue
+
+            if kind == clang.CursorKind.CXX_BASE_SPECIFIER:
+                base = cursor.referenced
+                if parent_usr and base is not None and base.get_usr():
+                    bases.add((parent_usr, base.get_usr()))
+                continue
+
+            usr = cursor.get_usr() if kind.is_declaration() else ""
+            if usr:
+                references.add(usr)
+                symbols.append(
+                    (
+                        usr,
+                        kind.name,
+                        cursor.spelling,
+                        filepath,
+                        cursor.location.line,
+                        cursor.location.column,
+                        int(cursor.is_definition()),
+                    )
+                )
+
+            children = [(child, usr or parent_usr) for child in cursor.get_children()]
+            children.reverse()
+            stack.extend(children)
+
+        changed_files = sorted(
+            (filepath, digest)
+            for filepath, digest, changed in files.values()
+            if changed
+        )
+        unchanged_files = sorted(
+            filepath for filepath, _, changed in files.values() if not changed
+        )
+
+        with self._connection:
+            for filepath, digest in changed_files:
+                self._connection.execute(
+                    """
+                    DELETE FROM bases WHERE usr IN (SELECT usr FROM symbols WHERE file = ?)
+                    """,
+                    (filepath,),
+                )
+                self._connection.execute(
+                    "DELETE FROM symbols WHERE file = ?", (filepath,)
+                )
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?)", (filepath, digest)
+                )
+            self._connection.executemany(
+                """
+                INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (usr) DO UPDATE SET
+                    kind = excluded.kind, name = excluded.name, file = excluded.file,
+                    line = excluded.line, column = excluded.column,
+                    is_definition = excluded.is_definition
+                WHERE excluded.is_definition > symbols.is_definition
+                """,
+                symbols,
+            )
+            for filepath in unchanged_files:
+                references.update(
+                    row["usr"]
+                    for row in self._connection.execute(
+                        "SELECT usr FROM symbols WHERE file = ?", (filepath,)
+                    )
+                )
+            self._connection.execute(
+                "INSERT OR IGNORE INTO translation_units VALUES (?)", (source,)
+            )
+            self._connection.execute(
+                "DELETE FROM symbol_references WHERE source = ?", (source,)
+            )
+            self._connection.executemany(
+                "INSERT INTO symbol_references VALUES (?, ?)",
+                ((source, usr) for usr in sorted(references)),
+            )
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO bases VALUES (?, ?)", sorted(bases)
+            )
+
+    @staticmethod
+    def _symbol(row) -> dict:
+        symbol = dict(row)
+        symbol["is_definition"] = bool(symbol["is_definition"])
+        return symbol
+
+    def _symbols(self, query: str, parameters: tuple) -> list:
+        return [
+            self._symbol(row) for row in self._connection.execute(query, parameters)
+        ]
+
+    def lookup(self, usr: str) -> dict or None:
+        """
+        Returns the symbol with a USR (keys: usr, kind, name, file, line, column, is_definition), or None.
+        """
+
+        row = self._connection.execute(
+            "SELECT * FROM symbols WHERE usr = ?", (usr,)
+        ).fetchone()
+        return row and self._symbol(row)
+
+    def find(self, name: str, kind: str = None) -> list:
+        """
+        Returns the symbols with a name (and kind, e.g. "STRUCT_DECL"), e.g. to find where a class is defined.
+        """
+
+        if kind is None:
+            return self._symbols(
+                "SELECT * FROM symbols WHERE name = ? ORDER BY file, line, column",
+                (name,),
+            )
+        return self._symbols(
+            "SELECT * FROM symbols WHERE name = ? AND kind = ? ORDER BY file, line, column",
+            (name, kind),
+        )
+
+    def declared_in(self, file: str) -> list:
+        """
+        Returns the symbols recorded in a file, e.g. a header's declarations.
+        """
+
+        return self._symbols(
+            "SELECT * FROM symbols WHERE file = ? ORDER BY line, column",
+            (utils.get_realpath(path=file),),
+        )
+
+    def bases(self, usr: str) -> list:
+        """
+        Returns the base classes of a class.
+        """
+
+        return self._symbols(
+            """
+            SELECT symbols.* FROM bases JOIN symbols ON symbols.usr = bases.base_usr
+            WHERE bases.usr = ? ORDER BY symbols.name
+            """,
+            (usr,),
+        )
+
+    def derived(self, usr: str) -> list:
+        """
+        Returns the classes directly derived from a class.
+        """
+
+        return self._symbols(
+            """
+            SELECT symbols.* FROM bases JOIN symbols ON symbols.usr = bases.usr
+            WHERE bases.base_usr = ? ORDER BY symbols.name
+            """,
+            (usr,),
+        )
+
+    def translation_units(self, usr: str) -> list:
+        """
+        Returns the sources whose translation units see a symbol.
+        """
+
+        return [
+            row["source"]
+            for row in self._connection.execute(
+                "SELECT source FROM symbol_references WHERE usr = ? ORDER BY source",
+                (usr,),
+            )
+        ]
+
+    def referenced_by(self, source: str) -> list:
+        """
+        Returns the symbols a source's translation unit sees.
+        """
+
+        return self._symbols(
+            """
+            SELECT symbols.* FROM symbol_references
+            JOIN symbols ON symbols.usr = symbol_references.usr
+            WHERE symbol_references.source = ? ORDER BY symbols.file, symbols.line
+            """,
+            (utils.get_realpath(path=source),),
+        )
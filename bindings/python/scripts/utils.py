@@ -1,6 +1,11 @@
 import os
 import json
+import hashlib
 import argparse
+import filecmp
+import tempfile
+import contextlib
+import concurrent.futures
 
 
 def get_realpath(path):
@@ -57,20 +62,231 @@ def get_output_path(source, output_dir, split_from, extension):
 
 
 def dump_json(filepath, info, indent=2, separators=None):
-    with open(filepath, "w") as f:
+    # Streamed to a temporary file, which only replaces the file if the contents changed
+    with open_if_changed(filepath=filepath) as f:
         json.dump(info, f, indent=indent, separators=separators)
 
 
+class JsonTreeWriter:
+    """
+    Writes a tree of nodes as JSON while it is being traversed.
+
+    How to use:
+        - writer = JsonTreeWriter(file)
+        - writer.begin_node(info) when entering a node, with all its keys except `members`
+        - writer.end_node() when leaving it, after all its children
+
+    - The output is byte-for-byte what `dump_json` writes for the complete tree, given each node's
+      `members` key comes last (as in `parsed_info`).
+    - Only one flag per open node is kept, so memory is bounded by the depth of the tree.
+    """
+
+    def __init__(self, file, indent=2):
+        self._file = file
+        self._indent = indent
+        self._open_nodes = []  # per open node: whether a member has been written yet
+
+    def _encode(self, value, level):
+        # `json.dumps` only emits newlines between elements, so shifting them indents nested values
+        encoded = json.dumps(value, indent=self._indent)
+        return encoded.replace("\n", "\n" + " " * (self._indent * level))
+
+    def begin_node(self, info):
+        write = self._file.write
+        # A node's dict is nested two levels (dict, `members` list) below its parent's
+        level = 2 * len(self._open_nodes)
+
+        if self._open_nodes:
+            newline = "\n" + " " * (self._indent * level)
+            write(("," if self._open_nodes[-1] else "[") + newline)
+            self._open_nodes[-1] = True
+
+        newline = "\n" + " " * (self._indent * (level + 1))
+        write("{")
+        for key, value in info.items():
+            write(f"{newline}{json.dumps(key)}: {self._encode(value, level + 1)},")
+        write(f'{newline}"members": ')
+
+        self._open_nodes.append(False)
+
+    def end_node(self):
+        has_members = self._open_nodes.pop()
+        level = 2 * len(self._open_nodes)
+
+        if has_members:
+            self._file.write("\n" + " " * (self._indent * (level + 1)) + "]")
+        else:
+            self._file.write("[]")
+        self._file.write("\n" + " " * (self._indent * level) + "}")
+
+
 def read_json(filename):
     with open(filename, "r") as f:
         return json.load(f)
 
 
+class FileDigests:
+    """
+    sha256 of files' contents, only rehashed when a file's modification time or size changes.
+
+    How to use:
+        - digests = FileDigests()
+        - digests.get(filepath): the digest, or None if the file doesn't exist
+    """
+
+    def __init__(self):
+        self._digests = {}  # filepath -> ((mtime, size), digest)
+
+    def get(self, filepath):
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._digests.get(filepath)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        with open(filepath, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        self._digests[filepath] = (signature, digest)
+        return digest
+
+
+def _new_file_mode(filepath):
+    """
+    Returns the permissions for a replacement of a file: the file's own if it exists, else what
+    `open` would create it with (`mkstemp` creates private files)
+    """
+
+    try:
+        return os.stat(filepath).st_mode & 0o777
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def write_atomic(filepath, data):
+    """
+    Writes bytes to a file via a temporary file and a rename, so readers never see a partial file
+
+    Arguments:
+        - filepath: The file to write
+        - data (bytes): The contents
+    """
+
+    dir = os.path.dirname(filepath) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=dir, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, _new_file_mode(filepath))
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def write_if_changed(filepath, data):
+    """
+    Writes bytes to a file (atomically, see `write_atomic`) unless it already has these contents
+
+    - An unchanged file keeps its mtime, so build systems (CMake, make) don't rebuild its dependents.
+
+    Arguments:
+        - filepath: The file to write
+        - data (bytes): The contents
+
+    Returns:
+        - written (bool): False if the file was left untouched
+    """
+
+    try:
+        if os.path.getsize(filepath) == len(data):
+            with open(filepath, "rb") as f:
+                if f.read() == data:
+                    return False
+    except OSError:
+        pass
+
+    write_atomic(filepath=filepath, data=data)
+    return True
+
+
+@contextlib.contextmanager
+def open_if_changed(filepath, mode="w"):
+    """
+    Opens a temporary file to write a file's new contents to, for outputs too big to hold in memory
+
+    - On success, the temporary file replaces the file (atomically) unless both have the same contents,
+      see `write_if_changed`. On error, the file is left as it was.
+
+    Arguments:
+        - filepath: The file to write
+        - mode: `w` (text) or `wb` (binary)
+    """
+
+    dir = os.path.dirname(filepath) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=dir, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        if os.path.exists(filepath) and filecmp.cmp(tmp_path, filepath, shallow=False):
+            os.remove(tmp_path)
+        else:
+            os.chmod(tmp_path, _new_file_mode(filepath))
+            os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 def write_to_file(filename, linelist):
-    with open(filename, "w") as f:
-        for line in linelist:
-            f.writelines(line)
-            f.writelines("\n")
+    write_if_changed(
+        filepath=filename, data="".join(f"{line}\n" for line in linelist).encode()
+    )
+
+
+def parallel_map(function, items, jobs=1, initializer=None):
+    """
+    Applies a function to every item, optionally in a process pool, yielding results in input order
+
+    Arguments:
+        - function: A picklable, module level function taking one item
+        - items: The items to process
+        - jobs: Number of worker processes; `1` runs everything in the current process
+        - initializer: Called once per worker process (or once in-process) before any item is processed
+
+    Yields:
+        - (item, result, error):
+            - result is the function's return value, or None if it raised
+            - error is the raised exception, or None on success
+            - Tuples are yielded as soon as the item and all items before it are done,
+              so the order never depends on which worker finishes first
+    """
+
+    items = list(items)
+
+    if jobs <= 1:
+        if initializer:
+            initializer()
+        for item in items:
+            try:
+                yield item, function(item), None
+            except Exception as error:
+                yield item, None, error
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs, initializer=initializer
+    ) as executor:
+        futures = [executor.submit(function, item) for item in items]
+        for item, future in zip(items, futures):
+            error = future.exception()
+            yield item, None if error else future.result(), error
 
 
 def parse_arguments(script):
@@ -96,16 +312,216 @@ def parse_arguments(script):
             default=get_parent_directory(file=__file__),
             help="Output path for generated json",
         )
-        parser.add_argument("files", nargs="+", help="The source files to parse")
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help="Number of files to parse in parallel (worker processes)",
+        )
+        parser.add_argument(
+            "--output_format",
+            choices=("json", "binary"),
+            default="json",
+            help="Format of the parsed output: indented json, or the compact binary format",
+        )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="Write the json while traversing the AST, instead of building it in memory first",
+        )
+        parser.add_argument(
+            "--fields",
+            default="full",
+            help="Traits to output per node: minimal, bindgen, full, or a comma separated list of fields",
+        )
+        parser.add_argument(
+            "--skip_function_bodies",
+            action="store_true",
+            help="Parse for bindings: skip function bodies and leave out statements and expressions",
+        )
+        parser.add_argument(
+            "--no_preprocessing",
+            action="store_true",
+            help="Don't output inclusion directives and macros",
+        )
+        parser.add_argument(
+            "--no_tokens",
+            action="store_true",
+            help="Don't output the tokens of the parsed files",
+        )
+        parser.add_argument(
+            "--cache_path",
+            default=None,
+            help="Directory for caching parse results across runs (disabled if not given)",
+        )
+        parser.add_argument(
+            "--ast_cache_path",
+            default=None,
+            help="Directory for saving parsed translation units (.ast) for reuse (disabled if not given)",
+        )
+        parser.add_argument(
+            "--cache_max_size",
+            type=float,
+            default=None,
+            help="Maximum size of each cache, in MB",
+        )
+        parser.add_argument(
+            "--cache_max_age",
+            type=float,
+            default=None,
+            help="Evict cache entries unused for this many days",
+        )
+        parser.add_argument(
+            "--symbol_index_path",
+            help="SQLite file of the project-wide symbol index to record declarations in",
+        )
+        parser.add_argument(
+            "--project",
+            action="store_true",
+            help="Parse every file in the compilation database, each project header's declarations once",
+        )
+        parser.add_argument(
+            "--watch",
+            action="store_true",
+            help="Keep running, re-emitting the output of the files whose sources or includes change",
+        )
+        parser.add_argument(
+            "--watch_interval",
+            type=float,
+            default=0.5,
+            help="Seconds between checks for changes, with --watch",
+        )
+        parser.add_argument(
+            "--pybind11_output_path",
+            help="With --watch, also regenerate the bindings under this path",
+        )
+        parser.add_argument("files", nargs="*", help="The source files to parse")
+
+    if script == "server":
+        parser = argparse.ArgumentParser(description="Local parse server")
+        parser.add_argument(
+            "--socket_path",
+            default=join_path(get_parent_directory(file=__file__), "parse.sock"),
+            help="Unix socket to listen on",
+        )
+        parser.add_argument(
+            "--compilation_database_path",
+            default=get_parent_directory(file=__file__),
+            help="Path to compilation database (json), for requests without one",
+        )
+        parser.add_argument(
+            "--max_translation_units",
+            type=int,
+            default=32,
+            help="Number of recently parsed TranslationUnits to keep in memory",
+        )
+
+    if script == "build":
+        parser = argparse.ArgumentParser(
+            description="Incremental parse, generate and compile of the bindings"
+        )
+        parser.add_argument(
+            "--compilation_database_path",
+            default=get_parent_directory(file=__file__),
+            help="Path to compilation database (json)",
+        )
+        parser.add_argument(
+            "--json_output_path",
+            default=get_parent_directory(file=__file__),
+            help="Output path for generated json",
+        )
+        parser.add_argument(
+            "--pybind11_output_path",
+            default=get_parent_directory(file=__file__),
+            help="Output path for generated cpp (and objects)",
+        )
+        parser.add_argument(
+            "--state_path",
+            help="File storing the fingerprints of the built outputs (default: under json_output_path)",
+        )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help="Number of outputs of a stage to build in parallel (worker processes)",
+        )
+        parser.add_argument(
+            "--compiler", default="c++", help="Compiler for the generated bindings"
+        )
+        parser.add_argument(
+            "--compile_flags",
+            default="",
+            help="Extra flags for the compiler, e.g. include directories",
+        )
+        parser.add_argument(
+            "--skip_compile",
+            action="store_true",
+            help="Stop after generating the bindings",
+        )
+        parser.add_argument(
+            "--config",
+            help="JSON file of per-function binding options, see generate.py's --config",
+        )
+        parser.add_argument(
+            "--fields",
+            default="full",
+            help="The traits to output for each node, see parse.py's --fields",
+        )
+        parser.add_argument(
+            "--skip_function_bodies",
+            action="store_true",
+            help="Skip function bodies, see parse.py's --skip_function_bodies",
+        )
+        parser.add_argument(
+            "--no_tokens",
+            action="store_true",
+            help="Don't output the TU's tokens",
+        )
+        parser.add_argument(
+            "files",
+            nargs="*",
+            help="The sources to build (default: all files in the compilation database)",
+        )
 
     if script == "generate":
         parser = argparse.ArgumentParser(description="JSON to pybind11 generation")
-        parser.add_argument("files", nargs="+", help="JSON input")
+        parser.add_argument(
+            "files", nargs="+", help="JSON (or binary format) parsed info input"
+        )
         parser.add_argument(
             "--pybind11_output_path",
             default=get_parent_directory(file=__file__),
             help="Output path for generated cpp",
         )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help="Number of files to generate in parallel (worker processes)",
+        )
+        parser.add_argument(
+            "--shards",
+            type=int,
+            default=1,
+            help="Split each file's bindings into up to this many files, compiled in parallel",
+        )
+        parser.add_argument(
+            "--lazy",
+            action="store_true",
+            help="Bind each file as a submodule, initialized on first use (module in pybind11-gen/pcl_module.cpp)",
+        )
+        parser.add_argument(
+            "--config",
+            help="JSON file of per-function binding options, e.g. releasing the GIL, see binding_config.py",
+        )
+        parser.add_argument(
+            "--kind",
+            help="Only bind declarations of this kind, e.g. STRUCT_DECL (binary format input)",
+        )
+        parser.add_argument(
+            "--name",
+            help="Only bind declarations with this name, e.g. PointXYZ (binary format input)",
+        )
 
     else:
         args = None
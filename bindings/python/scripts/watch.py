@@ -0,0 +1,139 @@
+import os
+import sys
+import time
+import clang.cindex as clang
+
+from context import scripts
+import scripts.utils as utils
+
+
+def get_mtime(filepath: str) -> int or None:
+    """
+    Returns a file's modification time in nanoseconds, or None if it doesn't exist
+    """
+
+    try:
+        return os.stat(filepath).st_mtime_ns
+    except OSError:
+        return None
+
+
+class Watcher:
+    """
+    Keeps TranslationUnits in memory and reparses them when their files change.
+
+    How to use:
+        - watcher = Watcher(parse_source=..., on_change=...)
+        - watcher.add(source) for each source to watch
+        - watcher.run() to poll until interrupted, or watcher.poll() for one check
+
+    - Each TranslationUnit is watched through its source and every file it includes.
+    - A change (modification, deletion) of any of them `reparse`s the TranslationUnit in place,
+      keeping the Index and the other TranslationUnits warm, then calls `on_change`.
+    - Files are polled by modification time: it works everywhere, without extra dependencies.
+    """
+
+    def __init__(self, parse_source, on_change, interval: float = 0.5) -> None:
+        """
+        Parameters:
+            - parse_source (function): Returns the TranslationUnit for a source, called once per source
+            - on_change (function):
+                - Called as `on_change(source, translation_unit)` after a source is parsed or reparsed
+            - interval (float): Seconds between two polls
+        """
+
+        self._parse_source = parse_source
+        self._on_change = on_change
+        self.interval = interval
+        self._translation_units = {}  # source -> TranslationUnit
+        self._dependencies = {}  # source -> {filepath: mtime}
+
+    def _record_dependencies(self, source: str, mtimes: dict = None) -> None:
+        """
+        Parameters:
+            - mtimes (dict): Modification times taken before parsing, so changes made while
+              parsing are picked up by the next poll
+        """
+
+        mtimes = mtimes or {}
+        filepaths = [source] + [
+            utils.get_realpath(path=inclusion.include.name)
+            for inclusion in self._translation_units[source].get_includes()
+        ]
+        self._dependencies[source] = {
+            filepath: mtimes[filepath] if filepath in mtimes else get_mtime(filepath)
+            for filepath in filepaths
+        }
+
+    def add(self, source: str) -> None:
+        """
+        Parses a source and starts watching it.
+        """
+
+        mtimes = {source: get_mtime(source)}
+        self._translation_units[source] = self._parse_source(source)
+        self._record_dependencies(source, mtimes=mtimes)
+        self._on_change(source, self._translation_units[source])
+
+    def changed(self) -> list:
+        """
+        Returns the watched sources with a changed dependency, in the order they were added.
+        """
+
+        mtimes = {}  # A header shared by many sources is only checked once
+        changed = []
+        for source, dependencies in self._dependencies.items():
+            for filepath, mtime in dependencies.items():
+                if filepath not in mtimes:
+                    mtimes[filepath] = get_mtime(filepath)
+                if mtimes[filepath] != mtime:
+                    changed.append(source)
+                    break
+        return changed
+
+    def poll(self) -> list:
+        """
+        Reparses the sources whose files changed since they were last parsed.
+
+        - A source failing to reparse, or whose `on_change` raises, is reported and retried on
+          its next change. The other sources are still processed.
+
+        Returns:
+            - reparsed (list): The reparsed sources
+        """
+
+        reparsed = []
+        for source in self.changed():
+            translation_unit = self._translation_units[source]
+            mtimes = {
+                filepath: get_mtime(filepath) for filepath in self._dependencies[source]
+            }
+            try:
+                translation_unit.reparse()
+            except clang.TranslationUnitLoadError as error:
+                print(f"Failed to reparse {source}: {error!r}", file=sys.stderr)
+                self._dependencies[source] = mtimes
+                continue
+
+            self._record_dependencies(source, mtimes=mtimes)
+            try:
+                self._on_change(source, translation_unit)
+            except Exception as error:
+                print(f"Failed to process {source}: {error!r}", file=sys.stderr)
+                continue
+            reparsed.append(source)
+
+        return reparsed
+
+    def run(self) -> None:
+        """
+        Polls for changes until interrupted (Ctrl+C).
+        """
+
+        try:
+            while True:
+                time.sleep(self.interval)
+                for source in self.poll():
+                    print(f"Updated {source}", file=sys.stderr)
+        except KeyboardInterrupt:
+            pass
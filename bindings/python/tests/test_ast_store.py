@@ -0,0 +1,83 @@
+from context import scripts
+import scripts.ast_store as ast_store
+import scripts.binary as binary
+import scripts.generate as generate
+import test_parse
+
+file_contents = """
+namespace pcl {
+    struct PointXY {
+        float x;
+        float y;
+    };
+    struct PointXYZ {
+        float x;
+        float y;
+        float z;
+        struct Inner {
+            int PointXYZ;
+        };
+    };
+}
+void AFunction(int firstParam);
+"""
+
+
+def get_store_path(tmp_path):
+    parsed_info = test_parse.get_parsed_info(
+        tmp_path=tmp_path, file_contents=file_contents
+    )
+    store_path = tmp_path / f"file{binary.EXTENSION}"
+    ast_store.dump_store(filepath=str(store_path), info=parsed_info)
+    return parsed_info, str(store_path)
+
+
+def test_read(tmp_path):
+    parsed_info, store_path = get_store_path(tmp_path)
+
+    with ast_store.AstStore(store_path) as store:
+        assert store.read() == parsed_info
+    # A store is a valid binary format file
+    assert binary.read_binary(filename=store_path) == parsed_info
+
+
+def test_find(tmp_path):
+    parsed_info, store_path = get_store_path(tmp_path)
+    namespace = parsed_info["members"][0]
+
+    with ast_store.AstStore(store_path) as store:
+        assert store.find(kind="STRUCT_DECL", name="PointXYZ") == [
+            namespace["members"][1]
+        ]
+        assert store.find(kind="FUNCTION_DECL") == [parsed_info["members"][1]]
+        assert [node["kind"] for node in store.find(name="PointXYZ")] == [
+            "STRUCT_DECL",
+            "FIELD_DECL",
+        ]
+        assert store.find(kind="STRUCT_DECL", name="NotThere") == []
+
+
+def test_extract(tmp_path):
+    parsed_info, store_path = get_store_path(tmp_path)
+    namespace = parsed_info["members"][0]
+
+    with ast_store.AstStore(store_path) as store:
+        extracted = store.extract(kind="STRUCT_DECL", name="PointXYZ")
+        # The inner FIELD_DECL is already part of the STRUCT_DECL's subtree
+        assert store.extract(name="PointXYZ") == extracted
+
+    assert extracted["name"] == parsed_info["name"]
+    assert [node["name"] for node in extracted["members"]] == ["pcl"]
+    assert extracted["members"][0]["members"] == [namespace["members"][1]]
+
+
+def test_generate_selected(tmp_path):
+    parsed_info, store_path = get_store_path(tmp_path)
+
+    selected = dict(parsed_info)
+    selected["members"] = [dict(parsed_info["members"][0])]
+    selected["members"][0]["members"] = [parsed_info["members"][0]["members"][1]]
+
+    assert generate.generate(
+        module_name="pcl", source=store_path, kind="STRUCT_DECL", name="PointXYZ"
+    ) == generate.generate(module_name="pcl", parsed_info=selected)
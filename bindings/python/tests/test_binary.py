@@ -0,0 +1,74 @@
+from context import scripts
+import scripts.binary as binary
+import scripts.generate as generate
+import scripts.utils as utils
+import test_parse
+
+
+def test_round_trip_values():
+    info = {
+        "depth": 0,
+        "line": -1,
+        "name": "ünïcode",
+        "flag": True,
+        "other_flag": False,
+        "nothing": None,
+        "ratio": 0.5,
+        "big": 2**70,
+        "tokens": ["a", "b", "a"],
+        "mixed": [1, "a", True, None, [2, {"nested": False}]],
+        "members": [{"depth": 1, "members": []}, {"depth": 1, "members": []}],
+    }
+
+    decoded = binary.loads(binary.dumps(info))
+
+    assert decoded == info
+    assert list(decoded) == list(info)
+    assert [type(value) for value in decoded.values()] == [
+        type(value) for value in info.values()
+    ]
+
+
+def test_round_trip_parsed_info(tmp_path):
+    file_contents = """
+    struct AStruct {
+        int aMember;
+        float anArray[4];
+        void aMethod() {}
+    };
+    """
+    parsed_info = test_parse.get_parsed_info(
+        tmp_path=tmp_path, file_contents=file_contents
+    )
+
+    json_path = tmp_path / "file.json"
+    binary_path = tmp_path / f"file{binary.EXTENSION}"
+    utils.dump_json(filepath=str(json_path), info=parsed_info)
+    binary.dump_binary(filepath=str(binary_path), info=parsed_info)
+
+    assert binary.read_binary(filename=str(binary_path)) == parsed_info
+    assert binary_path.stat().st_size * 5 < json_path.stat().st_size
+
+    # generate reads the binary format directly
+    assert generate.generate(module_name="pcl", source=str(binary_path)) == (
+        generate.generate(module_name="pcl", source=str(json_path))
+    )
+
+
+def test_many_nodes(tmp_path):
+    file_contents = "\n".join(
+        f"struct AStruct{index} {{ int aMember; float anArray[4]; "
+        f"int aMethod(int a) {{ return a + aMember * {index}; }} }};"
+        for index in range(100)
+    )
+    parsed_info = test_parse.get_parsed_info(
+        tmp_path=tmp_path, file_contents=file_contents
+    )
+    json_path = tmp_path / "file.json"
+    binary_path = tmp_path / f"file{binary.EXTENSION}"
+    utils.dump_json(filepath=str(json_path), info=parsed_info)
+    binary.dump_binary(filepath=str(binary_path), info=parsed_info)
+
+    # Words are wider than a byte, past 256 distinct values
+    assert binary.read_binary(filename=str(binary_path)) == parsed_info
+    assert binary_path.stat().st_size * 10 < json_path.stat().st_size
@@ -0,0 +1,46 @@
+import json
+import pytest
+
+from context import scripts
+from scripts.binding_config import BindingConfig
+
+
+def test_qualified_names_take_precedence(tmp_path):
+    config_path = tmp_path / "config.json"
+    config_path.write_text(
+        json.dumps(
+            {
+                "functions": {
+                    "compute": {"release_gil": True},
+                    "pcl::io::compute": {"release_gil": False},
+                }
+            }
+        )
+    )
+    config = BindingConfig.load(config_path=str(config_path))
+
+    assert config.release_gil(qualified_name="pcl::compute")
+    assert config.release_gil(qualified_name="compute")
+    assert not config.release_gil(qualified_name="pcl::io::compute")
+    # Functions missing from the configuration get the default
+    assert not config.release_gil(qualified_name="pcl::filter")
+    assert config.release_gil(qualified_name="pcl::filter", default=True)
+    assert not BindingConfig.load().release_gil(qualified_name="compute")
+
+
+def test_invalid_options():
+    with pytest.raises(ValueError, match="Unknown binding option"):
+        BindingConfig(functions={"compute": {"releasegil": True}})
+    with pytest.raises(ValueError, match="must be a bool"):
+        BindingConfig(functions={"compute": {"release_gil": "yes"}})
+
+
+def test_return_value_policy():
+    config = BindingConfig(
+        functions={"pcl::PointCloud::at": {"return_value_policy": "copy"}}
+    )
+    assert config.return_value_policy(qualified_name="pcl::PointCloud::at") == "copy"
+    assert config.return_value_policy(qualified_name="pcl::PointCloud::back") is None
+
+    with pytest.raises(ValueError, match="Unknown return value policy"):
+        BindingConfig(functions={"at": {"return_value_policy": "borrow"}})
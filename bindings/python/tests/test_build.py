@@ -0,0 +1,97 @@
+import os
+import sys
+
+from context import scripts
+from scripts.build import Builder, get_generator_files
+
+
+def touch(path, file_contents):
+    # Make sure the modification time changes, whatever the filesystem's resolution
+    mtime = os.stat(path).st_mtime_ns
+    path.write_text(file_contents)
+    os.utime(path, ns=(mtime + 10**9, mtime + 10**9))
+
+
+def get_builder(tmp_path):
+    source_dir = tmp_path / "pcl"
+    source_dir.mkdir(exist_ok=True)
+    commands = [
+        {
+            "directory": str(source_dir),
+            "command": f"/usr/bin/clang++ -std=c++14 {source_dir / name}",
+            "file": str(source_dir / name),
+        }
+        for name in ("first.cpp", "second.cpp")
+    ]
+    (tmp_path / "compile_commands.json").write_text(str(commands).replace("'", '"'))
+
+    # A stand-in compiler, writing an empty object file
+    compiler = tmp_path / "compiler"
+    compiler.write_text(
+        f"#!{sys.executable}\n"
+        "import sys\n"
+        "open(sys.argv[sys.argv.index('-o') + 1], 'w').close()\n"
+    )
+    compiler.chmod(0o755)
+
+    return Builder(
+        sources=[],
+        compilation_database_path=str(tmp_path),
+        json_output_path=str(tmp_path / "out"),
+        pybind11_output_path=str(tmp_path / "out"),
+        compiler=str(compiler),
+    )
+
+
+def test_only_stale_nodes_rerun(tmp_path):
+    source_dir = tmp_path / "pcl"
+    source_dir.mkdir()
+    (source_dir / "header.h").write_text("struct AStruct {\n    int aMember;\n};")
+    (source_dir / "first.cpp").write_text('#include "header.h"\nvoid first();')
+    (source_dir / "second.cpp").write_text("struct BStruct {};")
+    first, second = str(source_dir / "first.cpp"), str(source_dir / "second.cpp")
+
+    everything = [first, second]
+    assert get_builder(tmp_path).build() == {
+        "parse": everything,
+        "generate": everything,
+        "compile": everything,
+        "failed": [],
+    }
+    assert (tmp_path / "out" / "pybind11-gen" / "first.o").exists()
+
+    nothing = {"parse": [], "generate": [], "compile": [], "failed": []}
+    assert get_builder(tmp_path).build() == nothing
+
+    # The header's change doesn't change first.cpp's JSON: nothing downstream reruns
+    touch(source_dir / "header.h", "struct AStruct {\n    int anotherMember;\n};")
+    assert get_builder(tmp_path).build() == dict(nothing, parse=[first])
+
+    touch(source_dir / "second.cpp", "struct BStruct {};\nvoid second();")
+    assert get_builder(tmp_path).build() == {
+        "parse": [second],
+        "generate": [second],
+        "compile": [second],
+        "failed": [],
+    }
+
+    # BStruct's vector becomes opaque: the header every binding includes changes
+    touch(source_dir / "second.cpp", "struct BStruct {\n    int aMember;\n};")
+    assert get_builder(tmp_path).build() == {
+        "parse": [second],
+        "generate": [second],
+        "compile": everything,
+        "failed": [],
+    }
+
+    # Missing outputs are rebuilt
+    os.remove(tmp_path / "out" / "pybind11-gen" / "second.o")
+    assert get_builder(tmp_path).build() == dict(nothing, compile=[second])
+
+
+def test_generator_files_cover_its_imports():
+    # Modules changing the generated bindings invalidate them, not only generate.py
+    names = [os.path.basename(filepath) for filepath in get_generator_files()]
+    for name in ("generate.py", "binding_config.py", "binary.py", "ast_store.py"):
+        assert name in names
+    assert "build.py" not in names
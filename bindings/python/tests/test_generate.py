@@ -1,5 +1,12 @@
+import os
+import sys
+import pytest
+
 from context import scripts
 import scripts.generate as generate
+import scripts.parse as parse
+import scripts.utils as utils
+from scripts.binding_config import BindingConfig
 import test_parse
 
 
@@ -74,9 +81,10 @@ def get_expected_string(file_include, expected_module_code):
 
     # Get pybind11's intial lines in the form of a string
     initial_pybind_lines = "".join(generate.bind._initial_pybind_lines)
+    opaque_include = f"#include <{generate.OPAQUE_HEADER}>"
 
     expected_output = remove_whitespace(
-        file_include + initial_pybind_lines + expected_module_code
+        file_include + initial_pybind_lines + opaque_include + expected_module_code
     )
 
     return expected_output
@@ -144,14 +152,477 @@ def test_struct_with_members(tmp_path):
         tmp_path=tmp_path, cpp_code_block=cpp_code_block, module_name="pcl"
     )
 
+    # A POD struct's vectors are opaque, bound with the buffer protocol
     expected_module_code = """
     PYBIND11_MODULE(pcl, m){
         py::class_<AStruct>(m, "AStruct")
         .def(py::init<>())
         .def_readwrite("aMember", &AStruct::aMember);
+        PYBIND11_NUMPY_DTYPE(AStruct, aMember);
+        py::bind_vector<std::vector<AStruct>>(m, "AStructVector", py::buffer_protocol());
     }
     """
 
     assert output == get_expected_string(
         file_include=file_include, expected_module_code=expected_module_code
     )
+
+
+def test_struct_with_array_members(tmp_path):
+    cpp_code_block = """
+    struct AStruct {
+        float anArray[4];
+        union {
+            float aUnionArray[2];
+        };
+    };
+    """
+    file_include, output = generate_bindings(
+        tmp_path=tmp_path, cpp_code_block=cpp_code_block, module_name="pcl"
+    )
+
+    # Arrays are NumPy views of the struct's memory, based on the struct's object
+    for name in ("anArray", "aUnionArray"):
+        element_type = f"std::remove_all_extents_t<decltype(AStruct::{name})>"
+        getter = f"""
+        .def_property("{name}", [](py::object obj) {{
+            auto &o = obj.cast<AStruct &>();
+            return py::array_t<{element_type}>(
+                sizeof(AStruct::{name}) / sizeof({element_type}),
+                reinterpret_cast<{element_type} *>(&o.{name}), obj);
+        }}
+        """
+        setter_copy = f"""
+        std::copy_n(value.data(), value.size(), reinterpret_cast<{element_type} *>(&o.{name}));
+        """
+        assert remove_whitespace(getter) in output
+        assert remove_whitespace(setter_copy) in output
+
+
+def test_bindgen_fields_give_same_bindings(tmp_path):
+    cpp_code_block = """
+    struct AStruct {
+        int aMember;
+        float anArray[4];
+        AStruct(int aParameter) {}
+        void aMethod() {}
+    };
+    void AFunction(int firstParam, double secondParam);
+    """
+    source_path = tmp_path / "file.cpp"
+    source_path.write_text(cpp_code_block)
+    compilation_database_path = test_parse.create_compilation_database(
+        tmp_path=tmp_path, filepath=source_path
+    )
+
+    def bindings_with_fields(fields):
+        parsed_info = parse.parse_file(
+            source=str(source_path),
+            compilation_database_path=compilation_database_path,
+            fields=fields,
+        )
+        return generate.generate(module_name="pcl", parsed_info=parsed_info)
+
+    assert bindings_with_fields("bindgen") == bindings_with_fields("full")
+
+
+def test_parallel_main(tmp_path, monkeypatch, capsys):
+    json_dir = tmp_path / "json"
+    json_dir.mkdir()
+    sources = []
+    for name in ("first", "second", "third"):
+        parsed_info = test_parse.get_parsed_info(
+            tmp_path=tmp_path, file_contents=f"struct {name.title()} {{}};"
+        )
+        sources.append(json_dir / f"{name}.json")
+        utils.dump_json(filepath=str(sources[-1]), info=parsed_info)
+    (json_dir / "broken.json").write_text("{")
+
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["generate.py", "--jobs", "2", "--pybind11_output_path", str(tmp_path)]
+        + [str(json_dir / "broken.json")]
+        + [str(source) for source in sources],
+    )
+    with pytest.raises(SystemExit, match="1 of 4 files failed to generate"):
+        generate.main()
+
+    # Every other file is generated, failures are reported
+    assert "Failed to generate" in capsys.readouterr().err
+    for source in sources:
+        output = (tmp_path / "pybind11-gen" / f"{source.stem}.cpp").read_text()
+        assert output == "\n".join(
+            generate.generate(module_name="pcl", source=str(source)) + [""]
+        )
+
+
+def test_shards(tmp_path):
+    cpp_code_block = """
+    namespace pcl {
+        struct PointA {
+            float x;
+            float y;
+        };
+        struct PointB {
+            int z;
+        };
+        void addOne(int value);
+    }
+    struct Outside {
+        double w;
+    };
+    """
+    parsed_info = test_parse.get_parsed_info(
+        tmp_path=tmp_path, file_contents=cpp_code_block
+    )
+
+    module_lines, shard_lines = generate.generate_shards(
+        module_name="pcl", shard_name="file", shards=3, parsed_info=parsed_info
+    )
+
+    assert len(shard_lines) == 3
+    assert module_lines[-5:] == [
+        "PYBIND11_MODULE(pcl, m){",
+        "init_file_0(m);",
+        "init_file_1(m);",
+        "init_file_2(m);",
+        "}",
+    ]
+    # Namespaces become `using namespace` blocks, reopened in every shard
+    assert shard_lines[1][-11:] == [
+        "void init_file_1(py::module &m){",
+        "{using namespace pcl;",
+        'py::class_<PointB>(m, "PointB")',
+        ".def(py::init<>())",
+        '.def_readwrite("z", &PointB::z)',
+        ";",
+        "PYBIND11_NUMPY_DTYPE(PointB, z);",
+        'py::bind_vector<std::vector<PointB>>(m, "PointBVector", py::buffer_protocol());',
+        'm.def("addOne", &addOne ,"value"_a);',
+        "}",
+        "}",
+    ]
+
+    # Every statement of the unsharded bindings is in exactly one shard, in order
+    unsharded = generate.generate(module_name="pcl", parsed_info=parsed_info)
+    statements = [
+        line
+        for lines in shard_lines
+        for line in lines
+        if line.startswith(("py::class_", ".def", "m.def"))
+    ]
+    assert statements == [
+        line.replace("PYBIND11_MODULE(pcl, m){", "")
+        for line in unsharded
+        if line.startswith(("py::class_", ".def", "m.def", "PYBIND11_MODULE"))
+    ]
+
+    # Fewer statements than shards: no empty shards
+    _, shard_lines = generate.generate_shards(
+        module_name="pcl", shard_name="file", shards=20, parsed_info=parsed_info
+    )
+    assert len(shard_lines) == 10
+
+    # Opaque vectors are declared at global scope, in every shard
+    for index, lines in enumerate(shard_lines):
+        assert lines.index(f"#include <{generate.OPAQUE_HEADER}>") < (
+            lines.index(f"void init_file_{index}(py::module &m){{")
+        )
+    opaque_types = []
+    generate.generate_shards(
+        module_name="pcl",
+        shard_name="file",
+        shards=2,
+        parsed_info=parsed_info,
+        opaque_types=opaque_types,
+    )
+    assert [type_name for _, type_name in opaque_types] == [
+        "pcl::PointA",
+        "pcl::PointB",
+        "Outside",
+    ]
+
+
+def test_stale_shards_are_removed(tmp_path):
+    json_dir = tmp_path / "json"
+    json_dir.mkdir()
+    source = json_dir / "file.json"
+    parsed_info = test_parse.get_parsed_info(
+        tmp_path=tmp_path,
+        file_contents="struct A {}; struct B {}; struct C {};",
+    )
+    utils.dump_json(filepath=str(source), info=parsed_info)
+    output_dir = tmp_path / "pybind11-gen"
+
+    generate.generate_worker(
+        source=str(source), pybind11_output_path=str(tmp_path), shards=3
+    )
+    assert sorted(os.listdir(output_dir)) == [
+        "file.cpp",
+        "file_shard0.cpp",
+        "file_shard1.cpp",
+        "file_shard2.cpp",
+    ]
+
+    generate.generate_worker(
+        source=str(source), pybind11_output_path=str(tmp_path), shards=2
+    )
+    assert sorted(os.listdir(output_dir)) == [
+        "file.cpp",
+        "file_shard0.cpp",
+        "file_shard1.cpp",
+    ]
+
+    generate.generate_worker(source=str(source), pybind11_output_path=str(tmp_path))
+    assert os.listdir(output_dir) == ["file.cpp"]
+
+
+def test_lazy_main(tmp_path, monkeypatch):
+    json_dir = tmp_path / "json"
+    json_dir.mkdir()
+    for name, file_contents in (
+        ("base", "struct Base { int x; }; void reset(int value);"),
+        ("derived", "struct Base {}; struct Derived : public Base { int y; };"),
+    ):
+        parsed_info = test_parse.get_parsed_info(
+            tmp_path=tmp_path, file_contents=file_contents
+        )
+        utils.dump_json(filepath=str(json_dir / f"{name}.json"), info=parsed_info)
+
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["generate.py", "--lazy", "--pybind11_output_path", str(tmp_path)]
+        + [str(json_dir / "base.json"), str(json_dir / "derived.json")],
+    )
+    generate.main()
+
+    output_dir = tmp_path / "pybind11-gen"
+    assert sorted(os.listdir(output_dir)) == [
+        "base.cpp",
+        "base_shard0.cpp",
+        "derived.cpp",
+        "derived_shard0.cpp",
+        "pcl_module.cpp",
+        "pcl_opaque.h",
+        "pcl_opaque.json",
+    ]
+    # Each file defines a submodule's init function instead of a module
+    assert (output_dir / "base.cpp").read_text().splitlines()[-3:] == [
+        "void init_base(py::module &m){",
+        "init_base_0(m);",
+        "}",
+    ]
+
+    # The module only registers the submodules, with their names and dependencies
+    module_lines = (output_dir / "pcl_module.cpp").read_text().splitlines()
+    assert "PYBIND11_MODULE(pcl, m){" in module_lines
+    includes = [line for line in module_lines if line.startswith("#include")]
+    assert len(includes) == len(set(includes))
+    assert "#include <map>" in includes
+    assert not any(line.startswith("py::class_") for line in module_lines)
+    assert (
+        '{"base", {&init_base, {}, {"Base", "BaseVector", "reset"}}},' in module_lines
+    )
+    assert (
+        '{"derived", {&init_derived, {"base"}, {"Base", "Derived", "DerivedVector"}}},'
+        in module_lines
+    )
+
+
+def test_lazy_module_requires_unique_names():
+    submodules = [
+        {"name": "types", "init_function": f"init_{index}", "names": [], "bases": []}
+        for index in range(2)
+    ]
+    with pytest.raises(ValueError, match="aren't unique"):
+        generate.generate_lazy_module(module_name="pcl", submodules=submodules)
+
+
+def test_pod_vectors(tmp_path):
+    cpp_code_block = """
+    #include <cstdint>
+    namespace pcl {
+        struct PointXYZ {
+            union {
+                float data[4];
+                struct {
+                    float x;
+                    float y;
+                    float z;
+                };
+            };
+            std::uint32_t label;
+        };
+        struct Inner {
+            int i;
+        };
+        struct Outer {
+            Inner inner;
+        };
+        struct NotPod {
+            NotPod() {}
+            int i;
+        };
+    }
+    """
+    parsed_info = test_parse.get_parsed_info(
+        tmp_path=tmp_path, file_contents=cpp_code_block
+    )
+    opaque_types = []
+    lines = generate.generate(
+        module_name="pcl", parsed_info=parsed_info, opaque_types=opaque_types
+    )
+
+    # Union members don't overlap in the dtype: the member with the most fields is kept
+    assert "PYBIND11_NUMPY_DTYPE(PointXYZ, x, y, z, label);" in lines
+    assert [type_name for _, type_name in opaque_types] == [
+        "pcl::PointXYZ",
+        "pcl::Inner",
+    ]
+    # Only POD structs whose fields all have a NumPy dtype
+    assert [line for line in lines if line.startswith("py::bind_vector")] == [
+        'py::bind_vector<std::vector<PointXYZ>>(m, "PointXYZVector", py::buffer_protocol());',
+        'py::bind_vector<std::vector<Inner>>(m, "InnerVector", py::buffer_protocol());',
+    ]
+
+
+def test_opaque_header(tmp_path, monkeypatch):
+    json_dir = tmp_path / "json"
+    json_dir.mkdir()
+    # The vector is made opaque by the file binding the struct, and returned in another one
+    for name, file_contents in (
+        ("pcl/types.h", "namespace pcl { struct PointE { float x; }; }"),
+        (
+            "pcl/io.h",
+            '#include <vector>\n#include "types.h"\n'
+            "namespace pcl { std::vector<PointE> load(int count); }",
+        ),
+    ):
+        (tmp_path / "pcl").mkdir(exist_ok=True)
+        (tmp_path / name).write_text(file_contents)
+        parsed_info = parse.parse_file(
+            source=str(tmp_path / name),
+            compilation_database_path=test_parse.create_compilation_database(
+                tmp_path=tmp_path, filepath=tmp_path / name
+            ),
+        )
+        utils.dump_json(filepath=str(json_dir / f"{name[4:-2]}.json"), info=parsed_info)
+
+    output_dir = tmp_path / "pybind11-gen"
+    header_lines = [
+        "#pragma once",
+        "#include <pybind11/pybind11.h>",
+        "#include <vector>",
+        "#include <pcl/types.h>",
+        "PYBIND11_MAKE_OPAQUE(std::vector<pcl::PointE>)",
+    ]
+
+    # Generated together, or one file per run: the header has the types of all the files
+    for inputs in (["types.json", "io.json"], ["types.json"], ["io.json"]):
+        monkeypatch.setattr(
+            sys,
+            "argv",
+            ["generate.py", "--pybind11_output_path", str(tmp_path)]
+            + [str(json_dir / name) for name in inputs],
+        )
+        generate.main()
+        assert (
+            output_dir / generate.OPAQUE_HEADER
+        ).read_text().splitlines() == header_lines
+
+    # Every binding file sees the declaration, so `load` returns the opaque vector
+    for name in ("types.cpp", "io.cpp"):
+        lines = (output_dir / name).read_text().splitlines()
+        assert f"#include <{generate.OPAQUE_HEADER}>" in lines
+        assert not any(line.startswith("PYBIND11_MAKE_OPAQUE") for line in lines)
+
+    # The types of removed binding files are dropped
+    (output_dir / "types.cpp").unlink()
+    generate.main()
+    assert (output_dir / generate.OPAQUE_HEADER).read_text().splitlines() == (
+        header_lines[:3]
+    )
+
+
+def test_gil_release(tmp_path):
+    cpp_code_block = """
+    namespace pcl {
+        struct Later;
+        void early(Later &later);
+        struct Cloud {
+            void compute();
+            void resize();
+        };
+        void filter(const Cloud &input, Cloud &output);
+        void fill(Cloud &cloud, int value);
+        void nothing();
+        struct Later {};
+    }
+    """
+    parsed_info = test_parse.get_parsed_info(
+        tmp_path=tmp_path, file_contents=cpp_code_block
+    )
+    call_guard = ", py::call_guard<py::gil_scoped_release>()"
+
+    # By default, only functions taking nothing but references to bound classes,
+    # declared before or after the function
+    lines = generate.generate(module_name="pcl", parsed_info=parsed_info)
+    assert [line for line in lines if call_guard in line] == [
+        f'm.def("early", &early ,"later"_a{call_guard});',
+        f'm.def("filter", &filter ,"input"_a,"output"_a{call_guard});',
+    ]
+
+    config = BindingConfig(
+        functions={
+            "pcl::Cloud::compute": {"release_gil": True},
+            "pcl::filter": {"release_gil": False},
+            "fill": {"release_gil": True},
+        }
+    )
+    lines = generate.generate(module_name="pcl", parsed_info=parsed_info, config=config)
+    assert [line for line in lines if call_guard in line] == [
+        f'm.def("early", &early ,"later"_a{call_guard});',
+        f'.def("compute", py::overload_cast<>(&Cloud::compute){call_guard})',
+        f'm.def("fill", &fill ,"cloud"_a,"value"_a{call_guard});',
+    ]
+
+
+def test_return_value_policies(tmp_path):
+    cpp_code_block = """
+    #include <cstdint>
+    struct Inner {
+        int i;
+    };
+    struct Outer {
+        Inner &inner();
+        const Inner &constInner() const;
+        Inner copyInner() const;
+        float &x();
+        const std::uint8_t &label() const;
+        Inner &shared();
+    };
+    Inner &globalInner(int index);
+    """
+    parsed_info = test_parse.get_parsed_info(
+        tmp_path=tmp_path, file_contents=cpp_code_block
+    )
+    config = BindingConfig(
+        functions={
+            "Outer::shared": {"return_value_policy": "reference"},
+            "globalInner": {"return_value_policy": "reference"},
+        }
+    )
+    lines = generate.generate(module_name="pcl", parsed_info=parsed_info, config=config)
+
+    # Methods returning references to classes reference them instead of copying them
+    assert [line for line in lines if line.startswith(('.def("', 'm.def("'))] == [
+        '.def("inner", py::overload_cast<>(&Outer::inner), py::return_value_policy::reference_internal)',
+        '.def("constInner", py::overload_cast<>(&Outer::constInner, py::const_), py::return_value_policy::reference_internal)',
+        '.def("copyInner", py::overload_cast<>(&Outer::copyInner, py::const_))',
+        '.def("x", py::overload_cast<>(&Outer::x))',
+        '.def("label", py::overload_cast<>(&Outer::label, py::const_))',
+        '.def("shared", py::overload_cast<>(&Outer::shared), py::return_value_policy::reference)',
+        'm.def("globalInner", &globalInner ,"index"_a, py::return_value_policy::reference);',
+    ]
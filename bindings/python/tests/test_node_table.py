@@ -0,0 +1,89 @@
+from context import scripts
+import scripts.generate as generate
+import scripts.parse as parse
+from scripts.node_table import NodeTable, NodeView
+import test_parse
+
+file_contents = """
+struct BaseStruct {};
+struct AStruct : public BaseStruct {
+    int aMember;
+    float anArray[4];
+    AStruct(int aParameter) {}
+    void aMethod() {}
+};
+void AFunction(int firstParam, double secondParam);
+"""
+
+
+def test_round_trip(tmp_path):
+    parsed_info = test_parse.get_parsed_info(
+        tmp_path=tmp_path, file_contents=file_contents
+    )
+    table = NodeTable.from_parsed_info(parsed_info)
+
+    assert table.to_parsed_info() == parsed_info
+    assert list(table.root) == list(parsed_info)
+    assert table.root == parsed_info
+
+
+def test_node_view_is_dict_compatible(tmp_path):
+    parsed_info = test_parse.get_parsed_info(
+        tmp_path=tmp_path, file_contents=file_contents
+    )
+    table = NodeTable.from_parsed_info(parsed_info)
+
+    struct_decl = table.root["members"][1]
+    field_decl = struct_decl["members"][1]
+
+    assert isinstance(struct_decl, NodeView)
+    assert struct_decl["kind"] == "STRUCT_DECL"
+    assert struct_decl["name"] == "AStruct"
+    assert field_decl["element_type"] == "Int"
+    assert field_decl["is_definition"] is True
+    assert "result_type" not in field_decl
+    assert field_decl.get("result_type", "missing") == "missing"
+
+    # generate.bind works on views as it does on dicts
+    assert generate.generate(module_name="pcl", parsed_info=table.root) == (
+        generate.generate(module_name="pcl", parsed_info=parsed_info)
+    )
+
+
+def test_find(tmp_path):
+    parsed_info = test_parse.get_parsed_info(
+        tmp_path=tmp_path, file_contents=file_contents
+    )
+    table = NodeTable.from_parsed_info(parsed_info)
+
+    assert [node["name"] for node in table.find(kind="STRUCT_DECL")] == [
+        "BaseStruct",
+        "AStruct",
+    ]
+    (struct_decl,) = table.find(kind="STRUCT_DECL", name="AStruct")
+    assert struct_decl.to_parsed_info() == parsed_info["members"][1]
+    assert table.find(kind="NOT_A_KIND") == []
+
+
+def test_generate_node_table(tmp_path):
+    source_path = tmp_path / "file.cpp"
+    source_path.write_text(file_contents)
+    parsed_info = test_parse.get_parsed_info(
+        tmp_path=tmp_path, file_contents=file_contents
+    )
+
+    translation_unit = parse.parse_translation_unit(
+        source=str(source_path), compilation_commands=["-std=c++14"]
+    )
+    tokens, token_offsets = parse.tokenize(translation_unit)
+    table = parse.generate_node_table(
+        {
+            "cursor": translation_unit.cursor,
+            "filename": translation_unit.spelling,
+            "depth": 0,
+            "tokens": tokens,
+            "token_offsets": token_offsets,
+        }
+    )
+
+    assert table.root == parsed_info
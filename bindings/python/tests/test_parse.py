@@ -1,5 +1,15 @@
+import sys
+import inspect
+import functools
+
+import pytest
+import clang.cindex as clang
+
 from context import scripts
 import scripts.parse as parse
+import scripts.utils as utils
+from scripts.cache import AstCache, ParseCache, get_libclang_version
+from scripts.compilation_database import CompilationDatabase
 
 
 def create_compilation_database(tmp_path, filepath):
@@ -447,3 +457,352 @@ def test_default_delete_constructor(tmp_path):
     assert delete_constructor["name"] == "aClass"
     assert delete_constructor["result_type"] == "void"
     # no check available for deleted ctor analogous to `is_default_constructor`
+
+
+def test_parallel_parse_keeps_input_order(tmp_path):
+    sources = []
+    for name in ("first", "second", "third"):
+        source_path = tmp_path / f"{name}.cpp"
+        source_path.write_text(f"struct {name.capitalize()} {{}};")
+        sources.append(str(source_path))
+
+    create_compilation_database(tmp_path=tmp_path, filepath=tmp_path / "first.cpp")
+    results = list(
+        utils.parallel_map(
+            function=functools.partial(
+                parse.parse_worker, compilation_database_path=str(tmp_path)
+            ),
+            items=sources,
+            jobs=2,
+            initializer=parse.init_worker,
+        )
+    )
+
+    assert [source for source, _, _ in results] == sources
+    assert all(error is None for _, _, error in results)
+    assert [info["members"][0]["name"] for _, info, _ in results] == [
+        "First",
+        "Second",
+        "Third",
+    ]
+
+
+def test_compilation_database_lookup(tmp_path):
+    source_path = tmp_path / "point_types.cpp"
+    source_path.write_text("")
+    create_compilation_database(tmp_path=tmp_path, filepath=source_path)
+
+    database = CompilationDatabase.load(compilation_database_path=str(tmp_path))
+
+    assert database is CompilationDatabase.load(compilation_database_path=str(tmp_path))
+    assert str(source_path) in database
+    arguments = database.get_arguments(filename=str(source_path))
+    assert "-std=c++14" in arguments
+    # libclang infers the arguments of files without an entry, in the same directory or not
+    for header_path in [
+        tmp_path / "point_types.hpp",
+        tmp_path / "include" / "pcl" / "point_types.h",
+    ]:
+        header_arguments = database.get_arguments(filename=str(header_path))
+        assert "-std=c++14" in header_arguments
+        assert str(header_path) not in header_arguments
+
+
+def test_libclang_version_leaves_bindings_alone():
+    function = clang.conf.lib.clang_getClangVersion
+    prototype = (function.restype, function.argtypes, function.errcheck)
+
+    assert get_libclang_version().startswith("clang version")
+    assert (function.restype, function.argtypes, function.errcheck) == prototype
+
+
+def test_parse_cache(tmp_path):
+    header_path = tmp_path / "header.h"
+    header_path.write_text("struct AStruct {};")
+    source_path = tmp_path / "file.cpp"
+    source_path.write_text('#include "header.h"\nAStruct anInstance;')
+    compilation_database_path = create_compilation_database(
+        tmp_path=tmp_path, filepath=source_path
+    )
+    cache = ParseCache(cache_path=str(tmp_path / "cache"))
+
+    def parse_with_cache(index=None):
+        return parse.parse_file(
+            source=str(source_path),
+            compilation_database_path=compilation_database_path,
+            index=index,
+            cache=cache,
+        )
+
+    parsed_info = parse_with_cache()
+
+    # A hit never touches libclang, so an unusable index is fine
+    assert parse_with_cache(index=object()) == parsed_info
+
+    # Changing an included file invalidates the entry, so libclang is needed again
+    header_path.write_text("struct AStruct { int aMember; };")
+    with pytest.raises(Exception):
+        parse_with_cache(index=object())
+    assert parse_with_cache() == parsed_info
+    assert parse_with_cache(index=object()) == parsed_info
+
+    # Evicting everything means a miss
+    cache.max_size = 0
+    cache.prune()
+    with pytest.raises(Exception):
+        parse_with_cache(index=object())
+
+
+def test_ast_cache(tmp_path):
+    header_path = tmp_path / "header.h"
+    header_path.write_text("struct AStruct {};")
+    source_path = tmp_path / "file.cpp"
+    source_path.write_text('#include "header.h"\nAStruct anInstance;')
+    compilation_database_path = create_compilation_database(
+        tmp_path=tmp_path, filepath=source_path
+    )
+    ast_cache = AstCache(cache_path=str(tmp_path / "ast_cache"))
+    arguments = parse.get_compilation_commands(
+        compilation_database_path=compilation_database_path,
+        filename=str(source_path),
+    )
+
+    # The parse options parse_file uses by default
+    options = {"parse_options": clang.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD}
+
+    def parse_with_ast_cache():
+        return parse.parse_file(
+            source=str(source_path),
+            compilation_database_path=compilation_database_path,
+            ast_cache=ast_cache,
+        )
+
+    assert (
+        ast_cache.get(source=str(source_path), arguments=arguments, options=options)
+        is None
+    )
+    parsed_info = parse_with_ast_cache()
+    assert (
+        ast_cache.get(source=str(source_path), arguments=arguments, options=options)
+        is not None
+    )
+    assert parse_with_ast_cache() == parsed_info
+
+    # A saved TU is stale once an included file changes
+    header_path.write_text("struct AStruct { int aMember; };")
+    assert (
+        ast_cache.get(source=str(source_path), arguments=arguments, options=options)
+        is None
+    )
+    assert parse_with_ast_cache() == parsed_info
+
+
+def test_tokens(tmp_path):
+    file_contents = "struct AStruct { int aMember; };"
+    parsed_info = get_parsed_info(tmp_path=tmp_path, file_contents=file_contents)
+
+    tokens = parsed_info["tokens"]
+    struct_decl = parsed_info["members"][0]
+    field_decl = struct_decl["members"][0]
+
+    assert parsed_info["token_range"] == [0, len(tokens)]
+    # The tokens are stored once, nodes refer to them by [start, end) ranges
+    assert "tokens" not in struct_decl
+    start, end = struct_decl["token_range"]
+    assert tokens[start:end] == ["struct", "AStruct", "{", "int", "aMember", ";", "}"]
+    start, end = field_decl["token_range"]
+    assert tokens[start:end] == ["int", "aMember"]
+
+
+def test_without_tokens(tmp_path):
+    source_path = tmp_path / "file.cpp"
+    source_path.write_text("struct AStruct {};")
+
+    parsed_info = parse.parse_file(
+        source=str(source_path),
+        compilation_database_path=create_compilation_database(
+            tmp_path=tmp_path, filepath=source_path
+        ),
+        tokens=False,
+    )
+
+    assert "tokens" not in parsed_info
+    assert "token_range" not in parsed_info["members"][0]
+
+
+def test_deep_nesting_without_recursion(tmp_path):
+    nesting = 200
+    file_contents = "namespace a {" * nesting + "}" * nesting
+
+    recursion_limit = sys.getrecursionlimit()
+    # Less than the nesting depth, on top of the frames already in use
+    sys.setrecursionlimit(len(inspect.stack()) + 100)
+    try:
+        parsed_info = get_parsed_info(tmp_path=tmp_path, file_contents=file_contents)
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+
+    node = parsed_info
+    for depth in range(1, nesting + 1):
+        node = node["members"][0]
+        assert node["kind"] == "NAMESPACE"
+        assert node["depth"] == depth
+    assert node["members"] == []
+
+
+def test_streamed_json_matches_dump_json(tmp_path):
+    source_path = tmp_path / "file.cpp"
+    source_path.write_text("""
+        #include <ostream>
+        namespace a_namespace {
+        /// A brief comment with "quotes" and ünicode
+        struct AStruct {
+            int aMember[4];
+            AStruct(int aParameter) : aMember{aParameter} {}
+        };
+        void aFunction(const char *aString = "a\\nb");
+        }
+        """)
+    compilation_database_path = create_compilation_database(
+        tmp_path=tmp_path, filepath=source_path
+    )
+
+    parsed_info = parse.parse_file(
+        source=str(source_path), compilation_database_path=compilation_database_path
+    )
+    utils.dump_json(filepath=str(tmp_path / "dumped.json"), info=parsed_info)
+
+    assert (
+        parse.parse_file(
+            source=str(source_path),
+            compilation_database_path=compilation_database_path,
+            output_filepath=str(tmp_path / "streamed.json"),
+        )
+        is None
+    )
+    assert (tmp_path / "streamed.json").read_bytes() == (
+        tmp_path / "dumped.json"
+    ).read_bytes()
+
+
+def test_field_profiles(tmp_path):
+    source_path = tmp_path / "file.cpp"
+    source_path.write_text("struct AStruct { int aMember; };")
+    compilation_database_path = create_compilation_database(
+        tmp_path=tmp_path, filepath=source_path
+    )
+
+    def parse_with_fields(fields):
+        return parse.parse_file(
+            source=str(source_path),
+            compilation_database_path=compilation_database_path,
+            tokens=False,
+            fields=fields,
+        )
+
+    field_decl = parse_with_fields("minimal")["members"][0]["members"][0]
+    assert list(field_decl) == ["depth", "line", "column", "kind", "name", "members"]
+
+    field_decl = parse_with_fields("bindgen")["members"][0]["members"][0]
+    assert field_decl["element_type"] == "Int"
+    assert "is_definition" not in field_decl
+
+    # Custom lists keep the output order
+    field_decl = parse_with_fields(["type_is_pod", "name"])["members"][0]["members"][0]
+    assert list(field_decl) == ["depth", "name", "type_is_pod", "members"]
+
+    with pytest.raises(ValueError):
+        parse_with_fields("not_a_field")
+
+
+def test_skip_function_bodies(tmp_path):
+    source_path = tmp_path / "file.cpp"
+    source_path.write_text(
+        """
+        #include <ostream>
+        struct AStruct {
+            int aMember = 1;
+            int aMethod(int aParameter = 2) { return aParameter + aMember; }
+        };
+        """
+    )
+
+    parsed_info = parse.parse_file(
+        source=str(source_path),
+        compilation_database_path=create_compilation_database(
+            tmp_path=tmp_path, filepath=source_path
+        ),
+        skip_function_bodies=True,
+        preprocessing=False,
+    )
+
+    # No inclusion directive without the preprocessing record
+    struct_decl = parsed_info["members"][0]
+    assert struct_decl["kind"] == "STRUCT_DECL"
+
+    field_decl, cxx_method = struct_decl["members"]
+    assert field_decl["kind"] == "FIELD_DECL"
+    assert field_decl["members"] == []
+
+    # Only the parameter is left: no body, no default argument expression
+    assert cxx_method["kind"] == "CXX_METHOD"
+    assert [member["kind"] for member in cxx_method["members"]] == ["PARM_DECL"]
+    assert cxx_method["members"][0]["members"] == []
+
+
+def test_project_mode_emits_headers_once(tmp_path):
+    source_dir = tmp_path / "src"
+    external_dir = tmp_path / "external"
+    source_dir.mkdir()
+    external_dir.mkdir()
+    (external_dir / "external.h").write_text("struct External {};")
+    (source_dir / "point_types.h").write_text(
+        '#include "external.h"\nstruct PointXYZ {\n    float x;\n};'
+    )
+    (source_dir / "first.cpp").write_text('#include "point_types.h"\nvoid first();')
+    (source_dir / "second.cpp").write_text('#include "point_types.h"\nvoid second();')
+
+    commands = [
+        {
+            "directory": str(source_dir),
+            "command": f"/usr/bin/clang++ -std=c++14 -I{external_dir} {source_dir / name}",
+            "file": str(source_dir / name),
+        }
+        for name in ("second.cpp", "first.cpp")
+    ]
+    (tmp_path / "compile_commands.json").write_text(str(commands).replace("'", '"'))
+
+    results = list(
+        parse.parse_project(compilation_database_path=str(tmp_path), tokens=False)
+    )
+
+    # Sorted sources, the first one including the header owns it; external headers are left out
+    assert [filepath for filepath, _ in results] == [
+        str(source_dir / "first.cpp"),
+        str(source_dir / "point_types.h"),
+        str(source_dir / "second.cpp"),
+    ]
+    first, header, second = [parsed_info for _, parsed_info in results]
+    assert [member["name"] for member in first["members"]] == [
+        "point_types.h",
+        "first",
+    ]
+    assert header["name"].endswith("point_types.h")
+    assert [member["name"] for member in header["members"]] == [
+        "external.h",
+        "PointXYZ",
+    ]
+    assert [member["name"] for member in second["members"]] == [
+        "point_types.h",
+        "second",
+    ]
+
+
+@pytest.mark.parametrize(
+    "option", (["--jobs", "2"], ["--symbol_index_path", "symbols.db"])
+)
+def test_project_mode_rejects_unsupported_options(monkeypatch, option):
+    monkeypatch.setattr(sys, "argv", ["parse.py", "--project"] + option)
+
+    with pytest.raises(SystemExit, match="without --jobs"):
+        parse.main()
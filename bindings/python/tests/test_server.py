@@ -0,0 +1,82 @@
+import os
+import threading
+
+from context import scripts
+import scripts.generate as generate
+import scripts.parse as parse
+from scripts.server import ParseClient, ParseServer
+import test_parse
+
+file_contents = """
+struct AStruct {
+    int aMember;
+};
+"""
+
+
+def test_server_matches_in_process(tmp_path):
+    source_path = tmp_path / "file.cpp"
+    source_path.write_text(file_contents)
+    compilation_database_path = test_parse.create_compilation_database(
+        tmp_path=tmp_path, filepath=source_path
+    )
+    expected = parse.parse_file(
+        source=str(source_path), compilation_database_path=compilation_database_path
+    )
+
+    socket_path = str(tmp_path / "parse.sock")
+    server = ParseServer(
+        socket_path=socket_path, compilation_database_path=compilation_database_path
+    )
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        with ParseClient(socket_path) as client:
+            assert client.parse_file(source=str(source_path)) == expected
+            # The second request reuses the warm TranslationUnit and its parsed_info
+            assert client.parse_file(source=str(source_path)) == expected
+            assert server.pool.hits == 1
+            assert server.cache_hits == 1
+            # Other traversal options of the same TranslationUnit aren't cached yet
+            assert client.parse_file(source=str(source_path), tokens=False) == (
+                parse.parse_file(
+                    source=str(source_path),
+                    compilation_database_path=compilation_database_path,
+                    tokens=False,
+                )
+            )
+            assert (server.pool.hits, server.cache_hits) == (2, 1)
+
+            # A changed file is reparsed, and traversed again
+            mtime = os.stat(source_path).st_mtime_ns
+            source_path.write_text("struct BStruct {};")
+            os.utime(source_path, ns=(mtime + 10**9, mtime + 10**9))
+            assert client.parse_file(source=str(source_path)) == parse.parse_file(
+                source=str(source_path),
+                compilation_database_path=compilation_database_path,
+            )
+            assert (server.pool.reparses, server.cache_hits) == (1, 1)
+
+            assert client.generate(module_name="pcl", parsed_info=expected) == (
+                generate.generate(module_name="pcl", parsed_info=expected)
+            )
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_client_falls_back_to_in_process(tmp_path):
+    source_path = tmp_path / "file.cpp"
+    source_path.write_text(file_contents)
+    compilation_database_path = test_parse.create_compilation_database(
+        tmp_path=tmp_path, filepath=source_path
+    )
+
+    with ParseClient(str(tmp_path / "no_server.sock")) as client:
+        assert not client.connected()
+        assert client.parse_file(
+            source=str(source_path), compilation_database_path=compilation_database_path
+        ) == parse.parse_file(
+            source=str(source_path), compilation_database_path=compilation_database_path
+        )
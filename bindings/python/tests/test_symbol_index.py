@@ -0,0 +1,126 @@
+import clang.cindex as clang
+
+from context import scripts
+import scripts.parse as parse
+from scripts.symbol_index import SymbolIndex
+
+header_contents = """
+namespace pcl {
+    struct PointXYZ {
+        float x;
+    };
+    struct PointXYZRGB : public PointXYZ {
+        int rgb;
+    };
+}
+"""
+
+
+def parse_source(tmp_path, filename, file_contents):
+    source_path = tmp_path / filename
+    source_path.write_text(file_contents)
+    return parse.parse_translation_unit(
+        source=str(source_path), compilation_commands=["-std=c++14"]
+    )
+
+
+def get_symbol_index(tmp_path):
+    (tmp_path / "point_types.h").write_text(header_contents)
+    symbol_index = SymbolIndex(index_path=str(tmp_path / "symbols.db"))
+    for filename, file_contents in (
+        ("first.cpp", '#include "point_types.h"\nvoid first(pcl::PointXYZ p);'),
+        ("second.cpp", '#include "point_types.h"\nnamespace pcl { void second(); }'),
+    ):
+        symbol_index.add_translation_unit(
+            translation_unit=parse_source(tmp_path, filename, file_contents)
+        )
+    return symbol_index
+
+
+def test_declarations_recorded_once(tmp_path):
+    with get_symbol_index(tmp_path) as symbol_index:
+        (point,) = symbol_index.find(name="PointXYZ", kind="STRUCT_DECL")
+
+        assert point["file"] == str(tmp_path / "point_types.h")
+        assert point["line"] == 3
+        assert point["is_definition"] is True
+        assert symbol_index.lookup(point["usr"]) == point
+        assert [
+            symbol["name"] for symbol in symbol_index.declared_in(point["file"])
+        ] == [
+            "pcl",
+            "PointXYZ",
+            "x",
+            "PointXYZRGB",
+            "rgb",
+        ]
+
+        # Both translation units see the header's declarations
+        assert symbol_index.translation_units(point["usr"]) == [
+            str(tmp_path / "first.cpp"),
+            str(tmp_path / "second.cpp"),
+        ]
+        # A namespace's declarations from several files are all recorded
+        assert [symbol["name"] for symbol in symbol_index.find(name="second")] == [
+            "second"
+        ]
+        assert str(tmp_path / "first.cpp") in symbol_index
+        assert str(tmp_path / "other.cpp") not in symbol_index
+
+
+def test_bases(tmp_path):
+    with get_symbol_index(tmp_path) as symbol_index:
+        (point,) = symbol_index.find(name="PointXYZ")
+        (point_rgb,) = symbol_index.find(name="PointXYZRGB")
+
+        assert symbol_index.bases(point_rgb["usr"]) == [point]
+        assert symbol_index.derived(point["usr"]) == [point_rgb]
+
+
+def test_reindex_replaces_references(tmp_path):
+    with get_symbol_index(tmp_path) as symbol_index:
+        symbol_index.add_translation_unit(
+            translation_unit=parse_source(tmp_path, "first.cpp", "void first();")
+        )
+        (point,) = symbol_index.find(name="PointXYZ")
+
+        assert symbol_index.translation_units(point["usr"]) == [
+            str(tmp_path / "second.cpp")
+        ]
+        assert [
+            symbol["name"]
+            for symbol in symbol_index.referenced_by(str(tmp_path / "first.cpp"))
+        ] == ["first"]
+
+
+def test_reindex_changed_header(tmp_path):
+    with get_symbol_index(tmp_path) as symbol_index:
+        (tmp_path / "point_types.h").write_text(
+            "\n\nnamespace pcl {\n    struct PointXYZ {\n        float y;\n    };\n}\n"
+        )
+        symbol_index.add_translation_unit(
+            translation_unit=parse_source(
+                tmp_path, "first.cpp", '#include "point_types.h"\nvoid first();'
+            )
+        )
+
+        # The header's declarations are replaced: moved, removed and added ones
+        (point,) = symbol_index.find(name="PointXYZ")
+        assert point["line"] == 4
+        assert [
+            symbol["name"]
+            for symbol in symbol_index.declared_in(str(tmp_path / "point_types.h"))
+        ] == ["pcl", "PointXYZ", "y"]
+        assert symbol_index.find(name="PointXYZRGB") == []
+        assert symbol_index.derived(point["usr"]) == []
+
+        # An unchanged header isn't traversed again, but is still referenced
+        symbol_index.add_translation_unit(
+            translation_unit=parse_source(
+                tmp_path, "second.cpp", '#include "point_types.h"\nvoid second();'
+            )
+        )
+        assert symbol_index.translation_units(point["usr"]) == [
+            str(tmp_path / "first.cpp"),
+            str(tmp_path / "second.cpp"),
+        ]
@@ -0,0 +1,75 @@
+import os
+import stat
+
+from context import scripts
+import scripts.utils as utils
+
+
+def set_old_mtime(path):
+    os.utime(path, ns=(10**9, 10**9))
+
+
+def test_unchanged_files_are_not_rewritten(tmp_path):
+    json_path = tmp_path / "file.json"
+    cpp_path = tmp_path / "file.cpp"
+    utils.dump_json(filepath=str(json_path), info={"name": "file", "members": []})
+    utils.write_to_file(filename=str(cpp_path), linelist=["#include <file>", "}"])
+    assert cpp_path.read_text() == "#include <file>\n}\n"
+    set_old_mtime(json_path)
+    set_old_mtime(cpp_path)
+
+    utils.dump_json(filepath=str(json_path), info={"name": "file", "members": []})
+    utils.write_to_file(filename=str(cpp_path), linelist=["#include <file>", "}"])
+    assert json_path.stat().st_mtime_ns == 10**9
+    assert cpp_path.stat().st_mtime_ns == 10**9
+
+    utils.write_to_file(filename=str(cpp_path), linelist=["#include <other>", "}"])
+    assert cpp_path.stat().st_mtime_ns != 10**9
+    assert cpp_path.read_text() == "#include <other>\n}\n"
+    # Only the target is left, no temporary files
+    assert sorted(os.listdir(tmp_path)) == ["file.cpp", "file.json"]
+
+
+def test_open_if_changed(tmp_path):
+    path = tmp_path / "file.json"
+    with utils.open_if_changed(str(path)) as f:
+        f.write("{}")
+    set_old_mtime(path)
+
+    with utils.open_if_changed(str(path)) as f:
+        f.write("{}")
+    assert path.stat().st_mtime_ns == 10**9
+
+    try:
+        with utils.open_if_changed(str(path)) as f:
+            f.write("{partial")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert path.read_text() == "{}"
+    assert os.listdir(tmp_path) == ["file.json"]
+
+
+def test_written_files_keep_usual_permissions(tmp_path):
+    path = tmp_path / "file.cpp"
+    utils.write_to_file(filename=str(path), linelist=["a"])
+    umask = os.umask(0)
+    os.umask(umask)
+    assert stat.S_IMODE(path.stat().st_mode) == 0o666 & ~umask
+
+    path.chmod(0o640)
+    utils.write_to_file(filename=str(path), linelist=["b"])
+    assert stat.S_IMODE(path.stat().st_mode) == 0o640
+
+
+def test_file_digests(tmp_path):
+    path = tmp_path / "file"
+    digests = utils.FileDigests()
+    assert digests.get(str(path)) is None
+
+    path.write_text("first")
+    first = digests.get(str(path))
+    assert first == digests.get(str(path))
+
+    path.write_text("second!")
+    assert digests.get(str(path)) not in (None, first)
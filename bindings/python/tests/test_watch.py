@@ -0,0 +1,94 @@
+import os
+
+from context import scripts
+import scripts.parse as parse
+from scripts.watch import Watcher
+
+
+def touch(path, file_contents):
+    # Make sure the modification time changes, whatever the filesystem's resolution
+    mtime = os.stat(path).st_mtime_ns
+    path.write_text(file_contents)
+    os.utime(path, ns=(mtime + 10**9, mtime + 10**9))
+
+
+def get_names(translation_unit):
+    return [
+        cursor.spelling
+        for cursor in translation_unit.cursor.get_children()
+        if cursor.kind.is_declaration()
+    ]
+
+
+def test_reparse_on_change(tmp_path):
+    header_path = tmp_path / "header.h"
+    source_path = tmp_path / "file.cpp"
+    other_path = tmp_path / "other.cpp"
+    header_path.write_text("struct AStruct {};")
+    source_path.write_text('#include "header.h"\nvoid aFunction();')
+    other_path.write_text("void otherFunction();")
+
+    emitted = []
+    watcher = Watcher(
+        parse_source=lambda source: parse.parse_translation_unit(
+            source=source, compilation_commands=["-std=c++14"], reparseable=True
+        ),
+        on_change=lambda source, translation_unit: emitted.append(
+            (source, get_names(translation_unit))
+        ),
+    )
+    watcher.add(str(source_path))
+    watcher.add(str(other_path))
+
+    assert emitted == [
+        (str(source_path), ["AStruct", "aFunction"]),
+        (str(other_path), ["otherFunction"]),
+    ]
+    assert watcher.poll() == []
+
+    # Only the sources depending on the changed file are reparsed
+    touch(header_path, "struct AStruct {};\nstruct BStruct {};")
+    assert watcher.poll() == [str(source_path)]
+    assert emitted[-1] == (str(source_path), ["AStruct", "BStruct", "aFunction"])
+
+    touch(other_path, "void otherFunction();\nvoid anotherFunction();")
+    assert watcher.poll() == [str(other_path)]
+    assert emitted[-1] == (str(other_path), ["otherFunction", "anotherFunction"])
+    assert watcher.poll() == []
+
+
+def test_failing_callback(tmp_path, capsys):
+    first_path = tmp_path / "first.cpp"
+    second_path = tmp_path / "second.cpp"
+    first_path.write_text("void first();")
+    second_path.write_text("void second();")
+
+    emitted = []
+
+    def on_change(source, translation_unit):
+        names = get_names(translation_unit)
+        if "broken" in names:
+            raise ValueError("Can't process broken")
+        emitted.append((source, names))
+
+    watcher = Watcher(
+        parse_source=lambda source: parse.parse_translation_unit(
+            source=source, compilation_commands=["-std=c++14"], reparseable=True
+        ),
+        on_change=on_change,
+    )
+    watcher.add(str(first_path))
+    watcher.add(str(second_path))
+
+    # The failure is reported, the other source is still processed
+    touch(first_path, "void broken();")
+    touch(second_path, "void second();\nvoid third();")
+    assert watcher.poll() == [str(second_path)]
+    assert emitted[-1] == (str(second_path), ["second", "third"])
+    assert "Failed to process" in capsys.readouterr().err
+
+    # Retried on the source's next change only
+    assert watcher.poll() == []
+    touch(first_path, "void fixed();")
+    assert watcher.poll() == [str(first_path)]
+    assert emitted[-1] == (str(first_path), ["fixed"])